@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class TweetsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tweets'
+
+    def ready(self):
+        from . import graph, signals  # noqa: F401
+
+        # Memory-mapped, so cheap; the graph is otherwise built on first use
+        graph.load_snapshot()
+
+        # Off by default: imports scikit-learn, slower than the rest of startup
+        if getattr(settings, 'RECOMMENDATIONS_WARM_UP', False):
+            from . import recommendations
+            recommendations.warm_up()
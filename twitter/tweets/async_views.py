@@ -0,0 +1,211 @@
+"""
+Async (ASGI) variants of the feed, user tweets and profile endpoints.
+
+DRF's generic views are synchronous, so these are plain Django async views
+that read through the async ORM and reuse the serializers (the lean ones
+with LEAN_TWEET_SERIALIZATION) and KeysetPagination to produce the same
+JSON as their synchronous counterparts. Everything the serializers need is
+loaded before they run, so rendering never touches the database from the
+event loop.
+
+Django's sync_to_async() runs every call on the one thread of the request
+by default, so calls made concurrently with asyncio.gather() still run one
+after the other. Independent blocking loads (cache lookups, queries) run
+with in_thread() instead, each on a worker thread of its own.
+
+Authentication accepts a simplejwt bearer token (the user is built from
+its claims, see tweets/tokens.py) or the session, and IsAuthenticated is
+the only permission check, as in the sync views.
+"""
+import asyncio
+import json
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from . import cards, comments, realtime, timeline
+from .models import Tweet, UserProfile, latest_comments_queryset
+from .pagination import KeysetPagination
+from .serializers import LeanTweetSerializer, ProfileSerializer, TweetSerializer
+from .tokens import ClaimsJWTAuthentication, claims_user
+from .visibility import VisibilityService
+
+
+def in_thread(function, *args):
+    """
+    Await `function(*args)` run on a worker thread, concurrently with other
+    in_thread() calls. It must not share objects with the request's thread;
+    its database connections are its own, closed after as a request would.
+    """
+    def call():
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+async def authenticate(request):
+    """Async counterpart of SessionAuthentication + ClaimsJWTAuthentication."""
+    jwt = ClaimsJWTAuthentication()
+    header = jwt.get_header(request)
+    raw_token = jwt.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return await request.auser()
+    # The revocation check may sync the denylist from the database
+    token = await sync_to_async(jwt.get_validated_token)(raw_token)
+    # The views only read, the user is made out of the claims
+    return claims_user(token)
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async replacement for APIView: authenticates, enforces
+    IsAuthenticated and turns API errors into JSON responses.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await authenticate(request)
+            if not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            request.user = user
+            self.request = Request(request, authenticators=())
+            self.request.user = user
+            return await super().dispatch(self.request, *args, **kwargs)
+        except Http404:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+        except exceptions.APIException as exc:
+            status = exc.status_code
+            if isinstance(exc, exceptions.NotAuthenticated):
+                # As DRF does when session authentication comes first, it has
+                # no WWW-Authenticate header to send with a 401
+                status = 403
+            return JsonResponse({'detail': exc.detail}, status=status)
+
+
+class AsyncTweetListView(AsyncAPIView):
+    """Base class: one keyset-paginated page of tweets, visible ones only."""
+    pagination_class = KeysetPagination
+    comments_preview = 3
+
+    def get_queryset(self):
+        """The unevaluated queryset of the tweets; it must not do any I/O."""
+        raise NotImplementedError
+
+    async def aget_queryset(self):
+        """get_queryset() for views that load something to build it."""
+        return self.get_queryset()
+
+    def load_visibility(self):
+        service = VisibilityService(self.request.user)
+        service.private_followee_ids  # load now, not from the event loop
+        return service
+
+    async def get(self, request, *args, **kwargs):
+        # The followee set and whatever the queryset needs come from the
+        # cache or the database independently
+        visibility, queryset = await asyncio.gather(in_thread(self.load_visibility), self.aget_queryset())
+        request._visibility_service = visibility
+        queryset = visibility.filter_tweets(queryset)
+        paginator = self.pagination_class()
+        if getattr(settings, 'LEAN_TWEET_SERIALIZATION', False):
+            data = await self.lean_page(paginator, LeanTweetSerializer.rows(queryset))
+        else:
+            data = await self.page(paginator, queryset.for_serializer().prefetch_related(None))
+        return JsonResponse(paginator.get_paginated_data(data))
+
+    async def lean_page(self, paginator, rows):
+        """The page as LeanTweetListMixin renders it, out of .values() rows."""
+        rows = await paginator.apaginate_queryset(rows, self.request, view=self)
+        # Comment previews and author cards of the page, independent lookups
+        previews, user_cards = await asyncio.gather(
+            in_thread(comments.previews, [row['id'] for row in rows]),
+            in_thread(cards.render_cards, {row['user_id'] for row in rows}, self.request),
+        )
+        context = {'request': self.request, 'view': self, 'user_cards': user_cards, 'comment_previews': previews}
+        return LeanTweetSerializer(rows, many=True, context=context).data
+
+    async def page(self, paginator, queryset):
+        tweets = await paginator.apaginate_queryset(queryset, self.request, view=self)
+        # Comment previews (on the request's thread) and author cards of the
+        # page, independent lookups
+        _, user_cards = await asyncio.gather(
+            self.attach_comment_previews(tweets),
+            in_thread(cards.render_cards, {tweet.user_id for tweet in tweets}, self.request),
+        )
+        context = {'request': self.request, 'view': self, 'user_cards': user_cards}
+        return TweetSerializer(tweets, many=True, context=context).data
+
+    async def attach_comment_previews(self, tweets):
+        previews = defaultdict(list)
+        latest = latest_comments_queryset(self.comments_preview).filter(tweet_id__in=[tweet.pk for tweet in tweets])
+        async for comment in latest:
+            previews[comment.tweet_id].append(comment)
+        for tweet in tweets:
+            tweet.latest_comments = previews[tweet.pk]
+
+
+class AsyncFollowingTweetsListView(AsyncTweetListView):
+    async def aget_queryset(self):
+        # Reads the celebrity list, and the timeline ids unless they are a
+        # subquery of the database backend
+        return await in_thread(timeline.home_timeline_queryset, self.request.user)
+
+
+class AsyncUserTweetsListView(AsyncTweetListView):
+    def get_queryset(self):
+        return Tweet.objects.filter(user=self.kwargs['user'])
+
+
+class AsyncUserProfileDetailView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        try:
+            profile = await UserProfile.objects.select_related('user').aget(pk=kwargs['pk'])
+        except UserProfile.DoesNotExist:
+            raise Http404
+        user_cards = await in_thread(cards.render_cards, [profile.user_id], request)
+        context = {'request': request, 'view': self, 'user_cards': user_cards}
+        return JsonResponse(ProfileSerializer(profile, context=context).data)
+
+
+class TimelineStreamView(AsyncAPIView):
+    """
+    Server-Sent Events stream of new tweet ids and like/comment counter
+    deltas for the authenticated user, see tweets/realtime.py. Each open
+    stream holds a worker under WSGI, so serve it from twitter/asgi.py.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        response = StreamingHttpResponse(self.events(request.user.pk), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def events(self, user_id):
+        broker = realtime.get_broker()
+        subscription = broker.subscribe(user_id)
+        heartbeat = getattr(settings, 'REALTIME_HEARTBEAT_SECONDS', 15)
+        coalesce = getattr(settings, 'REALTIME_COALESCE_MS', 250) / 1000
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    batch = await asyncio.wait_for(subscription.next_batch(coalesce), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                # Nothing new is taken from the subscription until the client
+                # has consumed this chunk; meanwhile events keep coalescing
+                yield ''.join(
+                    'event: %s\ndata: %s\n\n' % (event['type'], json.dumps(event)) for event in batch
+                )
+        finally:
+            broker.unsubscribe(subscription)
@@ -1,13 +1,92 @@
-from django.contrib.auth.backends import ModelBackend
+"""
+Login with either the username or the email address.
+
+One query looks the identifier up as both, the email case-insensitively
+through the LOWER(email) index of migration 0017. When it matches no user,
+the password is still hashed once, with the same hasher and work factor as
+a real check, so a miss takes as long as a wrong password and response times
+do not tell which identifiers exist. Misses are remembered for
+LOGIN_MISS_CACHE_SECONDS, so repeated attempts against unknown identifiers
+skip the query; saving or deleting any user forgets them all, see
+forget_misses().
+
+The hashing is what costs CPU under credential stuffing; the throttles in
+tweets/throttles.py limit how often the login view gets to do it.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db.models import Q, Value
+from django.db.models.functions import Lower
+
+MISS_KEY = 'auth:miss:%s:%s'
+GENERATION_KEY = 'auth:miss:generation'
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def candidates(identifier):
+    """The users `identifier` is the username or (in any case) the email of."""
+    UserModel = get_user_model()
+    return UserModel._default_manager.alias(email_lower=Lower('email')).filter(
+        Q(email_lower=Lower(Value(identifier))) | Q(username=identifier)
+    )
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _miss_key(identifier):
+    digest = hashlib.blake2b(identifier.encode(), digest_size=16).hexdigest()
+    return MISS_KEY % (_generation(), digest)
+
+
+def forget_misses():
+    """Drop all remembered misses, e.g. after a user was created or renamed."""
+    # A new generation instead of deleting every key; the old entries expire
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def find_user(identifier):
+    """
+    The user to check the password of: the one whose username it is, else
+    the only one whose email it is. None when there is no such user.
+    """
+    ttl = get_setting('LOGIN_MISS_CACHE_SECONDS', 60)
+    if ttl and cache.get(_miss_key(identifier)):
+        return None
+    users = list(candidates(identifier)[:3])
+    user = next((user for user in users if user.username == identifier), None)
+    if user is None and len(users) == 1:
+        user = users[0]
+    if user is None and not users and ttl:
+        cache.set(_miss_key(identifier), True, ttl)
+    return user
+
 
 class EmailOrUsernameModelBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
         UserModel = get_user_model()
-        try:
-            user = UserModel.objects.get(email=username)
-        except UserModel.DoesNotExist:
-            user = UserModel.objects.get(username=username)
-
-        if user.check_password(password):
-            return user
\ No newline at end of file
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = find_user(username)
+        if user is None:
+            # Hash anyway, so that unknown identifiers are not answered faster
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,15 @@
+"""
+Benchmark and load-test helpers, driven by the management commands in
+tweets/management/commands.
+"""
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Nearest-rank percentiles of `samples`, as {'p50': ..., ...}."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'p%d' % point: None for point in points}
+    return {
+        'p%d' % point: ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))]
+        for point in points
+    }
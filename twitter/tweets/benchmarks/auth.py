@@ -0,0 +1,105 @@
+"""
+Per-request cost of authentication.
+
+A view that only returns request.user.pk is called through the session and
+authentication middleware, authenticated in turn by
+
+* session     - a session cookie, SessionAuthentication (session row + user row)
+* jwt         - a bearer token, simplejwt's JWTAuthentication (user row)
+* claims      - a bearer token, ClaimsJWTAuthentication (no query)
+* claims_write - the same with a POST, which loads the user
+
+and the time and queries per request are recorded, so the difference between
+two methods is what authenticating costs a request.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from tweets.models import UserProfile
+from tweets.serializers import ClaimsTokenObtainPairSerializer
+from tweets.tokens import ClaimsJWTAuthentication
+
+from . import percentiles
+
+
+class WhoAmIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({'id': request.user.pk})
+
+    def post(self, request):
+        return Response({'id': request.user.pk})
+
+
+# name -> (authentication class, request method, credentials)
+METHODS = {
+    'session': (SessionAuthentication, 'get', 'session'),
+    'jwt': (JWTAuthentication, 'get', 'token'),
+    'claims': (ClaimsJWTAuthentication, 'get', 'token'),
+    'claims_write': (ClaimsJWTAuthentication, 'post', 'token'),
+}
+
+
+def make_user():
+    user = User.objects.create_user('auth-benchmark', 'auth-benchmark@example.com', 'password')
+    UserProfile.objects.create(user=user)
+    return user
+
+
+def session_key(user):
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+def run_method(name, user, requests):
+    authentication_class, method, credentials = METHODS[name]
+    view = WhoAmIView.as_view(authentication_classes=[authentication_class])
+    handler = SessionMiddleware(AuthenticationMiddleware(view))
+    factory = RequestFactory()
+    headers = {}
+    if credentials == 'token':
+        headers['HTTP_AUTHORIZATION'] = 'Bearer %s' % ClaimsTokenObtainPairSerializer.get_token(user).access_token
+    cookie = session_key(user) if credentials == 'session' else None
+    samples, queries = [], 0
+    for _ in range(requests):
+        request = getattr(factory, method)('/whoami/', **headers)
+        if cookie is not None:
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = cookie
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = handler(request)
+            response.render()
+            samples.append((time.perf_counter() - start) * 1e6)
+        if response.status_code != 200:
+            raise RuntimeError('%s: status %d' % (name, response.status_code))
+        queries += len(captured)
+    # The first request of a token method builds the revocation filter
+    samples = samples[1:]
+    result = {'requests': requests, 'queries_mean': queries / requests}
+    result.update({key + '_us': value for key, value in percentiles(samples).items()})
+    return result
+
+
+def run(names=None, requests=2000):
+    """Benchmark the named methods (all by default) on the current database."""
+    user = make_user()
+    return {name: run_method(name, user, requests) for name in names or METHODS}
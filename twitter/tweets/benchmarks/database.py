@@ -0,0 +1,136 @@
+"""
+Database configurations under concurrent writes.
+
+Threads run a mix of like toggles and home feed reads against a dataset
+from datagen.generate(), each operation between the connection handling of
+a request (close_old_connections() before and after, so CONN_MAX_AGE and
+pooling behave as they do in production). Every configuration in
+configurations() gets its own test database and the same workload; the
+result per operation is its throughput, latency percentiles and the number
+of failures, e.g. "database is locked".
+"""
+import random
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, close_old_connections, connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tweets import timeline, toggles
+from tweets.models import Tweet
+from tweets.visibility import VisibilityService
+
+from . import datagen, percentiles
+
+
+def configurations():
+    """{name: overrides of the default database settings} to compare on this vendor."""
+    configured = {key: connection.settings_dict.get(key) for key in ('OPTIONS', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+    if connection.vendor == 'sqlite':
+        return {
+            # Django's defaults, as this project used them before
+            'rollback-journal': {'OPTIONS': {}},
+            'configured': configured,
+        }
+    options = {key: value for key, value in configured['OPTIONS'].items() if key != 'pool'}
+    result = {
+        'per-request': {'OPTIONS': options, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+        'persistent': {'OPTIONS': options, 'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True},
+    }
+    if connection.vendor == 'postgresql':
+        try:
+            import psycopg_pool  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            result['pool'] = {'OPTIONS': dict(options, pool=True), 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False}
+    return result
+
+
+def like(rng, user_ids, tweet_ids):
+    toggles.likes.toggle(rng.choice(user_ids), rng.choice(tweet_ids))
+
+
+def read_feed(rng, user_ids, tweet_ids):
+    user = User(pk=rng.choice(user_ids))
+    tweets = VisibilityService(user).filter_tweets(timeline.home_timeline_queryset(user)).for_serializer()
+    list(tweets[:20])
+
+
+OPERATIONS = {'like': like, 'feed': read_feed}
+
+
+def run_workload(threads, seconds, write_ratio=0.5, seed=0):
+    """Run the mix from `threads` threads for `seconds`; returns results per operation."""
+    user_ids = list(Tweet.objects.values_list('user_id', flat=True).distinct())
+    tweet_ids = list(Tweet.objects.values_list('id', flat=True))
+    samples = {name: [] for name in OPERATIONS}
+    errors = {name: 0 for name in OPERATIONS}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        try:
+            while time.perf_counter() < deadline:
+                name = 'like' if rng.random() < write_ratio else 'feed'
+                close_old_connections()
+                start = time.perf_counter()
+                try:
+                    OPERATIONS[name](rng, user_ids, tweet_ids)
+                except DatabaseError:
+                    with lock:
+                        errors[name] += 1
+                    continue
+                finally:
+                    close_old_connections()
+                with lock:
+                    samples[name].append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    results = {}
+    for name in OPERATIONS:
+        result = {'operations': len(samples[name]), 'errors': errors[name], 'per_second': len(samples[name]) / seconds}
+        result.update({key + '_ms': value for key, value in percentiles(samples[name]).items()})
+        results[name] = result
+    return results
+
+
+def run(names=None, users=300, threads=8, seconds=5, write_ratio=0.5, seed=0):
+    """Benchmark each configuration in a test database of its own."""
+    available = configurations()
+    settings_dict = connection.settings_dict
+    saved = {key: settings_dict.get(key) for key in ('OPTIONS', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+    saved_test = dict(settings_dict.get('TEST') or {})
+    results = {}
+    setup_test_environment()
+    try:
+        for name in names or available:
+            # The settings dict is shared by the connections of every thread
+            settings_dict.update(available[name])
+            with tempfile.TemporaryDirectory() as directory:
+                if connection.vendor == 'sqlite':
+                    # WAL and locking only apply to a database file
+                    settings_dict['TEST'] = dict(saved_test, NAME='%s/benchmark.sqlite3' % directory)
+                connection.close()
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    datagen.generate(users=users, tweets_per_user=5, follows_per_user=20, seed=seed)
+                    connection.close()
+                    results[name] = run_workload(threads, seconds, write_ratio, seed)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+                    settings_dict['TEST'] = saved_test
+    finally:
+        settings_dict.update(saved)
+        teardown_test_environment()
+    return results
@@ -0,0 +1,87 @@
+"""
+Synthetic dataset for the benchmarks: users (some private), a power-law
+follow graph, tweets, likes and comments, written with bulk_create. The
+derived data (counters, timelines, similarity index) is built afterwards
+the same way the management commands would.
+"""
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from tweets import counters, recommendations, timeline
+from tweets.models import Comment, Follow, Like, Tweet, UserProfile
+
+WORDS = (
+    'python django tweet timeline cache index query latency feed follow like '
+    'comment search graph async stream cursor page count signal profile image '
+    'worker queue batch shard replica token json render compress benchmark'
+).split()
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def generate(users=1000, tweets_per_user=5, follows_per_user=20, likes_per_user=20,
+             comments_per_user=5, private_ratio=0.1, seed=0, batch_size=2000):
+    """Populate the database and return the number of rows created per model."""
+    rng = random.Random(seed)
+    password = make_password('password')
+
+    User.objects.bulk_create(
+        [User(username='bench%d' % i, email='bench%d@example.com' % i, password=password) for i in range(users)],
+        batch_size=batch_size,
+    )
+    user_ids = list(User.objects.filter(username__startswith='bench').order_by('id').values_list('id', flat=True))
+    private = {user_id for user_id in user_ids if rng.random() < private_ratio}
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user_id, is_public=user_id not in private) for user_id in user_ids],
+        batch_size=batch_size,
+    )
+
+    # Preferential attachment: a few accounts collect most of the followers
+    popularity = [rng.paretovariate(1.2) for _ in user_ids]
+    follows = []
+    for follower_id in user_ids:
+        count = min(len(user_ids) - 1, int(rng.expovariate(1 / follows_per_user)) + 1)
+        followees = set(rng.choices(user_ids, weights=popularity, k=count))
+        followees.discard(follower_id)
+        for following_id in followees:
+            pending = following_id in private and rng.random() < 0.3
+            follows.append(Follow(follower_id=follower_id, following_id=following_id, is_accepted=not pending))
+    Follow.objects.bulk_create(follows, batch_size=batch_size)
+
+    Tweet.objects.bulk_create(
+        [Tweet(user_id=user_id, content=sentence(rng, rng.randint(4, 20)))
+         for user_id in user_ids for _ in range(tweets_per_user)],
+        batch_size=batch_size,
+    )
+    tweet_ids = list(Tweet.objects.values_list('id', flat=True))
+    tweet_popularity = [rng.paretovariate(1.5) for _ in tweet_ids]
+
+    likes = []
+    for user_id in user_ids:
+        for tweet_id in set(rng.choices(tweet_ids, weights=tweet_popularity, k=likes_per_user)):
+            likes.append(Like(user_id=user_id, tweet_id=tweet_id))
+    Like.objects.bulk_create(likes, batch_size=batch_size)
+
+    Comment.objects.bulk_create(
+        [Comment(user_id=user_id, tweet_id=rng.choice(tweet_ids), content=sentence(rng, rng.randint(2, 10)))
+         for user_id in user_ids for _ in range(comments_per_user)],
+        batch_size=batch_size,
+    )
+
+    counters.reconcile()
+    for user_id in user_ids:
+        timeline.rebuild_timeline(user_id)
+    recommendations.build_similarity_index()
+
+    return {
+        'users': len(user_ids),
+        'private_users': len(private),
+        'follows': len(follows),
+        'tweets': len(tweet_ids),
+        'likes': len(likes),
+        'comments': Comment.objects.count(),
+    }
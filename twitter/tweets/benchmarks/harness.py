@@ -0,0 +1,191 @@
+"""
+In-process API benchmark: drives every endpoint in tweets/urls.py through
+Django's test client against a dataset from datagen.generate(), and records
+per endpoint the latency percentiles, the queries per request and the rows
+fetched from the database per request, whether they became model instances
+or .values() dicts ("rows"). Both count the queries of the request's thread.
+
+Write endpoints run against fresh targets prepared outside the timed part
+(a tweet not liked yet, a pending follow request, ...). The SSE stream is
+left out, it never finishes a response.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from tweets.models import Follow, Tweet, UserProfile
+
+from . import percentiles
+
+
+class CountingCursor:
+    """DB-API cursor proxy adding the rows fetched through it to `rows[0]`."""
+
+    def __init__(self, cursor, rows):
+        self.cursor = cursor
+        self.rows = rows
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.rows[0] += 1
+            yield row
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.rows[0] += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.rows[0] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.rows[0] += len(rows)
+        return rows
+
+
+@contextmanager
+def count_rows():
+    """Count the rows fetched by the queries executed in the block."""
+    rows = [0]
+
+    def wrapper(execute, sql, params, many, context):
+        cursor = context['cursor']
+        if not isinstance(cursor.cursor, CountingCursor):
+            cursor.cursor = CountingCursor(cursor.cursor, rows)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield rows
+
+
+class Dataset:
+    """The ids the endpoints are exercised with, picked from the generated data."""
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        # The feed is read by the account following the most people, the
+        # profile and tweets of the most followed account are looked at
+        self.viewer = User.objects.annotate(followees=Count('following')).order_by('-followees', 'id')[0]
+        self.author = User.objects.annotate(total=Count('followers')).order_by('-total', 'id')[0]
+        self.author_profile_id = UserProfile.objects.get(user=self.author).pk
+        self.tweet_ids = list(Tweet.objects.values_list('id', flat=True))
+        followed = set(Follow.objects.filter(follower=self.viewer).values_list('following_id', flat=True))
+        followers = set(Follow.objects.filter(following=self.viewer).values_list('follower_id', flat=True))
+        others = User.objects.exclude(pk=self.viewer.pk).values_list('id', flat=True)
+        self.not_followed = [user_id for user_id in others if user_id not in followed]
+        self.not_followers = [user_id for user_id in others if user_id not in followers]
+        self.rng.shuffle(self.not_followed)
+        self.rng.shuffle(self.not_followers)
+        self.counter = 0
+
+    def tweet_id(self):
+        return self.rng.choice(self.tweet_ids)
+
+    def unique(self):
+        self.counter += 1
+        return self.counter
+
+    def pending_request(self):
+        """A new follow request to the viewer, to accept or deny."""
+        follower_id = self.not_followers.pop()
+        return Follow.objects.create(follower_id=follower_id, following=self.viewer, is_accepted=False).pk
+
+    def own_tweet(self):
+        return Tweet.objects.create(user=self.viewer, content='benchmark tweet %d' % self.unique()).pk
+
+
+# name -> function(dataset) returning (method, path, json body or None)
+ENDPOINTS = {
+    'feed': lambda data: ('get', '/api/tweets/', None),
+    'async_feed': lambda data: ('get', '/api/async/tweets/', None),
+    'recommended': lambda data: ('get', '/api/recommended-tweets/', None),
+    'suggestions': lambda data: ('get', '/api/suggestions/', None),
+    'user_tweets': lambda data: ('get', '/api/user-tweets/%d/' % data.author.pk, None),
+    'async_user_tweets': lambda data: ('get', '/api/async/user-tweets/%d/' % data.author.pk, None),
+    'user_profile': lambda data: ('get', '/api/user-profile/%d/' % data.author_profile_id, None),
+    'async_user_profile': lambda data: ('get', '/api/async/user-profile/%d/' % data.author_profile_id, None),
+    'my_profile': lambda data: ('get', '/api/my-profile/', None),
+    'tweet_detail': lambda data: ('get', '/api/tweets/%d/' % data.tweet_id(), None),
+    'comments': lambda data: ('get', '/api/comments/%d/' % data.tweet_id(), None),
+    'search': lambda data: ('get', '/api/search/?q=%s' % data.rng.choice(['python', 'cache feed', 'time*']), None),
+    'follow_requests': lambda data: ('get', '/api/requests/', None),
+    'like_toggle': lambda data: ('post', '/api/like/%d/' % data.tweet_id(), None),
+    'retweet': lambda data: ('post', '/api/retweet/', {'tweet': data.tweet_ids.pop()}),
+    'comment_create': lambda data: ('post', '/api/comments/%d/' % data.tweet_id(), {'content': 'benchmark comment'}),
+    'tweet_create': lambda data: ('post', '/api/tweets/create/', {'content': 'benchmark tweet'}),
+    'tweet_update': lambda data: ('patch', '/api/tweets/%d/' % data.own_tweet(), {'content': 'edited'}),
+    'tweet_delete': lambda data: ('delete', '/api/tweets/%d/' % data.own_tweet(), None),
+    'follow_toggle': lambda data: ('post', '/api/follow/%d/' % data.not_followed.pop(), None),
+    'accept_request': lambda data: ('put', '/api/requests/%d/accept/' % data.pending_request(), {}),
+    'bulk_accept_requests': lambda data: ('post', '/api/requests/bulk/', {
+        'action': 'accept', 'ids': [data.pending_request() for _ in range(10)],
+    }),
+    'deny_request': lambda data: ('delete', '/api/requests/%d/deny/' % data.pending_request(), None),
+    'login': lambda data: ('post', '/api/login/', {'username': data.viewer.username, 'password': 'password'}),
+    'register': lambda data: ('post', '/api/register/', {
+        'username': 'registered%d' % data.unique(), 'email': 'registered@example.com',
+        'password': 'password', 'confirm_password': 'password',
+    }),
+}
+
+
+def measure(client, method, path, body):
+    """Issue one request; returns (seconds, status, queries, rows)."""
+    with CaptureQueriesContext(connection) as queries, count_rows() as rows:
+        start = time.perf_counter()
+        if body is None:
+            response = getattr(client, method)(path)
+        else:
+            response = getattr(client, method)(path, body, content_type='application/json')
+        elapsed = time.perf_counter() - start
+    return elapsed, response.status_code, len(queries), rows[0]
+
+
+def run(endpoints=None, requests=30, seed=0):
+    """Benchmark the named endpoints (all by default) on the current data."""
+    data = Dataset(seed)
+    client = Client(raise_request_exception=False)
+    client.force_login(data.viewer)
+    # Failures are counted as errors, not logged with a traceback each
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    try:
+        return {name: run_endpoint(client, data, name, requests) for name in endpoints or ENDPOINTS}
+    finally:
+        request_logger.setLevel(level)
+
+
+def run_endpoint(client, data, name, requests):
+    """Issue `requests` requests to one endpoint and summarize them."""
+    samples = []
+    for _ in range(requests):
+        try:
+            method, path, body = ENDPOINTS[name](data)
+        except IndexError:
+            break  # ran out of fresh targets on a small dataset
+        samples.append(measure(client, method, path, body))
+    latencies_ms = [elapsed * 1000 for elapsed, status, _, _ in samples if status < 400]
+    result = {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _, _ in samples if status >= 400),
+        'queries_mean': sum(sample[2] for sample in samples) / len(samples) if samples else None,
+        'queries_max': max((sample[2] for sample in samples), default=None),
+        'rows_mean': sum(sample[3] for sample in samples) / len(samples) if samples else None,
+    }
+    result.update({key + '_ms': value for key, value in percentiles(latencies_ms).items()})
+    return result
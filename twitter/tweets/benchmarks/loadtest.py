@@ -0,0 +1,60 @@
+"""
+HTTP load test against a running server.
+
+To compare the WSGI and ASGI deployments, start each with the same number of
+workers, e.g.
+
+    gunicorn twitter.wsgi:application -w 4
+    gunicorn twitter.asgi:application -w 4 -k uvicorn.workers.UvicornWorker
+
+and run `manage.py loadtest` against both with the same options. The default
+paths pair every synchronous endpoint with its async variant.
+"""
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from . import percentiles
+
+DEFAULT_PATHS = [
+    '/api/tweets/',
+    '/api/async/tweets/',
+    '/api/user-tweets/{user}/',
+    '/api/async/user-tweets/{user}/',
+    '/api/user-profile/{profile}/',
+    '/api/async/user-profile/{profile}/',
+]
+
+
+def fetch(url, headers):
+    request = urllib.request.Request(url, headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as exc:
+        status = exc.code
+    except urllib.error.URLError:
+        status = None
+    return time.perf_counter() - start, status
+
+
+def run(base_url, path, requests=200, concurrency=8, headers=None):
+    """Issue `requests` GETs to one path from `concurrency` threads."""
+    url = base_url.rstrip('/') + path
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: fetch(url, headers or {}), range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies_ms = [latency * 1000 for latency, status in results if status == 200]
+    result = {
+        'path': path,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, status in results if status != 200),
+        'requests_per_second': requests / elapsed if elapsed else None,
+    }
+    result.update({key + '_ms': value for key, value in percentiles(latencies_ms).items()})
+    return result
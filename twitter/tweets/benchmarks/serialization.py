@@ -0,0 +1,74 @@
+"""
+CPU spent serializing a page of tweets, per serializer and renderer.
+
+A page of the newest tweets is turned into JSON by each combination of
+
+* drf  - TweetSerializer over Tweet.objects.for_serializer() instances
+* lean - LeanTweetSerializer over .values() rows
+
+and of DRF's JSONRenderer (json) and ORJSONRenderer (orjson). Each run
+records the process CPU time of building the data (including its queries,
+SQLite runs in-process) and of rendering it, and the size of the JSON
+uncompressed and with each coding of tweets/compression.py.
+"""
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from tweets import compression, renderers
+from tweets.models import Tweet
+from tweets.serializers import LeanTweetSerializer, TweetSerializer
+from tweets.visibility import VisibilityService
+
+SERIALIZERS = {
+    'drf': lambda page: TweetSerializer(list(Tweet.objects.for_serializer().filter(id__in=page)), many=True),
+    'lean': lambda page: LeanTweetSerializer(LeanTweetSerializer.rows(Tweet.objects.filter(id__in=page)), many=True),
+}
+RENDERERS = {
+    'json': JSONRenderer,
+    'orjson': renderers.ORJSONRenderer,
+}
+
+
+def cpu_ms(function):
+    start = time.process_time()
+    result = function()
+    return (time.process_time() - start) * 1000, result
+
+
+def run(page_size=100, repeat=20):
+    """Median CPU milliseconds per page of each combination; see the module docstring."""
+    request = RequestFactory().get('/api/tweets/')
+    request.user = User.objects.order_by('id').first()
+    # Visible tweets only, as the views list them
+    tweets = VisibilityService(request.user).filter_tweets(Tweet.objects.all())
+    page = list(tweets.order_by('-created_at', '-id').values_list('id', flat=True)[:page_size])
+    results = {}
+    for serializer_name, make_serializer in SERIALIZERS.items():
+        for renderer_name, renderer_class in RENDERERS.items():
+            if renderer_name == 'orjson' and renderers.orjson is None:
+                continue
+            serialize, render = [], []
+            for _ in range(repeat):
+                serializer = make_serializer(page)
+                serializer.context['request'] = request
+                elapsed, data = cpu_ms(lambda: serializer.data)
+                serialize.append(elapsed)
+                elapsed, content = cpu_ms(lambda: renderer_class().render(data))
+                render.append(elapsed)
+            result = {
+                'tweets': len(data),
+                'serialize_ms': statistics.median(serialize),
+                'render_ms': statistics.median(render),
+                'bytes': len(content),
+            }
+            result['total_ms'] = result['serialize_ms'] + result['render_ms']
+            for coding in (['br'] if compression.brotli is not None else []) + ['gzip']:
+                elapsed, compressed = cpu_ms(lambda: compression.compress(content, coding))
+                result[coding + '_bytes'] = len(compressed)
+                result[coding + '_ms'] = elapsed
+            results['%s+%s' % (serializer_name, renderer_name)] = result
+    return results
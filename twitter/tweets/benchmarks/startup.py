@@ -0,0 +1,74 @@
+"""
+Startup cost of a worker process: django.setup() plus importing the URLconf
+(and with it every view), measured in fresh interpreters.
+
+Each run is a `python -c` child with this project's settings, which reports
+the seconds taken, its peak RSS and which of HEAVY_MODULES got imported.
+Those are the libraries only some code paths need, kept out of startup by
+importing them lazily (see tweets/recommendations.py).
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+
+HEAVY_MODULES = ('sklearn', 'scipy')
+
+SCRIPT = r'''
+import json, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+seconds = time.perf_counter() - start
+try:
+    # ru_maxrss of a forked child includes its parent's before exec
+    with open('/proc/self/status') as status:
+        rss_mb = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:')) / 2 ** 10
+except OSError:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    rss_mb = rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+print(json.dumps({
+    'seconds': seconds,
+    'max_rss_mb': rss_mb,
+    'heavy_modules': sorted(name for name in %r if name in sys.modules),
+}))
+''' % (HEAVY_MODULES,)
+
+
+def measure_once():
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'twitter.settings'))
+    completed = subprocess.run(
+        [sys.executable, '-c', SCRIPT], cwd=str(settings.BASE_DIR), env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure(runs=5):
+    """Median seconds, peak RSS and heavy modules imported over `runs` fresh processes."""
+    results = [measure_once() for _ in range(runs)]
+    return {
+        'runs': runs,
+        'seconds': statistics.median(result['seconds'] for result in results),
+        'max_rss_mb': max(result['max_rss_mb'] for result in results),
+        'heavy_modules': sorted({name for result in results for name in result['heavy_modules']}),
+    }
+
+
+def over_budget(result):
+    """The budget settings the measurement exceeds, as messages."""
+    problems = []
+    seconds = getattr(settings, 'STARTUP_BUDGET_SECONDS', None)
+    if seconds is not None and result['seconds'] > seconds:
+        problems.append('startup took %.2fs, the budget is %.2fs' % (result['seconds'], seconds))
+    rss = getattr(settings, 'STARTUP_BUDGET_RSS_MB', None)
+    if rss is not None and result['max_rss_mb'] > rss:
+        problems.append('peak RSS was %.0f MB, the budget is %d MB' % (result['max_rss_mb'], rss))
+    if result['heavy_modules']:
+        problems.append('imported at startup: %s' % ', '.join(result['heavy_modules']))
+    return problems
@@ -0,0 +1,139 @@
+"""
+Compact cached "user cards" for rendering authors and followers.
+
+A card holds what UserSerializer renders about a user: id, username, avatar
+URL (relative to the site, a small variant once tweets/images.py made one)
+and is_public. Cards are read through two tiers: a small per-process LRU
+(USER_CARD_LOCAL_SIZE entries, kept for USER_CARD_LOCAL_TTL seconds) in
+front of Django's cache, and the database for whatever is missing, all in
+bulk for a whole page. User and UserProfile
+save signals drop a card from the shared cache and the local tier of the
+process that saved it; other processes may serve their local copy until its
+short TTL runs out.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router
+
+from . import images
+from .models import UserProfile
+
+CACHE_KEY = 'usercard:%s'
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class LocalLRU:
+    """
+    Thread-safe LRU dict whose entries also expire after `ttl` seconds.
+    `size` and `ttl` are callables, read on every write rather than once at
+    import, so they follow the settings in effect.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    continue
+                expires, value = entry
+                if expires < now:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values):
+        expires = time.monotonic() + self.ttl()
+        size = self.size()
+        with self._lock:
+            for key, value in values.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cards = LocalLRU(
+    size=lambda: get_setting('USER_CARD_LOCAL_SIZE', 1024),
+    ttl=lambda: get_setting('USER_CARD_LOCAL_TTL', 30),
+)
+
+
+def load_cards(user_ids):
+    storage = UserProfile._meta.get_field('profile_pic').storage
+    # From the primary: a card read from a lagging replica would be cached
+    # again after the save that invalidated it
+    rows = User.objects.db_manager(router.db_for_write(User)).filter(id__in=user_ids).values(
+        'id', 'username', 'userprofile__profile_pic', 'userprofile__image_variants', 'userprofile__is_public'
+    )
+    return {
+        row['id']: {
+            'id': row['id'],
+            'username': row['username'],
+            'avatar': storage.url(images.card_avatar(row['userprofile__image_variants'], row['userprofile__profile_pic']))
+            if row['userprofile__profile_pic'] else None,
+            'is_public': row['userprofile__is_public'] is not False,
+        }
+        for row in rows
+    }
+
+
+def get_cards(user_ids):
+    """Return {user_id: card} for the users that exist among `user_ids`."""
+    user_ids = set(user_ids)
+    cards = local_cards.get_many(user_ids)
+    missing = user_ids - cards.keys()
+    if missing:
+        shared = cache.get_many([CACHE_KEY % user_id for user_id in missing])
+        from_cache = {card['id']: card for card in shared.values()}
+        local_cards.set_many(from_cache)
+        cards.update(from_cache)
+        missing -= from_cache.keys()
+    if missing:
+        loaded = load_cards(missing)
+        cache.set_many({CACHE_KEY % user_id: card for user_id, card in loaded.items()}, get_setting('USER_CARD_CACHE_TTL', 3600))
+        local_cards.set_many(loaded)
+        cards.update(loaded)
+    return cards
+
+
+def invalidate(user_id):
+    local_cards.delete(user_id)
+    cache.delete(CACHE_KEY % user_id)
+
+
+def render_card(card, request):
+    """The UserSerializer representation of a card."""
+    avatar = card['avatar']
+    if avatar and request is not None:
+        avatar = request.build_absolute_uri(avatar)
+    return {'id': card['id'], 'username': card['username'], 'profile_pic': avatar}
+
+
+def render_cards(user_ids, request):
+    return {user_id: render_card(card, request) for user_id, card in get_cards(user_ids).items()}
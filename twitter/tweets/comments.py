@@ -0,0 +1,72 @@
+"""
+Comment threads, and the cached comment previews of tweets.
+
+A reply stores its parent and, in Comment.path, the ids of all its
+ancestors ("12.34." for a reply to 34, itself a reply to 12; top-level
+comments have an empty path). The replies at any depth under a comment are
+therefore the comments of the same tweet whose path starts with the
+comment's path plus its own id, a prefix match on the (tweet, path) index
+read by subtree() in one query. Paths are at most 255 characters, which bounds the
+depth of a thread (MAX_PATH_LENGTH).
+
+The preview rendered with each tweet, its PREVIEW_SIZE latest comments, is
+cached per tweet for COMMENT_PREVIEW_CACHE_TTL seconds. A new comment
+replaces the preview of its tweet once committed; other changes drop it,
+see the Comment handlers in tweets/signals.py.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+
+from .models import Comment, latest_comments_queryset
+
+PREVIEW_SIZE = 3
+CACHE_KEY = 'comments:preview:%s'
+MAX_PATH_LENGTH = Comment._meta.get_field('path').max_length
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def child_path(parent):
+    """The path of a reply to `parent`; longer than MAX_PATH_LENGTH if too deep."""
+    return '%s%d.' % (parent.path, parent.pk)
+
+
+def subtree(comment):
+    """The replies at any depth under `comment`, oldest first."""
+    return Comment.objects.filter(tweet_id=comment.tweet_id, path__startswith=child_path(comment)).order_by('created_at', 'id')
+
+
+def render_previews(tweet_ids):
+    """{tweet_id: latest comments as CommentSerializer renders them}, from the database."""
+    from .serializers import CommentSerializer
+    previews = {tweet_id: [] for tweet_id in tweet_ids}
+    if previews:
+        # From the primary, as they are cached past the invalidation
+        rendered = latest_comments_queryset(PREVIEW_SIZE).using(router.db_for_write(Comment))
+        for comment in rendered.filter(tweet_id__in=previews):
+            previews[comment.tweet_id].append(dict(CommentSerializer(comment).data))
+    return previews
+
+
+def previews(tweet_ids):
+    """{tweet_id: preview} of the tweets, from the cache where possible."""
+    tweet_ids = set(tweet_ids)
+    cached = cache.get_many([CACHE_KEY % tweet_id for tweet_id in tweet_ids])
+    found = {tweet_id: cached[CACHE_KEY % tweet_id] for tweet_id in tweet_ids if CACHE_KEY % tweet_id in cached}
+    missing = tweet_ids - found.keys()
+    if missing:
+        loaded = render_previews(missing)
+        cache.set_many({CACHE_KEY % tweet_id: preview for tweet_id, preview in loaded.items()}, get_setting('COMMENT_PREVIEW_CACHE_TTL', 60 * 60))
+        found.update(loaded)
+    return found
+
+
+def refresh_preview(tweet_id):
+    cache.set(CACHE_KEY % tweet_id, render_previews([tweet_id])[tweet_id], get_setting('COMMENT_PREVIEW_CACHE_TTL', 60 * 60))
+
+
+def invalidate_preview(tweet_id):
+    cache.delete(CACHE_KEY % tweet_id)
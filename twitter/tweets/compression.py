@@ -0,0 +1,99 @@
+"""
+Compression of responses, with Brotli when the client and the server can.
+
+CompressionMiddleware picks the best coding the client accepts (br if the
+brotli package is installed, else gzip) for responses of at least
+COMPRESSION_MIN_SIZE bytes; below that the framing and CPU outweigh the
+saving. Streaming responses, e.g. the SSE timeline stream, are passed
+through, as compressing them would hold events back in the compressor.
+
+Only JSON is compressed. HTML pages, the browsable API among them, carry
+CSRF tokens next to text an attacker can choose, which compression would
+leak through the response size (BREACH); Django's GZipMiddleware pads its
+output against that, this middleware leaves those responses alone instead.
+
+As with Django's GZipMiddleware, strong ETags are made weak, since the bytes
+differ per coding, and If-None-Match keeps matching them (weak comparison).
+"""
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CODING_RE = re.compile(r'\s*([^\s;,]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*')
+COMPRESSED_TYPES = ('application/json',)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def accepted_codings(header):
+    """{coding: q} of an Accept-Encoding header, without the refused ones."""
+    codings = {}
+    for part in header.split(','):
+        match = CODING_RE.fullmatch(part)
+        if match is None:
+            continue
+        try:
+            quality = float(match.group(2)) if match.group(2) is not None else 1.0
+        except ValueError:
+            continue
+        codings[match.group(1).lower()] = quality
+    return {coding: quality for coding, quality in codings.items() if quality > 0}
+
+
+def choose_coding(header):
+    codings = accepted_codings(header)
+    available = (['br'] if brotli is not None else []) + ['gzip']
+    # The server's preference breaks ties of the client's
+    best = max(available, key=lambda coding: (codings.get(coding, codings.get('*', 0)), -available.index(coding)))
+    return best if codings.get(best, codings.get('*', 0)) > 0 else None
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type in COMPRESSED_TYPES or content_type.endswith('+json')
+
+
+def compress(content, coding):
+    if coding == 'br':
+        return brotli.compress(content, quality=get_setting('COMPRESSION_BROTLI_QUALITY', 4))
+    return gzip.compress(content, compresslevel=get_setting('COMPRESSION_GZIP_LEVEL', 6), mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # Vary whether or not this one is compressed; caches must not serve
+        # a compressed copy to clients that cannot read it
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or not is_compressible(response)
+            or len(response.content) < get_setting('COMPRESSION_MIN_SIZE', 1024)
+        ):
+            return response
+        coding = choose_coding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+        compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
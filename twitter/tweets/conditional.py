@@ -0,0 +1,118 @@
+"""
+Conditional GETs and cached rendered JSON for tweet and profile reads.
+
+A view using ConditionalGetMixin first computes a version stamp of what it
+would render, with one or two narrow queries that skip the serializer
+pipeline: the row values it renders, the current counters and the author's
+user card (usually in the process' card cache). The stamp is hashed into
+the ETag, so a request whose If-None-Match matches is answered 304 Not
+Modified without serializing anything.
+
+Otherwise the rendered JSON is looked up in Django's cache, under the
+object and a variant made of the viewer's visibility class (see
+visibility_class()), the host and the full path. It is reused only while
+its ETag matches the current one. Nothing rendered is viewer-specific
+beyond what the visibility class captures, so the views of a public
+profile or tweet are shared by every viewer. The signal handlers in
+tweets/signals.py drop an object's entries when it is saved or deleted.
+Counter updates send no signals, but they change the stamp, so a stale
+entry is never served.
+
+There is no Last-Modified: no column bounds the time of the counter
+updates, and If-Modified-Since alone would then be answered 304 wrongly.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .visibility import VisibilityService
+
+CACHE_KEY = 'rendered:%s:%s'
+# Variants kept per object, e.g. pages of a user's tweets
+MAX_VARIANTS = 16
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def visibility_class(request, author_id, is_public):
+    """
+    How the viewer relates to an author, as far as visibility goes. Viewers
+    of the same class get the same representation.
+    """
+    if is_public:
+        return 'public'
+    viewer = request.user
+    if viewer.is_authenticated and viewer.pk == author_id:
+        return 'owner'
+    if author_id in VisibilityService.for_request(request).private_followee_ids:
+        return 'follower'
+    return 'hidden'
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def invalidate(name, object_id):
+    """Drop the rendered responses of an object of the `name` views."""
+    cache.delete(CACHE_KEY % (name, object_id))
+
+
+class ConditionalGetMixin:
+    """
+    GET with ETag validation and cached rendered JSON; the view defines
+    `rendered_cache_name` and get_version().
+    """
+    rendered_cache_name = None
+
+    def get_version(self):
+        """
+        Return (object id, visibility class, stamp) of what the GET would
+        render, or None to render it without validation (e.g. a 404).
+        """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_version()
+        if version is None:
+            return super().get(request, *args, **kwargs)
+        object_id, viewer_class, stamp = version
+        renderer_format = request.accepted_renderer.format
+        etag = make_etag(self.rendered_cache_name, renderer_format, request.get_host(), viewer_class, stamp)
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return self.finalize_conditional(response, etag)
+
+        ttl = get_setting('RENDERED_CACHE_TTL', 300)
+        if not ttl or renderer_format != 'json':
+            # e.g. the browsable API, which shows the viewer
+            return self.finalize_conditional(super().get(request, *args, **kwargs), etag)
+        key = CACHE_KEY % (self.rendered_cache_name, object_id)
+        variant = '%s|%s|%s' % (viewer_class, request.get_host(), request.get_full_path())
+        cached = (cache.get(key) or {}).get(variant)
+        if cached is not None and cached['etag'] == etag:
+            return self.finalize_conditional(HttpResponse(cached['content'], content_type=cached['content_type']), etag)
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            def store(rendered):
+                variants = cache.get(key) or {}
+                variants.pop(variant, None)
+                while len(variants) >= MAX_VARIANTS:
+                    variants.pop(next(iter(variants)))
+                variants[variant] = {'etag': etag, 'content': rendered.content, 'content_type': rendered['Content-Type']}
+                cache.set(key, variants, ttl)
+            response.add_post_render_callback(store)
+        return self.finalize_conditional(response, etag)
+
+    def finalize_conditional(self, response, etag):
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            # Clients may keep the response but must revalidate it
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,112 @@
+"""
+Denormalized like/retweet/comment counters on Tweet.
+
+Counters are adjusted with F() expressions by the code that inserts or
+deletes the source row, inside the same transaction. Once a tweet's counter
+reaches TWEET_COUNTER_HOT_THRESHOLD and TWEET_COUNTER_SHARDS is set, its
+updates go to one of several TweetCounterShard rows picked at random, so
+concurrent likes on a viral tweet do not queue on a single row lock. The
+shard deltas are added on read and folded back into the column by the
+reconcile_counters command, which also repairs drift against the source
+tables.
+"""
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Like, Retweet, Tweet, TweetCounterShard
+
+# Counter column -> model whose rows it counts
+COUNTER_SOURCES = {
+    'like_count': Like,
+    'retweet_count': Retweet,
+    'comment_count': Comment,
+}
+
+
+def shard_count():
+    return getattr(settings, 'TWEET_COUNTER_SHARDS', 0)
+
+
+def hot_threshold():
+    return getattr(settings, 'TWEET_COUNTER_HOT_THRESHOLD', 10000)
+
+
+def adjust(tweet, field, delta):
+    """Add `delta` to `field` of `tweet`. Call inside the writing transaction."""
+    adjust_id(tweet.pk, field, delta)
+
+
+def adjust_id(tweet_id, field, delta):
+    """adjust() by tweet id; one UPDATE unless the tweet is hot."""
+    if field not in COUNTER_SOURCES:
+        raise ValueError('Unknown counter %r' % field)
+    rows = Tweet.objects.filter(pk=tweet_id)
+    shards = shard_count()
+    if not shards:
+        rows.update(**{field: F(field) + delta})
+    elif not rows.filter(**{field + '__lt': hot_threshold()}).update(**{field: F(field) + delta}):
+        adjust_shard(tweet_id, field, random.randrange(shards), delta)
+
+
+def adjust_shard(tweet_id, field, shard, delta):
+    rows = TweetCounterShard.objects.filter(tweet_id=tweet_id, field=field, shard=shard)
+    if rows.update(delta=F('delta') + delta):
+        return
+    try:
+        with transaction.atomic():
+            TweetCounterShard.objects.create(tweet_id=tweet_id, field=field, shard=shard, delta=delta)
+    except IntegrityError:
+        # Another request created the shard row first
+        rows.update(delta=F('delta') + delta)
+
+
+def shard_delta(field):
+    """Expression for the pending shard deltas of `field` of the outer tweet."""
+    deltas = TweetCounterShard.objects.filter(tweet=OuterRef('pk'), field=field).order_by().values('tweet').annotate(total=Sum('delta')).values('total')
+    return Coalesce(Subquery(deltas), 0)
+
+
+def counter_expression(field):
+    """Current value of a counter, including unfolded shard deltas if sharding is on."""
+    if shard_count():
+        return F(field) + shard_delta(field)
+    return F(field)
+
+
+def reconcile(batch_size=1000):
+    """
+    Recount every tweet's counters from the source tables in batches of
+    tweet ids and fold away the shard rows. Returns the number of tweets
+    whose counters had drifted.
+    """
+    drifted = 0
+    last_id = 0
+    fields = list(COUNTER_SOURCES)
+    while True:
+        with transaction.atomic():
+            tweets = list(
+                Tweet.objects.select_for_update().filter(pk__gt=last_id).order_by('pk').only('pk', *fields)[:batch_size]
+            )
+            if not tweets:
+                return drifted
+            ids = [tweet.pk for tweet in tweets]
+            last_id = ids[-1]
+            actual = {}
+            for field, model in COUNTER_SOURCES.items():
+                actual[field] = dict(
+                    model.objects.filter(tweet_id__in=ids).values('tweet_id').annotate(total=Count('*')).values_list('tweet_id', 'total')
+                )
+            changed = []
+            for tweet in tweets:
+                values = {field: actual[field].get(tweet.pk, 0) for field in fields}
+                if any(getattr(tweet, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(tweet, field, value)
+                    changed.append(tweet)
+            Tweet.objects.bulk_update(changed, fields)
+            TweetCounterShard.objects.filter(tweet_id__in=ids).delete()
+            drifted += len(changed)
@@ -0,0 +1,110 @@
+"""
+Read replicas for the read-only list views, with read-your-writes.
+
+Views using ReplicaReadMixin (the tweet lists and feeds) run their GETs
+against one of the DATABASE_REPLICAS, picked at random per request; every
+other read, and every write, goes to the default database. Replicas lag
+behind the primary, so a user who just wrote (any successful unsafe
+request, as recorded by ReplicaStickinessMiddleware) keeps reading from the
+primary for REPLICA_STICKY_SECONDS. Without replicas configured all of this
+is skipped.
+
+The write is remembered in a signed cookie, so whichever worker serves the
+next request knows about it. API clients that keep no cookies are matched by
+a cache entry as well; settings.py configures a cache shared by every
+process whenever replicas are (Redis, or the primary database).
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.permissions import SAFE_METHODS
+
+CACHE_KEY = 'db:sticky:%s'
+COOKIE_NAME = 'sticky'
+COOKIE_SALT = 'tweets.db_routing'
+
+# The replica of the current request, None to read from the primary
+_replica = ContextVar('tweets_replica', default=None)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def replicas():
+    return get_setting('DATABASE_REPLICAS', [])
+
+
+def stick(response, user_id):
+    """Keep `user_id` reading from the primary until replicas caught up."""
+    seconds = get_setting('REPLICA_STICKY_SECONDS', 10)
+    response.set_signed_cookie(
+        COOKIE_NAME, str(user_id), salt=COOKIE_SALT, max_age=seconds, httponly=True, samesite='Lax',
+        secure=settings.SESSION_COOKIE_SECURE,
+    )
+    cache.set(CACHE_KEY % user_id, True, seconds)
+
+
+def is_sticky(request):
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    # max_age checks the signature's timestamp, the browser may keep it longer
+    cookie = request.get_signed_cookie(
+        COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=get_setting('REPLICA_STICKY_SECONDS', 10)
+    )
+    return cookie == str(user.pk) or bool(cache.get(CACHE_KEY % user.pk))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'django_cache':
+            # DatabaseCache entries are invalidated on the primary
+            return 'default'
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in replicas()
+
+
+class ReplicaStickinessMiddleware:
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # DRF sets the user it authenticated on the request as well
+        user = getattr(request, 'user', None)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and user is not None and user.is_authenticated:
+            stick(response, user.pk)
+        return response
+
+
+class ReplicaReadMixin:
+    """Serve the view's GETs from a replica, unless the user wrote recently."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        aliases = replicas()
+        if aliases and request.method in SAFE_METHODS and not is_sticky(request):
+            self._replica_token = _replica.set(random.choice(aliases))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            _replica.reset(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,339 @@
+"""
+Process-local index of the follow graph.
+
+Adjacency is held as CSR arrays indexed by user id: `indptr[u]:indptr[u + 1]`
+slices the sorted ids adjacent to user u out of `indices`. There is one such
+pair per relation:
+
+* followees  - accepted follows, follower -> following
+* followers  - accepted follows, following -> follower
+* requested  - pending requests, follower -> following
+* requesters - pending requests, following -> follower
+
+The arrays are immutable, built from the Follow table with one query or
+memory-mapped from a snapshot written by the follow_graph_snapshot command.
+Follow changes committed by this process are applied to a small overlay of
+added and removed edges by the signal handlers in tweets/signals.py. Other
+processes' changes are picked up when the graph is rebuilt: once it is older
+than FOLLOW_GRAPH_MAX_AGE seconds, get_graph() keeps serving it and queues a
+rebuild on a background thread, which swaps the new graph in when done. A
+process without any graph (no snapshot) queues the first build the same way;
+until it is ready get_graph() returns None and callers query the Follow table.
+
+The index may therefore lag behind the database a little, so it serves
+rankings and candidate sets (recommendations, suggestions); access control
+(visibility.py) keeps reading the database.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Follow
+
+logger = logging.getLogger(__name__)
+
+RELATIONS = ('followees', 'followers', 'requested', 'requesters')
+SNAPSHOT_MAGIC = b'FOLLOWGRAPH1\n'
+SNAPSHOT_HEADER_SIZE = 4096
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def build_csr(sources, targets, size):
+    """CSR arrays of the edges sources[i] -> targets[i] over `size` nodes."""
+    order = np.lexsort((targets, sources))
+    indices = targets[order].astype(np.int32)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr, indices
+
+
+class FollowGraph:
+    def __init__(self, arrays, created_at):
+        self.arrays = arrays  # {'followees_indptr': ..., 'followees_indices': ..., ...}
+        self.created_at = created_at
+        self._added = {relation: defaultdict(set) for relation in RELATIONS}
+        self._removed = {relation: defaultdict(set) for relation in RELATIONS}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls):
+        created_at = time.time()
+        rows = Follow.objects.values_list('follower_id', 'following_id', 'is_accepted').iterator(chunk_size=10000)
+        edges = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 3)
+        return cls.from_edges(edges[:, 0], edges[:, 1], edges[:, 2].astype(bool), created_at)
+
+    @classmethod
+    def from_edges(cls, followers, followings, accepted, created_at=None):
+        """Build from parallel arrays of follower ids, following ids and states."""
+        size = int(max(followers.max(), followings.max())) + 1 if len(followers) else 0
+        arrays = {}
+        for relation, sources, targets, mask in (
+            ('followees', followers, followings, accepted),
+            ('followers', followings, followers, accepted),
+            ('requested', followers, followings, ~accepted),
+            ('requesters', followings, followers, ~accepted),
+        ):
+            indptr, indices = build_csr(sources[mask], targets[mask], size)
+            arrays[relation + '_indptr'] = indptr
+            arrays[relation + '_indices'] = indices
+        return cls(arrays, time.time() if created_at is None else created_at)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a snapshot written by save()."""
+        with open(path, 'rb') as snapshot:
+            header = snapshot.read(SNAPSHOT_HEADER_SIZE)
+        if not header.startswith(SNAPSHOT_MAGIC):
+            raise ValueError('%s is not a follow graph snapshot.' % path)
+        layout = json.loads(header[len(SNAPSHOT_MAGIC):].rstrip(b'\0'))
+        arrays = {
+            name: np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(length,)) if length else np.zeros(0, dtype)
+            for name, (dtype, offset, length) in layout['arrays'].items()
+        }
+        return cls(arrays, layout['created_at'])
+
+    def save(self, path):
+        """Write the base arrays (not the overlay) to `path`, atomically."""
+        layout = {}
+        offset = SNAPSHOT_HEADER_SIZE
+        for name, array in self.arrays.items():
+            layout[name] = (array.dtype.str, offset, len(array))
+            offset += array.nbytes
+        header = SNAPSHOT_MAGIC + json.dumps({'created_at': self.created_at, 'arrays': layout}).encode()
+        if len(header) > SNAPSHOT_HEADER_SIZE:
+            raise ValueError('Snapshot header too large.')
+        tmp_path = '%s.tmp%d' % (path, os.getpid())
+        with open(tmp_path, 'wb') as snapshot:
+            snapshot.write(header.ljust(SNAPSHOT_HEADER_SIZE, b'\0'))
+            for array in self.arrays.values():
+                snapshot.write(np.ascontiguousarray(array).tobytes())
+        os.replace(tmp_path, path)
+
+    @property
+    def edge_count(self):
+        return len(self.arrays['followees_indices']) + len(self.arrays['requested_indices'])
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def _base(self, relation, user_id):
+        indptr = self.arrays[relation + '_indptr']
+        if user_id + 1 >= len(indptr):
+            return self.arrays[relation + '_indices'][:0]
+        return self.arrays[relation + '_indices'][indptr[user_id]:indptr[user_id + 1]]
+
+    def _in_base(self, relation, user_id, other_id):
+        row = self._base(relation, user_id)
+        position = np.searchsorted(row, other_id)
+        return position < len(row) and row[position] == other_id
+
+    def neighbours(self, relation, user_id):
+        """Sorted array of the ids adjacent to `user_id` in `relation`."""
+        row = self._base(relation, user_id)
+        with self._lock:
+            added = self._added[relation].get(user_id)
+            removed = self._removed[relation].get(user_id)
+            if not added and not removed:
+                return row
+            ids = (set(row.tolist()) - (removed or set())) | (added or set())
+        return np.array(sorted(ids), dtype=np.int32)
+
+    def followees(self, user_id):
+        return self.neighbours('followees', user_id)
+
+    def followers(self, user_id):
+        return self.neighbours('followers', user_id)
+
+    def follows(self, user_id, other_id):
+        """Whether user_id follows other_id with an accepted request."""
+        with self._lock:
+            if other_id in self._removed['followees'].get(user_id, ()):
+                return False
+            if other_id in self._added['followees'].get(user_id, ()):
+                return True
+        return bool(self._in_base('followees', user_id, other_id))
+
+    def mutuals(self, user_id):
+        return np.intersect1d(self.followees(user_id), self.followers(user_id), assume_unique=True)
+
+    def two_hop(self, user_id):
+        """
+        Accounts followed by the user's followees that the user does not
+        follow yet, as (ids, counts of followees following them), most
+        shared first.
+        """
+        followees = self.followees(user_id)
+        if not len(followees):
+            return np.zeros(0, np.int32), np.zeros(0, np.int64)
+        reached = np.concatenate([self.followees(followee) for followee in followees.tolist()])
+        ids, counts = np.unique(reached, return_counts=True)
+        keep = (ids != user_id) & ~np.isin(ids, followees, assume_unique=True)
+        ids, counts = ids[keep], counts[keep]
+        order = np.argsort(-counts, kind='stable')
+        return ids[order], counts[order]
+
+    def _add(self, relation, user_id, other_id):
+        self._removed[relation][user_id].discard(other_id)
+        if not self._in_base(relation, user_id, other_id):
+            self._added[relation][user_id].add(other_id)
+
+    def _remove(self, relation, user_id, other_id):
+        self._added[relation][user_id].discard(other_id)
+        if self._in_base(relation, user_id, other_id):
+            self._removed[relation][user_id].add(other_id)
+
+    def set_edge(self, follower_id, following_id, accepted):
+        """Record that follower_id follows (or requested to follow) following_id."""
+        with self._lock:
+            self._remove_edge(follower_id, following_id)
+            if accepted:
+                self._add('followees', follower_id, following_id)
+                self._add('followers', following_id, follower_id)
+            else:
+                self._add('requested', follower_id, following_id)
+                self._add('requesters', following_id, follower_id)
+
+    def remove_edge(self, follower_id, following_id):
+        with self._lock:
+            self._remove_edge(follower_id, following_id)
+
+    def _remove_edge(self, follower_id, following_id):
+        self._remove('followees', follower_id, following_id)
+        self._remove('followers', following_id, follower_id)
+        self._remove('requested', follower_id, following_id)
+        self._remove('requesters', following_id, follower_id)
+
+
+_graph = None
+_graph_lock = threading.Lock()
+# Serializes rebuilds, so only one reads the Follow table at a time
+_rebuild_lock = threading.Lock()
+_rebuild_queued = False
+# Changes applied while a rebuild reads the database, replayed onto its result
+_journal = None
+_executor = None
+
+
+def load_snapshot():
+    """Load the FOLLOW_GRAPH_SNAPSHOT file, if configured; run at startup."""
+    global _graph
+    path = get_setting('FOLLOW_GRAPH_SNAPSHOT', None)
+    if path and os.path.exists(path):
+        _graph = FollowGraph.load(path)
+
+
+def rebuild():
+    """Build the graph from the database and swap it in; callers hold _rebuild_lock."""
+    global _graph, _journal
+    with _graph_lock:
+        _journal = []
+    try:
+        graph = FollowGraph.from_database()
+        with _graph_lock:
+            # Setting an edge again is harmless if the query already saw it
+            for change in _journal:
+                apply_change(graph, *change)
+            _graph = graph
+    finally:
+        with _graph_lock:
+            _journal = None
+    return graph
+
+
+def get_executor():
+    """The process' rebuild thread, or None when FOLLOW_GRAPH_BACKGROUND_REBUILD is off."""
+    global _executor
+    if not get_setting('FOLLOW_GRAPH_BACKGROUND_REBUILD', True):
+        return None
+    if _executor is None:
+        with _graph_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(1, thread_name_prefix='follow-graph')
+    return _executor
+
+
+def run():
+    global _rebuild_queued
+    try:
+        with _rebuild_lock:
+            rebuild()
+    except Exception:
+        logger.exception('Rebuilding the follow graph failed')
+    finally:
+        with _graph_lock:
+            _rebuild_queued = False
+        close_old_connections()
+
+
+def schedule_rebuild():
+    """Rebuild the graph in the background, unless a rebuild is already queued."""
+    global _rebuild_queued
+    with _graph_lock:
+        if _rebuild_queued:
+            return
+        _rebuild_queued = True
+    executor = get_executor()
+    if executor is None:
+        run()
+    else:
+        executor.submit(run)
+
+
+def get_graph(wait=False):
+    """
+    The process' graph. One older than FOLLOW_GRAPH_MAX_AGE is still
+    returned while a fresh one is built in the background. Without any, the
+    first is built in the background too and None is returned meanwhile,
+    unless `wait` (for callers off the request thread) builds it right away.
+    """
+    graph = _graph
+    if graph is None:
+        if wait:
+            with _rebuild_lock:
+                graph = _graph if _graph is not None else rebuild()
+        else:
+            schedule_rebuild()
+            # Already there when rebuilds run inline
+            graph = _graph
+    elif graph.created_at < time.time() - get_setting('FOLLOW_GRAPH_MAX_AGE', 300):
+        schedule_rebuild()
+    return graph
+
+
+def reset():
+    """Forget the process' graph, the next get_graph() rebuilds it."""
+    global _graph
+    _graph = None
+
+
+def apply_change(graph, follower_id, following_id, accepted):
+    if accepted is None:
+        graph.remove_edge(follower_id, following_id)
+    else:
+        graph.set_edge(follower_id, following_id, accepted)
+
+
+def edge_changed(follower_id, following_id, accepted=None):
+    """
+    Apply a Follow change to the loaded graph; `accepted` None means deleted.
+    A graph that is not loaded yet will read the change from the database.
+    """
+    with _graph_lock:
+        graph = _graph
+        if _journal is not None:
+            _journal.append((follower_id, following_id, accepted))
+    if graph is not None:
+        apply_change(graph, follower_id, following_id, accepted)
@@ -0,0 +1,199 @@
+"""
+Resized variants of profile pictures and headers.
+
+An upload is stored as it came in. Once the profile is saved, a worker of
+IMAGE_WORKERS threads decodes it, applies and drops the EXIF orientation,
+crops it to each size of VARIANTS and encodes it in each of FORMATS. Pillow
+writes no metadata unless asked to, so EXIF (GPS position, camera), ICC
+profiles and comments are gone from the variants. Each variant is saved
+under the hash of its bytes, e.g. profile_pics/variants/3f9a...c2.webp, so
+a URL never changes content and can be cached forever; identical results
+share one file.
+
+The storage names end up in UserProfile.image_variants:
+
+    {'profile_pic': {'source': 'profile_pics/me.jpg',
+                     'sizes': {'small': {'webp': ..., 'jpeg': ...}, ...}},
+     'profile_header': {...}}
+
+`source` is the upload they were made from. Until a new upload is processed
+its variants are unknown and the original is served instead, see
+variant_names(). Files of replaced variants are left in place, other
+profiles may share them.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from . import cards
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+# (width, height) of the variants of each field
+VARIANTS = {
+    'profile_pic': {'small': (48, 48), 'medium': (128, 128), 'large': (400, 400)},
+    'profile_header': {'small': (600, 200), 'large': (1500, 500)},
+}
+# Pillow save() options of each format
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+# The variant user cards link to as the author's profile_pic
+CARD_VARIANT = ('small', 'webp')
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def open_image(file, side):
+    """Decode an upload, upright, scaled down while decoding if the format allows."""
+    image = Image.open(file)
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale, much faster for large photos;
+    # both sides stay at least `side`, whichever way the photo is rotated
+    image.draft('RGB', (side, side))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def encode(image, format_name):
+    if format_name == 'jpeg' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    output = io.BytesIO()
+    image.save(output, **FORMATS[format_name])
+    return output.getvalue()
+
+
+def make_variants(field, name):
+    """Write the variants of the upload `name` of `field`; returns {size: {format: storage name}}."""
+    storage = UserProfile._meta.get_field(field).storage
+    upload_to = UserProfile._meta.get_field(field).upload_to
+    sizes = VARIANTS[field]
+    with storage.open(name, 'rb') as file:
+        image = open_image(file, max(max(dimensions) for dimensions in sizes.values()))
+        image.load()
+    variants = {}
+    for size, dimensions in sizes.items():
+        resized = ImageOps.fit(image, dimensions, Image.Resampling.LANCZOS)
+        variants[size] = {}
+        for format_name in FORMATS:
+            content = encode(resized, format_name)
+            variant_name = '%svariants/%s.%s' % (upload_to, hashlib.sha256(content).hexdigest()[:32], format_name)
+            if not storage.exists(variant_name):
+                variant_name = storage.save(variant_name, ContentFile(content))
+            variants[size][format_name] = variant_name
+    return variants
+
+
+def outdated_fields(profile):
+    """The image fields of `profile` whose variants are missing or of an older upload."""
+    return [
+        field for field in VARIANTS
+        if getattr(profile, field).name and profile.image_variants.get(field, {}).get('source') != getattr(profile, field).name
+    ]
+
+
+def process_profile(profile_id, force=False):
+    """
+    Make the missing variants of a profile, or with `force` all of them
+    (after VARIANTS or FORMATS changed); returns whether it was updated.
+    """
+    profile = UserProfile.objects.filter(pk=profile_id).first()
+    if profile is None:
+        return False
+    fields = [field for field in VARIANTS if getattr(profile, field).name] if force else outdated_fields(profile)
+    if not fields:
+        return False
+    image_variants = {field: value for field, value in profile.image_variants.items() if getattr(profile, field).name}
+    for field in fields:
+        name = getattr(profile, field).name
+        try:
+            image_variants[field] = {'source': name, 'sizes': make_variants(field, name)}
+        except Exception:
+            # Not an image Pillow can read, or gone from the storage; the
+            # original keeps being served
+            logger.exception('Could not make variants of %s', name)
+            image_variants.pop(field, None)
+    # Only if the uploads are still the ones processed; a newer upload has
+    # queued its own run. update() sends no post_save, so the card is
+    # dropped here.
+    updated = UserProfile.objects.filter(
+        pk=profile_id, **{field: getattr(profile, field).name for field in VARIANTS}
+    ).update(image_variants=image_variants)
+    cards.invalidate(profile.user_id)
+    return bool(updated)
+
+
+def run(profile_id):
+    try:
+        process_profile(profile_id)
+    except Exception:
+        logger.exception('Processing the images of profile %s failed', profile_id)
+    finally:
+        close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process' image worker pool, or None when IMAGE_WORKERS is 0."""
+    global _executor
+    workers = get_setting('IMAGE_WORKERS', 2)
+    if not workers:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(workers, thread_name_prefix='images')
+    return _executor
+
+
+def schedule(profile_id):
+    """Process the profile's images once the current transaction commits."""
+    def submit():
+        executor = get_executor()
+        if executor is None:
+            process_profile(profile_id)
+        else:
+            executor.submit(run, profile_id)
+    transaction.on_commit(submit)
+
+
+def variant_names(image_variants, field, name):
+    """{size: {format: storage name}} of the upload `name`, empty if not processed yet."""
+    variants = (image_variants or {}).get(field)
+    if not name or not variants or variants.get('source') != name:
+        return {}
+    return variants['sizes']
+
+
+def variant_urls(profile, field, request=None):
+    storage = UserProfile._meta.get_field(field).storage
+    urls = {}
+    for size, formats in variant_names(profile.image_variants, field, getattr(profile, field).name).items():
+        urls[size] = {}
+        for format_name, name in formats.items():
+            url = storage.url(name)
+            urls[size][format_name] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+def card_avatar(image_variants, name):
+    """Storage name of the avatar shown on user cards, the original until processed."""
+    size, format_name = CARD_VARIANT
+    return variant_names(image_variants, 'profile_pic', name).get(size, {}).get(format_name, name)
@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from tweets import timeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill materialized home timelines. Pass --follower and --following "
+        "after a follow was accepted (or deleted, with --removed), --user to "
+        "rebuild single timelines, or nothing to rebuild every timeline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follower', type=int, help='Follower side of a changed follow.')
+        parser.add_argument('--following', type=int, help='Followed side of a changed follow.')
+        parser.add_argument('--removed', action='store_true', help='The follow was deleted rather than accepted.')
+        parser.add_argument('--user', type=int, action='append', default=[], help='Rebuild the timeline of this user id (repeatable).')
+
+    def handle(self, *args, **options):
+        follower, following = options['follower'], options['following']
+        if (follower is None) != (following is None):
+            raise CommandError('--follower and --following must be given together.')
+
+        if follower is not None:
+            if options['removed']:
+                timeline.remove_followee(follower, following)
+            else:
+                timeline.backfill_followee(follower, following)
+            self.stdout.write(self.style.SUCCESS('Backfilled timeline of user %s.' % follower))
+            return
+
+        user_ids = options['user'] or User.objects.values_list('id', flat=True).iterator()
+        count = 0
+        for user_id in user_ids:
+            timeline.rebuild_timeline(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d timeline(s).' % count))
@@ -0,0 +1,100 @@
+import json
+import subprocess
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tweets import cards
+from tweets.benchmarks import datagen, harness
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API endpoint in-process on synthetic datasets of "
+        "several sizes, in a throwaway test database. Reports p50/p95/p99 "
+        "latency, queries and rows loaded per request; --output writes JSON "
+        "to diff between commits, --compare prints the change against such a file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000', help='Comma separated numbers of users, one dataset each.')
+        parser.add_argument('--endpoint', action='append', default=[], choices=sorted(harness.ENDPOINTS),
+                            help='Endpoint to benchmark (repeatable), all by default.')
+        parser.add_argument('--requests', type=int, default=30, help='Requests per endpoint and dataset.')
+        parser.add_argument('--tweets-per-user', type=int, default=5)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes expects comma separated integers.')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as previous:
+                baseline = {run['users']: run['endpoints'] for run in json.load(previous)['runs']}
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        runs = []
+        try:
+            for size in sizes:
+                call_command('flush', interactive=False, verbosity=0)
+                cache.clear()
+                cards.local_cards.clear()
+                dataset = datagen.generate(
+                    users=size,
+                    tweets_per_user=options['tweets_per_user'],
+                    follows_per_user=options['follows_per_user'],
+                    seed=options['seed'],
+                )
+                self.stdout.write('Dataset: %s' % ', '.join('%s=%d' % item for item in dataset.items()))
+                results = harness.run(options['endpoint'], options['requests'], options['seed'])
+                runs.append({'users': size, 'dataset': dataset, 'endpoints': results})
+                for name, result in results.items():
+                    self.stdout.write(self.format_result(name, result, (baseline or {}).get(size, {}).get(name)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'commit': current_commit(), 'runs': runs}, output, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS('Benchmarked %d dataset(s).' % len(runs)))
+
+    def format_result(self, name, result, previous=None):
+        if not result['requests']:
+            return '  %-20s skipped' % name
+        line = '  %-20s p50 %7s  p95 %7s  p99 %7s  queries %5.1f  rows %7.1f  errors %d' % (
+            name,
+            self.format_ms(result['p50_ms']),
+            self.format_ms(result['p95_ms']),
+            self.format_ms(result['p99_ms']),
+            result['queries_mean'],
+            result['rows_mean'],
+            result['errors'],
+        )
+        if previous and previous.get('p50_ms') and result['p50_ms']:
+            line += '  (p50 %+.0f%%, queries %+.1f)' % (
+                100 * (result['p50_ms'] / previous['p50_ms'] - 1),
+                result['queries_mean'] - previous['queries_mean'],
+            )
+        return line
+
+    def format_ms(self, value):
+        return '-' if value is None else '%.1fms' % value
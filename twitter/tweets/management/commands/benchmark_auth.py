@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tweets import revocation
+from tweets.benchmarks import auth
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what authentication costs a request: a view returning the "
+        "user's id, authenticated by session, by simplejwt's database lookup "
+        "and by the token claims, in a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', action='append', default=[], choices=sorted(auth.METHODS),
+                            help='Method to benchmark (repeatable), all by default.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per method.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            revocation.reset()
+            results = auth.run(options['method'], options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        for name, result in results.items():
+            self.stdout.write('  %-13s p50 %7.1fus  p95 %7.1fus  p99 %7.1fus  queries %.1f' % (
+                name, result['p50_us'], result['p95_us'], result['p99_us'], result['queries_mean'],
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS('Benchmarked %d method(s).' % len(results)))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tweets.benchmarks import database
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare database configurations under concurrent like toggles and "
+        "feed reads, each in a throwaway test database. On SQLite Django's "
+        "default rollback journal is compared with the configured WAL mode; on "
+        "Postgres per-request, persistent and (with psycopg[pool]) pooled "
+        "connections. Select the database with the DB_* environment variables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--config', action='append', default=[], help='Configuration to run (repeatable), all by default.')
+        parser.add_argument('--users', type=int, default=300)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--write-ratio', type=float, default=0.5, help='Share of operations that toggle a like.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['config']) - set(database.configurations())
+        if unknown:
+            raise CommandError('Unknown configuration(s): %s. Available: %s.' % (
+                ', '.join(sorted(unknown)), ', '.join(database.configurations())))
+        results = database.run(
+            options['config'],
+            users=options['users'],
+            threads=options['threads'],
+            seconds=options['seconds'],
+            write_ratio=options['write_ratio'],
+            seed=options['seed'],
+        )
+        for name, operations in results.items():
+            self.stdout.write(name)
+            for operation, result in operations.items():
+                self.stdout.write(
+                    '  %-6s %8.1f ops/s  p50 %s  p95 %s  p99 %s  errors %d' % (
+                        operation, result['per_second'], self.format_ms(result['p50_ms']),
+                        self.format_ms(result['p95_ms']), self.format_ms(result['p99_ms']), result['errors'],
+                    )
+                )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS('Benchmarked %d configuration(s).' % len(results)))
+
+    def format_ms(self, value):
+        return '%7s' % ('-' if value is None else '%.1fms' % value)
@@ -0,0 +1,49 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from tweets import cards
+from tweets.benchmarks import datagen, serialization
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the CPU time of turning a page of tweets into JSON with "
+        "TweetSerializer or LeanTweetSerializer, rendered by DRF's "
+        "JSONRenderer or ORJSONRenderer, and the compressed sizes, in a "
+        "throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20, help='Pages serialized per combination.')
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            cache.clear()
+            cards.local_cards.clear()
+            datagen.generate(users=options['users'], seed=options['seed'])
+            results = serialization.run(options['page_size'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        for name, result in results.items():
+            line = '  %-12s serialize %6.2fms  render %5.2fms  total %6.2fms  %7d bytes' % (
+                name, result['serialize_ms'], result['render_ms'], result['total_ms'], result['bytes'],
+            )
+            for coding in ('br', 'gzip'):
+                if coding + '_bytes' in result:
+                    line += '  %s %6d (%.2fms)' % (coding, result[coding + '_bytes'], result[coding + '_ms'])
+            self.stdout.write(line)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS('Benchmarked %d combination(s).' % len(results)))
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tweets.benchmarks import startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure django.setup() plus the URLconf import, and the peak RSS, in "
+        "fresh processes like a starting worker. Fails when a budget "
+        "(STARTUP_BUDGET_SECONDS, STARTUP_BUDGET_RSS_MB) is exceeded or "
+        "scikit-learn/SciPy got imported at startup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Processes to start; the median time is reported.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        result = startup.measure(options['runs'])
+        self.stdout.write('startup %.3fs (median of %d)  peak RSS %.1f MB  heavy modules: %s' % (
+            result['seconds'], result['runs'], result['max_rss_mb'], ', '.join(result['heavy_modules']) or 'none',
+        ))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(result, output, indent=2, sort_keys=True)
+        problems = startup.over_budget(result)
+        if problems:
+            raise CommandError('Over the startup budget: %s.' % '; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Within the startup budget.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from tweets import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the user-similarity index used by recommended tweets. By default "
+        "the model is refitted and every user recomputed; --stale and --user "
+        "only score those users against the saved model (RECOMMENDATIONS_MODEL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true', help='Only recompute stale users.')
+        parser.add_argument('--user', type=int, action='append', default=[], help='Recompute this user id (repeatable).')
+        parser.add_argument('--top-k', type=int, help='Neighbours kept per user (default RECOMMENDATIONS_TOP_K).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users per sparse matrix product.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or None
+        if options['stale']:
+            user_ids = recommendations.stale_user_ids()
+        if user_ids is None:
+            count = recommendations.build_similarity_index(top_k=options['top_k'], batch_size=options['batch_size'])
+        else:
+            count = recommendations.refresh_users(user_ids, top_k=options['top_k'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Computed neighbours for %d user(s).' % count))
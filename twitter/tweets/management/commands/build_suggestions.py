@@ -0,0 +1,30 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from tweets import suggestions
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the \"who to follow\" suggestions in batches across a process "
+        "pool. By default every user who follows or liked anything is "
+        "recomputed; --stale only refreshes users whose follows changed or "
+        "whose suggestions are older than SUGGESTIONS_MAX_AGE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true', help='Only recompute stale users.')
+        parser.add_argument('--user', type=int, action='append', default=[], help='Recompute this user id (repeatable).')
+        parser.add_argument('--top-k', type=int, help='Suggestions kept per user (default SUGGESTIONS_TOP_K).')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users per sparse matrix product.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user'] or None
+        if options['stale']:
+            user_ids = suggestions.stale_user_ids()
+        count = suggestions.build_suggestions(
+            user_ids, top_k=options['top_k'], batch_size=options['batch_size'], workers=options['workers']
+        )
+        self.stdout.write(self.style.SUCCESS('Computed suggestions for %d user(s).' % count))
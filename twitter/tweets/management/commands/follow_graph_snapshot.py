@@ -0,0 +1,72 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from tweets import graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a snapshot of the follow graph index for processes to memory-map "
+        "at startup (FOLLOW_GRAPH_SNAPSHOT), and report its size per million "
+        "edges. --synthetic measures a generated graph of that many edges "
+        "instead of the Follow table; --benchmark times the index lookups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Snapshot path, FOLLOW_GRAPH_SNAPSHOT by default.')
+        parser.add_argument('--synthetic', type=int, help='Build a power-law graph with this many edges.')
+        parser.add_argument('--users', type=int, help='Users of the synthetic graph (default edges / 50).')
+        parser.add_argument('--benchmark', type=int, default=0, help='Time this many lookups of each kind.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['synthetic']:
+            follow_graph = self.synthetic_graph(options['synthetic'], options['users'])
+        else:
+            follow_graph = graph.FollowGraph.from_database()
+        built = time.perf_counter() - started
+
+        edges = follow_graph.edge_count
+        self.stdout.write('%d edges, %.1f MB, built in %.2fs' % (edges, follow_graph.nbytes / 2 ** 20, built))
+        if edges:
+            self.stdout.write('%.1f MB per million edges' % (follow_graph.nbytes / 2 ** 20 / edges * 10 ** 6))
+        if options['benchmark']:
+            self.benchmark(follow_graph, options['benchmark'])
+
+        # A synthetic graph is only written where explicitly asked to
+        path = options['output'] or (None if options['synthetic'] else graph.get_setting('FOLLOW_GRAPH_SNAPSHOT', None))
+        if path:
+            follow_graph.save(path)
+            self.stdout.write(self.style.SUCCESS('Wrote %s.' % path))
+        elif not options['synthetic']:
+            raise CommandError('Set FOLLOW_GRAPH_SNAPSHOT or pass --output.')
+
+    def synthetic_graph(self, edges, users=None):
+        users = users or max(2, edges // 50)
+        rng = np.random.default_rng(0)
+        followers = rng.integers(1, users + 1, size=edges)
+        # Pareto popularity: a few accounts have most of the followers
+        popularity = rng.pareto(1.2, size=users) + 1
+        followings = rng.choice(users, size=edges, p=popularity / popularity.sum()) + 1
+        keep = followers != followings
+        pairs = np.unique(np.stack([followers[keep], followings[keep]], axis=1), axis=0)
+        accepted = rng.random(len(pairs)) > 0.02
+        return graph.FollowGraph.from_edges(pairs[:, 0], pairs[:, 1], accepted)
+
+    def benchmark(self, follow_graph, count):
+        size = len(follow_graph.arrays['followees_indptr']) - 1
+        user_ids = [random.randrange(1, max(size, 2)) for _ in range(count)]
+        for name, lookup in (
+            ('followees', follow_graph.followees),
+            ('follows', lambda user_id: follow_graph.follows(user_id, user_ids[0])),
+            ('mutuals', follow_graph.mutuals),
+            ('two_hop', follow_graph.two_hop),
+        ):
+            started = time.perf_counter()
+            for user_id in user_ids:
+                lookup(user_id)
+            elapsed = time.perf_counter() - started
+            self.stdout.write('%-10s %8.1f us per lookup' % (name, elapsed / count * 10 ** 6))
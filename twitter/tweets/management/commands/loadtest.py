@@ -0,0 +1,48 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tweets.benchmarks import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test a running server, by default every sync endpoint next to "
+        "its async variant. Run it against the WSGI and the ASGI deployment "
+        "with equal worker counts to compare them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', default=[], help='Path to load (repeatable), may use {user} and {profile}.')
+        parser.add_argument('--user', type=int, default=1, help='User id substituted for {user}.')
+        parser.add_argument('--profile', type=int, default=1, help='Profile id substituted for {profile}.')
+        parser.add_argument('--token', help='JWT access token sent as a bearer token (async endpoints only).')
+        parser.add_argument('--session', help='Session id cookie, accepted by sync and async endpoints alike.')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--label', default='', help='Stored in the output, e.g. "wsgi-4-workers".')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = 'Bearer %s' % options['token']
+        if options['session']:
+            headers['Cookie'] = '%s=%s' % (settings.SESSION_COOKIE_NAME, options['session'])
+        results = []
+        for path in options['path'] or loadtest.DEFAULT_PATHS:
+            path = path.format(user=options['user'], profile=options['profile'])
+            result = loadtest.run(options['base_url'], path, options['requests'], options['concurrency'], headers)
+            results.append(result)
+            if result['p50_ms'] is None:
+                self.stdout.write(self.style.ERROR('%(path)-40s all %(errors)d requests failed' % result))
+                continue
+            self.stdout.write(
+                '%(path)-40s %(requests_per_second)8.1f req/s  p50 %(p50_ms).1f ms  p95 %(p95_ms).1f ms  '
+                'p99 %(p99_ms).1f ms  errors %(errors)d' % result
+            )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'label': options['label'], 'base_url': options['base_url'], 'results': results}, output, indent=2)
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+
+from tweets import images
+from tweets.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the resized variants of the profile pictures and headers that "
+        "have none yet, e.g. uploaded before variants existed. --force remakes "
+        "every profile's, after the sizes or formats changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Remake variants that are up to date.')
+        parser.add_argument('--workers', type=int, default=4, help='Worker threads.')
+
+    def handle(self, *args, **options):
+        with_images = Q()
+        for field in images.VARIANTS:
+            with_images |= Q(**{'%s__gt' % field: ''})
+        profile_ids = UserProfile.objects.filter(with_images).values_list('pk', flat=True)
+
+        def process(profile_id):
+            try:
+                return images.process_profile(profile_id, force=options['force'])
+            finally:
+                close_old_connections()
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as pool:
+                processed = sum(pool.map(process, profile_ids))
+        else:
+            processed = sum(images.process_profile(profile_id, force=options['force']) for profile_id in profile_ids)
+        self.stdout.write(self.style.SUCCESS('Processed the images of %d profile(s).' % processed))
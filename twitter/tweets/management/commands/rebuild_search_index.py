@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from tweets.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index over tweet content."
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the %s search index.' % type(backend).__name__))
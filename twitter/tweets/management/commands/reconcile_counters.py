@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tweets import counters
+
+
+class Command(BaseCommand):
+    help = "Recount tweet like/retweet/comment counters from the source tables and fold sharded counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tweets recounted per transaction.')
+
+    def handle(self, *args, **options):
+        drifted = counters.reconcile(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Reconciled counters, %d tweet(s) had drifted.' % drifted))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0009_timelineentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['-created_at', '-id'], name='tweet_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='tweet_user_created_id_idx'),
+        ),
+    ]
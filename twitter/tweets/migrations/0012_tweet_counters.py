@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Tweet = apps.get_model('tweets', 'Tweet')
+    sources = {
+        'like_count': apps.get_model('tweets', 'Like'),
+        'retweet_count': apps.get_model('tweets', 'Retweet'),
+        'comment_count': apps.get_model('tweets', 'Comment'),
+    }
+    for field, model in sources.items():
+        counts = model.objects.filter(tweet=OuterRef('pk')).order_by().values('tweet').annotate(total=Count('*')).values('total')
+        Tweet.objects.update(**{field: Coalesce(Subquery(counts), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0011_similaruser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='retweet_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TweetCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=20)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('delta', models.IntegerField(default=0)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='tweets.tweet')),
+            ],
+            options={
+                'unique_together': {('tweet', 'field', 'shard')},
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
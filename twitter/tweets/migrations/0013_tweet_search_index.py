@@ -0,0 +1,53 @@
+from django.db import DatabaseError, migrations
+
+# The schema as of this migration, deliberately not imported from
+# tweets/search.py: later changes there must not change what this does.
+FTS_TABLE = 'tweets_tweet_fts'
+SQLITE_FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tweets_tweet_fts USING fts5(content, content='tweets_tweet', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS tweets_tweet_fts_ai AFTER INSERT ON tweets_tweet BEGIN "
+    "INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS tweets_tweet_fts_ad AFTER DELETE ON tweets_tweet BEGIN "
+    "INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS tweets_tweet_fts_au AFTER UPDATE OF content ON tweets_tweet BEGIN "
+    "INSERT INTO tweets_tweet_fts(tweets_tweet_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO tweets_tweet_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+POSTGRES_INDEX = 'tweets_tweet_content_tsv_idx'
+
+
+def install_search_schema(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            try:
+                for statement in SQLITE_FTS_SCHEMA:
+                    cursor.execute(statement)
+            except DatabaseError:
+                # FTS5 not compiled in, search falls back to the in-process index
+                return
+            cursor.execute("INSERT INTO tweets_tweet_fts(tweets_tweet_fts) VALUES ('rebuild')")
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS tweets_tweet_content_tsv_idx ON tweets_tweet "
+            "USING GIN (to_tsvector('english'::regconfig, COALESCE(content, '')))"
+        )
+
+
+def remove_search_schema(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for trigger in ('ai', 'ad', 'au'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS %s_%s' % (FTS_TABLE, trigger))
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % POSTGRES_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0012_tweet_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_schema, remove_search_schema),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0015_userprofile_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['tweet', '-created_at'], name='comment_tweet_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(condition=models.Q(('is_accepted', False)), fields=['following', '-created_at'], name='follow_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(condition=models.Q(('is_accepted', True)), fields=['following', 'follower'], name='follow_accepted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', '-created_at'], name='like_user_created_idx'),
+        ),
+    ]
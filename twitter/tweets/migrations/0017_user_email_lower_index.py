@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+# On the user table, which belongs to another app, so created here
+EMAIL_INDEX = models.Index(Lower('email'), name='user_email_lower_idx')
+
+
+def add_email_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model(settings.AUTH_USER_MODEL), EMAIL_INDEX)
+
+
+def remove_email_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model(settings.AUTH_USER_MODEL), EMAIL_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0016_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(add_email_index, remove_email_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0020_similaritystate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_tweet_path_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['tweet', 'path'], name='comment_tweet_path_like_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+    ]
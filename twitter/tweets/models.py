@@ -4,15 +4,52 @@ from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
+from django.db.models import F, Prefetch
+from django.db.models.functions import RowNumber
+from django.db.models.expressions import Window
 
 
 # models.py in the 'tweets' app
+def latest_comments_queryset(limit=3):
+    # The `limit` latest comments of every tweet, in one windowed query
+    return Comment.objects.annotate(
+        row_number=Window(RowNumber(), partition_by=F('tweet_id'), order_by=F('created_at').desc())
+    ).filter(row_number__lte=limit).order_by('-created_at')
+
+
+class TweetQuerySet(models.QuerySet):
+    def for_serializer(self, comments_preview=3):
+        """
+        Fetch everything TweetSerializer renders in a constant number of
+        queries per page: the author and profile are joined, the counters
+        are read from the denormalized columns and the latest comments of the
+        whole page are prefetched with one windowed query.
+        """
+        from .counters import counter_expression
+        latest_comments = latest_comments_queryset(comments_preview)
+        return self.select_related('user__userprofile').annotate(
+            likes_total=counter_expression('like_count'),
+            retweets_total=counter_expression('retweet_count'),
+            comments_total=counter_expression('comment_count'),
+        ).prefetch_related(Prefetch('comment_set', queryset=latest_comments, to_attr='latest_comments'))
+
+
 class Tweet(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     retweets = models.ManyToManyField(User, related_name='retweeted_tweets', blank=True)
-    
+    # Denormalized counters, kept current by tweets/counters.py
+    like_count = models.IntegerField(default=0)
+    retweet_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    objects = TweetQuerySet.as_manager()
+    class Meta:
+        # Keyset pagination walks (created_at, id) newest first, see pagination.py
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='tweet_created_id_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='tweet_user_created_id_idx'),
+        ]
 
 class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -21,12 +58,34 @@ class Like(models.Model):
     class Meta:
         # Ensure the combination of follower and following is unique
         unique_together = ['user', 'tweet']
+        # A user's likes newest first, and their latest like
+        indexes = [models.Index(fields=['user', '-created_at'], name='like_user_created_idx')]
 
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Replies: the comment replied to, and the ids of all its ancestors as
+    # "12.34." (empty for top-level comments), see tweets/comments.py
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE)
+    path = models.CharField(max_length=255, blank=True, default='')
+    reply_count = models.PositiveIntegerField(default=0)
+    class Meta:
+        indexes = [
+            # The latest comments of a tweet, see latest_comments_queryset()
+            models.Index(fields=['tweet', '-created_at'], name='comment_tweet_created_idx'),
+            # Keyset pages of a tweet's top-level comments or of a comment's replies
+            models.Index(fields=['tweet', 'parent', '-created_at', '-id'], name='comment_thread_page_idx'),
+            # Subtrees, as paths starting with a prefix. On Postgres the
+            # pattern opclass lets LIKE 'prefix%' use it whatever the collation
+            models.Index(fields=['tweet', 'path'], opclasses=['int8_ops', 'varchar_pattern_ops'], name='comment_tweet_path_like_idx'),
+        ]
+    def save(self, *args, **kwargs):
+        if self.parent_id is not None and not self.path:
+            from .comments import child_path
+            self.path = child_path(self.parent)
+        super().save(*args, **kwargs)
     # models.py in the 'tweets' app
 class UserProfile(models.Model):
     phone_number_regex = RegexValidator(
@@ -41,6 +100,8 @@ class UserProfile(models.Model):
     joined_date = models.DateTimeField(auto_now_add=True)
     birth_date = models.DateField(blank=True, null=True)
     is_public = models.BooleanField(default=True, null=False)
+    # Storage names of the resized copies of the images, see tweets/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 # models.py in the 'tweets' app
 
 class Retweet(models.Model):
@@ -60,9 +121,83 @@ class Follow(models.Model):
     class Meta:
         # Ensure the combination of follower and following is unique
         unique_together = ['follower', 'following']
+        indexes = [
+            # An account's pending requests, newest first
+            models.Index(
+                fields=['following', '-created_at'], condition=models.Q(is_accepted=False), name='follow_pending_idx'
+            ),
+            # An account's followers, without reading the rows (fan-out)
+            models.Index(
+                fields=['following', 'follower'], condition=models.Q(is_accepted=True), name='follow_accepted_idx'
+            ),
+        ]
     def clean(self):
         if self.follower == self.following:
             raise ValidationError("Follower and following cannot be the same.")
         # Call the parent class's clean method
         super().clean()
 
+
+# models.py in the 'tweets' app
+class TimelineEntry(models.Model):
+    # One row per tweet pushed into a user's materialized home timeline,
+    # see tweets/timeline.py
+    user = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
+    class Meta:
+        # Also serves the (user, -tweet_id) range scan used to read a timeline
+        unique_together = ['user', 'tweet']
+
+# models.py in the 'tweets' app
+class SimilarUser(models.Model):
+    # Top-K neighbours by liked-content similarity, built offline by
+    # tweets/recommendations.py
+    user = models.ForeignKey(User, related_name='similar_users', on_delete=models.CASCADE)
+    similar_user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+    class Meta:
+        unique_together = ['user', 'similar_user']
+        indexes = [models.Index(fields=['user', '-score'], name='similaruser_user_score_idx')]
+
+# models.py in the 'tweets' app
+class SimilarityState(models.Model):
+    # When a user's neighbours were last computed, also for users who have
+    # none, see tweets/recommendations.py
+    user = models.OneToOneField(User, primary_key=True, related_name='+', on_delete=models.CASCADE)
+    computed_at = models.DateTimeField()
+
+# models.py in the 'tweets' app
+class TweetCounterShard(models.Model):
+    # Pending counter deltas of hot tweets, spread over several rows to avoid
+    # lock contention on the tweet row, see tweets/counters.py
+    tweet = models.ForeignKey(Tweet, related_name='counter_shards', on_delete=models.CASCADE)
+    field = models.CharField(max_length=20)
+    shard = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(default=0)
+    class Meta:
+        unique_together = ['tweet', 'field', 'shard']
+
+# models.py in the 'tweets' app
+class FollowSuggestion(models.Model):
+    # "Who to follow" candidates ranked by tweets/suggestions.py
+    user = models.ForeignKey(User, related_name='follow_suggestions', on_delete=models.CASCADE)
+    suggested_user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+    class Meta:
+        unique_together = ['user', 'suggested_user']
+        indexes = [models.Index(fields=['user', '-score'], name='suggestion_user_score_idx')]
+
+# models.py in the 'tweets' app
+class SuggestionState(models.Model):
+    # When a user's suggestions were computed, and whether their follows
+    # changed since
+    user = models.OneToOneField(User, primary_key=True, related_name='+', on_delete=models.CASCADE)
+    computed_at = models.DateTimeField()
+    stale = models.BooleanField(default=False)
+
+# models.py in the 'tweets' app
+class RevokedToken(models.Model):
+    # JWTs revoked before they expire (logout), see tweets/revocation.py
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
@@ -0,0 +1,142 @@
+import binascii
+from base64 import b64decode, b64encode
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Cursor pagination keyed on (created_at, id), newest first.
+
+    Pages are read with a `WHERE (created_at, id) < cursor` range scan on the
+    composite index instead of COUNT(*) + OFFSET, so deep pages cost the same
+    as the first one and rows inserted while a client pages through do not
+    shift the pages it has yet to read. No total count is returned.
+
+    Polling clients pass the `since` link of the last response to fetch only
+    newer rows; they are returned oldest-first in slices of page_size so that
+    nothing is skipped, and `since` moves forward with each response.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    since_query_param = 'since'
+    ordering_field = 'created_at'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """The sliced queryset of one page (plus one row to detect more)."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_page_size(request)
+        field = self.ordering_field
+
+        since = request.query_params.get(self.since_query_param)
+        self.is_polling = bool(since)
+        if since:
+            value, pk = self.since_position = self.decode_cursor(since)
+            newer = Q(**{field + '__gt': value}) | Q(**{field: value, 'id__gt': pk})
+            return queryset.filter(newer).order_by(field, 'id')[:self.limit + 1]
+
+        queryset = queryset.order_by('-' + field, '-id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            older = Q(**{field + '__lt': value}) | Q(**{field: value, 'id__lt': pk})
+            queryset = queryset.filter(older)
+        self.since_position = None
+        return queryset[:self.limit + 1]
+
+    def set_page(self, rows):
+        self.has_more = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        if self.is_polling:
+            # Polled rows come oldest first, hand them out newest first
+            self.page.reverse()
+        if self.page:
+            self.since_position = self.position(self.page[0])
+        return self.page
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return pagination._positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def position(self, instance):
+        if isinstance(instance, dict):
+            # A .values() row
+            return instance[self.ordering_field], instance['id']
+        return getattr(instance, self.ordering_field), instance.pk
+
+    def encode_cursor(self, position):
+        value, pk = position
+        raw = '%s|%s' % (value.isoformat(), pk)
+        return b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        try:
+            value, pk = b64decode(encoded.encode('ascii'), validate=True).decode('ascii').split('|')
+            value, pk = datetime.fromisoformat(value), int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        # encode_cursor() writes the offset of aware datetimes
+        if settings.USE_TZ and timezone.is_naive(value):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def get_next_link(self):
+        if self.is_polling or not self.has_more:
+            return None
+        url = remove_query_param(self.base_url, self.since_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.position(self.page[-1])))
+
+    def get_since_link(self):
+        if self.since_position is None:
+            return None
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.since_query_param, self.encode_cursor(self.since_position))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'since': self.get_since_link(),
+            'has_more': self.has_more,
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        link = {'type': 'string', 'nullable': True, 'format': 'uri'}
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': link,
+                'since': link,
+                'has_more': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,247 @@
+"""
+Per-request profiling, aggregated per view class.
+
+With PROFILING_ENABLED, ProfilingMiddleware profiles a PROFILING_SAMPLE_RATE
+share of the requests and records for each view class:
+
+* the number of queries and the time spent in the database, through an
+  execute wrapper installed on every connection
+* repeated queries: the same SQL issued PROFILING_DUPLICATE_THRESHOLD times
+  or more in one request, usually an N+1, with the application stack that
+  issued it
+* named sections timed with `timed()`: list serialization, TF-IDF
+  vectorization and the similarity product of the recommendations
+
+Every request is counted with its latency, sampled or not. The aggregates
+are served to staff users by ProfilingMetricsView, as JSON or, with
+?format=prometheus, in the Prometheus text format. When profiling is
+disabled the middleware removes itself and `timed()` reduces to a context
+variable lookup.
+"""
+import random
+import threading
+import time
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework import renderers
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+# Stack frames kept for a repeated query, and examples kept per view
+STACK_DEPTH = 8
+MAX_REPEATED_QUERIES = 10
+
+_current = ContextVar('tweets_request_profile', default=None)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def application_stack():
+    """The innermost frames of the current stack that belong to the project."""
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return ['%s:%d in %s' % (frame.filename[len(base_dir) + 1:], frame.lineno, frame.name) for frame in frames[-STACK_DEPTH:]]
+
+
+class RequestProfile:
+    def __init__(self, duplicate_threshold):
+        self.duplicate_threshold = duplicate_threshold
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.sql_counts = defaultdict(int)
+        self.repeated = {}  # sql -> application stack at the threshold
+        self.sections = defaultdict(float)
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        self.sql_counts[sql] += 1
+        if self.sql_counts[sql] == self.duplicate_threshold:
+            self.repeated[sql] = application_stack()
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - start)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timed(section):
+    """Add the time spent in the block to `section` of the current profile."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[section] += time.perf_counter() - start
+
+
+class Registry:
+    """Aggregates of the profiled requests of this process, per view."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.views = {}
+
+    def new_stats(self):
+        return {
+            'requests': 0,
+            'seconds': 0.0,
+            'max_seconds': 0.0,
+            'sampled': 0,
+            'queries': 0,
+            'db_seconds': 0.0,
+            'repeated_queries': 0,
+            'sections': defaultdict(float),
+            'repeated': {},
+        }
+
+    def record(self, view, seconds, profile):
+        with self._lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = self.new_stats()
+            stats['requests'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if profile is None:
+                return
+            stats['sampled'] += 1
+            stats['queries'] += profile.queries
+            stats['db_seconds'] += profile.db_seconds
+            for section, section_seconds in profile.sections.items():
+                stats['sections'][section] += section_seconds
+            for sql, stack in profile.repeated.items():
+                count = profile.sql_counts[sql]
+                stats['repeated_queries'] += count - 1
+                example = stats['repeated'].get(sql)
+                if example is not None:
+                    example['requests'] += 1
+                    example['max_count'] = max(example['max_count'], count)
+                elif len(stats['repeated']) < MAX_REPEATED_QUERIES:
+                    stats['repeated'][sql] = {'requests': 1, 'max_count': count, 'stack': stack}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view: dict(
+                    stats,
+                    sections=dict(stats['sections']),
+                    repeated=[dict(example, sql=sql) for sql, example in stats['repeated'].items()],
+                )
+                for view, stats in self.views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+
+
+registry = Registry()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not get_setting('PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = get_setting('PROFILING_SAMPLE_RATE', 1.0)
+        self.duplicate_threshold = get_setting('PROFILING_DUPLICATE_THRESHOLD', 5)
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        profile = RequestProfile(self.duplicate_threshold) if random.random() < self.sample_rate else None
+        token = _current.set(profile)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        view = getattr(request, '_profiling_view', None)
+        if view is not None:
+            registry.record(view, time.perf_counter() - start, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        request._profiling_view = (view_class or view_func).__name__
+        # Connections opened before the signal was connected, e.g. by
+        # earlier middleware of this thread
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+
+PROMETHEUS_METRICS = [
+    ('requests_total', 'counter', 'requests', 'Requests handled.'),
+    ('request_seconds_total', 'counter', 'seconds', 'Time spent handling requests.'),
+    ('request_seconds_max', 'gauge', 'max_seconds', 'Slowest request.'),
+    ('sampled_requests_total', 'counter', 'sampled', 'Requests profiled.'),
+    ('queries_total', 'counter', 'queries', 'Queries issued by profiled requests.'),
+    ('db_seconds_total', 'counter', 'db_seconds', 'Database time of profiled requests.'),
+    ('repeated_queries_total', 'counter', 'repeated_queries', 'Repetitions of queries issued repeatedly in one request.'),
+]
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if 'views' not in data:
+            # An error response
+            return '# %s\n' % data.get('detail', '')
+        lines = []
+        views = sorted(data['views'].items())
+        for name, kind, key, description in PROMETHEUS_METRICS:
+            lines.append('# HELP tweets_%s %s' % (name, description))
+            lines.append('# TYPE tweets_%s %s' % (name, kind))
+            lines.extend('tweets_%s{view="%s"} %s' % (name, view, stats[key]) for view, stats in views)
+        lines.append('# HELP tweets_section_seconds_total Time spent in profiled sections.')
+        lines.append('# TYPE tweets_section_seconds_total counter')
+        for view, stats in views:
+            for section, seconds in sorted(stats['sections'].items()):
+                lines.append('tweets_section_seconds_total{view="%s",section="%s"} %s' % (view, section, seconds))
+        return '\n'.join(lines) + '\n'
+
+
+class ProfilingMetricsView(APIView):
+    permission_classes = [IsAdminUser]
+    renderer_classes = [renderers.JSONRenderer, PrometheusRenderer]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'enabled': get_setting('PROFILING_ENABLED', False),
+            'sample_rate': get_setting('PROFILING_SAMPLE_RATE', 1.0),
+            'views': registry.snapshot(),
+        })
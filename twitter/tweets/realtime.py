@@ -0,0 +1,172 @@
+"""
+Real-time timeline events for the /api/stream/ Server-Sent Events endpoint.
+
+The signal handlers in tweets/signals.py publish an event when a Tweet, Like
+or Comment is created (or a like removed). It is delivered after the commit
+to the connected subscribers among the author's accepted followers, and to
+the author. Delivery goes through a broker selected by the REALTIME_BROKER
+setting. InProcessBroker keeps the subscriptions of the current process in
+memory. Another broker, for example one backed by a local pub/sub server,
+only needs the same four methods.
+
+Each connection has a Subscription that coalesces what it has not sent yet:
+new tweet ids are kept up to REALTIME_MAX_PENDING, and counter changes are
+summed per tweet. A slow client therefore never queues more than that.
+When it falls further behind, it is told to resync, i.e. to refetch its
+feed.
+"""
+import asyncio
+import threading
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Follow, Tweet
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Subscription:
+    """Pending events of one connection, owned by its event loop."""
+
+    def __init__(self, user_id, loop, max_pending):
+        self.user_id = user_id
+        self.loop = loop
+        self.max_pending = max_pending
+        self.tweet_ids = deque()
+        self.counters = defaultdict(Counter)
+        self.resync = False
+        self.ready = asyncio.Event()
+
+    def offer(self, event):
+        """Queue an event; safe to call from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._add, event)
+        except RuntimeError:
+            # The connection's loop is closed, it will unsubscribe shortly
+            pass
+
+    def _add(self, event):
+        if event['type'] == 'tweet':
+            self.tweet_ids.append(event['id'])
+            if len(self.tweet_ids) > self.max_pending:
+                self.tweet_ids.popleft()
+                self.resync = True
+        else:
+            self.counters[event['tweet']].update(event['deltas'])
+            if len(self.counters) > self.max_pending:
+                self.counters.clear()
+                self.resync = True
+        self.ready.set()
+
+    async def next_batch(self, coalesce_seconds=0):
+        """Wait for events, then return everything pending as one batch."""
+        await self.ready.wait()
+        if coalesce_seconds:
+            # Let a burst of likes on the same tweet collapse into one delta
+            await asyncio.sleep(coalesce_seconds)
+        self.ready.clear()
+        events = []
+        if self.resync:
+            events.append({'type': 'resync'})
+            self.resync = False
+        events.extend({'type': 'tweet', 'id': tweet_id} for tweet_id in self.tweet_ids)
+        self.tweet_ids.clear()
+        for tweet_id, deltas in self.counters.items():
+            deltas = {name: value for name, value in deltas.items() if value}
+            if deltas:
+                events.append({'type': 'counters', 'tweet': tweet_id, **deltas})
+        self.counters.clear()
+        return events
+
+
+class InProcessBroker:
+    """Delivers events to the subscriptions held by this process."""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop(), get_setting('REALTIME_MAX_PENDING', 100))
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def connected_user_ids(self):
+        with self._lock:
+            return set(self._subscriptions)
+
+    def publish(self, user_ids, event):
+        with self._lock:
+            subscriptions = [sub for user_id in user_ids for sub in self._subscriptions.get(user_id, ())]
+        for subscription in subscriptions:
+            subscription.offer(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(get_setting('REALTIME_BROKER', 'tweets.realtime.InProcessBroker'))()
+    return _broker
+
+
+def recipients(author_id):
+    """Connected users who should hear about activity on author_id's tweets."""
+    connected = get_broker().connected_user_ids()
+    if not connected:
+        return set()
+    followers = Follow.objects.filter(following_id=author_id, is_accepted=True)
+    if len(connected) <= 500:
+        followers = followers.filter(follower_id__in=connected)
+    user_ids = set(followers.values_list('follower_id', flat=True)) & connected
+    if author_id in connected:
+        user_ids.add(author_id)
+    return user_ids
+
+
+def publish_after_commit(author_id, event):
+    def publish():
+        user_ids = recipients(author_id)
+        if user_ids:
+            get_broker().publish(user_ids, event)
+    transaction.on_commit(publish)
+
+
+def tweet_created(tweet):
+    if get_broker().connected_user_ids():
+        publish_after_commit(tweet.user_id, {'type': 'tweet', 'id': tweet.pk})
+
+
+def tweet_author(tweet_id):
+    """Lazy author lookup for counters_changed()."""
+    return lambda: Tweet.objects.filter(pk=tweet_id).values_list('user_id', flat=True).first()
+
+
+def counters_changed(tweet_id, author_id, **deltas):
+    """`author_id` may be a callable, only evaluated if anyone is listening."""
+    if get_broker().connected_user_ids():
+        if callable(author_id):
+            author_id = author_id()
+        if author_id is None:
+            # The tweet itself is being deleted
+            return
+        publish_after_commit(author_id, {'type': 'counters', 'tweet': tweet_id, 'deltas': deltas})
@@ -0,0 +1,325 @@
+"""
+Offline user-similarity index for RecommendedTweetsListView.
+
+The liked content of every user is read with a single query, vectorized once
+into a sparse user x term TF-IDF matrix and the top-K neighbours of each user
+are found with one sparse matrix product per batch of rows. Results are
+stored in the SimilarUser table, so a request only does an indexed lookup,
+and each user's SimilarityState marks when that was, also for users who have
+no neighbours.
+
+The index is built by the build_similarity_index command, which also keeps
+the fitted vocabulary, IDF weights and user x term matrix as a
+SimilarityModel: in the process, and in the RECOMMENDATIONS_MODEL file, if
+set, for other processes to load. Users who liked something since their rows
+were computed, or whose rows are older than RECOMMENDATIONS_INDEX_MAX_AGE,
+are still served their rows and queued for a refresh by a background thread
+(RECOMMENDATIONS_WORKERS). The refresh vectorizes only their likes against
+the model and scores them against its matrix; without a model it builds the
+whole index once. Unlikes are only picked up by a full rebuild.
+
+scikit-learn takes longer to import than Django and the rest of the project
+together, so it is only imported once an index is built. With
+RECOMMENDATIONS_WARM_UP the app imports it at startup instead, e.g. before a
+preforking server forks its workers.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import profiling
+from .models import Like, SimilarityState, SimilarUser
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def warm_up():
+    """Import what building the index needs, ahead of the first request."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    TfidfVectorizer().fit_transform(['warm up'])
+
+
+def liked_documents(user_ids=None):
+    """{user_id: everything the user liked, as one document}, of `user_ids` or every user."""
+    likes = Like.objects.all() if user_ids is None else Like.objects.filter(user_id__in=user_ids)
+    documents = defaultdict(list)
+    for user_id, content in likes.values_list('user_id', 'tweet__content').iterator():
+        documents[user_id].append(content)
+    return {user_id: '\n'.join(contents) for user_id, contents in documents.items()}
+
+
+class SimilarityModel:
+    """
+    The fitted vocabulary and IDF weights, and the TF-IDF rows of the users
+    (user_ids[i] is row i of `matrix`). Rows are L2-normalized, so the dot
+    product of two rows is their cosine similarity.
+    """
+
+    def __init__(self, terms, idf, user_ids, matrix):
+        self.terms = terms
+        self.idf = idf
+        self.user_ids = user_ids
+        self.matrix = matrix
+        self.positions = {user_id: row for row, user_id in enumerate(user_ids.tolist())}
+
+    @classmethod
+    def fit(cls, documents):
+        """Fit on {user_id: document}; None if there is no vocabulary."""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        user_ids = sorted(documents)
+        if not user_ids:
+            return None
+        vectorizer = TfidfVectorizer()
+        try:
+            with profiling.timed('tfidf'):
+                matrix = vectorizer.fit_transform([documents[user_id] for user_id in user_ids])
+        except ValueError:
+            # Empty vocabulary, e.g. only stop words were liked
+            return None
+        return cls(vectorizer.get_feature_names_out().astype(str), vectorizer.idf_, np.array(user_ids, dtype=np.int64), matrix.tocsr())
+
+    def vectors(self, documents):
+        """TF-IDF rows of `documents` over the fitted vocabulary, as TfidfVectorizer makes them."""
+        from scipy import sparse
+        from sklearn.feature_extraction.text import CountVectorizer
+        from sklearn.preprocessing import normalize
+
+        counts = CountVectorizer(vocabulary=self.terms).transform(documents)
+        return normalize(counts @ sparse.diags(self.idf), copy=False).tocsr()
+
+    @classmethod
+    def load(cls, path):
+        from scipy import sparse
+
+        with np.load(path, allow_pickle=False) as arrays:
+            matrix = sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape'])
+            )
+            return cls(arrays['terms'], arrays['idf'], arrays['user_ids'], matrix)
+
+    def save(self, path):
+        """Write the model to `path`, atomically."""
+        tmp_path = '%s.tmp%d' % (path, os.getpid())
+        with open(tmp_path, 'wb') as output:
+            np.savez(
+                output, terms=self.terms, idf=self.idf, user_ids=self.user_ids, data=self.matrix.data,
+                indices=self.matrix.indices, indptr=self.matrix.indptr, shape=np.array(self.matrix.shape),
+            )
+        os.replace(tmp_path, path)
+
+
+_model = None
+_model_mtime = None
+_model_lock = threading.Lock()
+# Users queued for a refresh, not queued again until it ran
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def get_model():
+    """The latest model built by this process or written to RECOMMENDATIONS_MODEL, if any."""
+    global _model, _model_mtime
+    path = get_setting('RECOMMENDATIONS_MODEL', None)
+    if path:
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime != _model_mtime:
+            with _model_lock:
+                if mtime != _model_mtime:
+                    _model = SimilarityModel.load(path)
+                    _model_mtime = mtime
+    return _model
+
+
+def reset():
+    """Forget the process' model and queued refreshes."""
+    global _model, _model_mtime
+    with _model_lock:
+        _model = _model_mtime = None
+    with _pending_lock:
+        _pending.clear()
+
+
+def set_model(model):
+    global _model, _model_mtime
+    path = get_setting('RECOMMENDATIONS_MODEL', None)
+    with _model_lock:
+        if model is not None and path:
+            model.save(path)
+            _model_mtime = os.stat(path).st_mtime
+        _model = model
+
+
+def top_neighbours(model, query_user_ids, vectors, top_k):
+    """Yield (user_id, similar_user_id, score) for the TF-IDF rows of query_user_ids."""
+    with profiling.timed('cosine_similarity'):
+        similarities = (vectors @ model.matrix.T).tocsr()
+    for offset, user_id in enumerate(query_user_ids):
+        start, end = similarities.indptr[offset], similarities.indptr[offset + 1]
+        neighbour_ids = model.user_ids[similarities.indices[start:end]]
+        scores = similarities.data[start:end]
+        keep = (neighbour_ids != user_id) & (scores > 0)
+        neighbour_ids, scores = neighbour_ids[keep], scores[keep]
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            neighbour_ids, scores = neighbour_ids[best], scores[best]
+        for neighbour_id, score in zip(neighbour_ids, scores):
+            yield user_id, int(neighbour_id), float(score)
+
+
+def store(user_ids, neighbours, computed_at):
+    """Replace the neighbours of `user_ids` and mark them computed."""
+    with transaction.atomic():
+        SimilarUser.objects.filter(user_id__in=user_ids).delete()
+        SimilarUser.objects.bulk_create(
+            [SimilarUser(user_id=user_id, similar_user_id=similar_id, score=score, computed_at=computed_at)
+             for user_id, similar_id, score in neighbours],
+            batch_size=1000,
+        )
+        SimilarityState.objects.bulk_create(
+            [SimilarityState(user_id=user_id, computed_at=computed_at) for user_id in user_ids],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['computed_at'],
+            batch_size=1000,
+        )
+
+
+def build_similarity_index(only_user_ids=None, top_k=None, batch_size=1000):
+    """
+    Refit the model on every user's likes and (re)compute the neighbours of
+    `only_user_ids`, or of every user. Returns the number of users computed.
+    """
+    top_k = top_k or get_setting('RECOMMENDATIONS_TOP_K', 20)
+    computed_at = timezone.now()
+    model = SimilarityModel.fit(liked_documents())
+    set_model(model)
+    if only_user_ids is None:
+        user_ids = model.user_ids.tolist() if model is not None else []
+        # Users who no longer like anything
+        SimilarUser.objects.exclude(user_id__in=user_ids).delete()
+        SimilarityState.objects.exclude(user_id__in=user_ids).update(computed_at=computed_at)
+    else:
+        user_ids = sorted(set(only_user_ids))
+
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        neighbours = []
+        if model is not None:
+            liking = [user_id for user_id in batch if user_id in model.positions]
+            rows = model.matrix[[model.positions[user_id] for user_id in liking]]
+            neighbours = list(top_neighbours(model, liking, rows, top_k))
+        store(batch, neighbours, computed_at)
+    return len(user_ids)
+
+
+def refresh_users(user_ids, top_k=None, batch_size=1000):
+    """
+    Recompute the neighbours of `user_ids` from their current likes against
+    the model, without refitting it; builds the whole index if there is no
+    model yet. Returns the number of users computed.
+    """
+    model = get_model()
+    if model is None:
+        return build_similarity_index(top_k=top_k, batch_size=batch_size)
+    top_k = top_k or get_setting('RECOMMENDATIONS_TOP_K', 20)
+    computed_at = timezone.now()
+    user_ids = sorted(set(user_ids))
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        documents = liked_documents(batch)
+        liking = [user_id for user_id in batch if user_id in documents]
+        neighbours = []
+        if liking:
+            vectors = model.vectors([documents[user_id] for user_id in liking])
+            neighbours = list(top_neighbours(model, liking, vectors, top_k))
+        store(batch, neighbours, computed_at)
+    return len(user_ids)
+
+
+def stale_user_ids():
+    """Users who liked a tweet after their neighbours were last computed."""
+    computed = dict(SimilarityState.objects.values_list('user', 'computed_at'))
+    return [
+        user_id
+        for user_id, liked_at in Like.objects.values('user').annotate(last=Max('created_at')).values_list('user', 'last')
+        if user_id not in computed or computed[user_id] < liked_at
+    ]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process' refresh thread pool, or None when RECOMMENDATIONS_WORKERS is 0."""
+    global _executor
+    workers = get_setting('RECOMMENDATIONS_WORKERS', 1)
+    if not workers:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(workers, thread_name_prefix='recommendations')
+    return _executor
+
+
+def run(user_id):
+    try:
+        refresh_users([user_id])
+    except Exception:
+        logger.exception('Refreshing the neighbours of user %s failed', user_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(user_id)
+        close_old_connections()
+
+
+def schedule(user_id):
+    """Refresh the user's neighbours in the background, unless already queued."""
+    def submit():
+        with _pending_lock:
+            if user_id in _pending:
+                return
+            _pending.add(user_id)
+        executor = get_executor()
+        if executor is None:
+            run(user_id)
+        else:
+            executor.submit(run, user_id)
+    transaction.on_commit(submit)
+
+
+def similar_user_ids(user, limit=None):
+    """
+    Neighbour ids of `user`, most similar first, as last computed. When they
+    are missing, too old, or the user liked something since, the user is
+    queued for a refresh.
+    """
+    rows = list(SimilarUser.objects.filter(user=user).order_by('-score').values_list('similar_user_id', flat=True)[:limit])
+    max_age = timedelta(seconds=get_setting('RECOMMENDATIONS_INDEX_MAX_AGE', 24 * 60 * 60))
+    state = SimilarityState.objects.filter(user=user).first()
+    if state is None or state.computed_at < timezone.now() - max_age:
+        stale = state is not None or Like.objects.filter(user=user).exists()
+    else:
+        stale = Like.objects.filter(user=user, created_at__gt=state.computed_at).exists()
+    if stale:
+        schedule(user.id)
+    return rows
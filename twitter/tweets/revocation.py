@@ -0,0 +1,144 @@
+"""
+Denylist of revoked JWTs, checked without a query per request.
+
+Access tokens are validated from their signature and claims alone (see
+tweets/tokens.py), so revoking one before it expires (logout) needs a list
+every process checks. The RevokedToken table is that list; each process
+mirrors the ids (jti) in it into a Bloom filter:
+
+* a jti not in the filter is not revoked, no query;
+* a jti in the filter is revoked, or a false positive at a rate of about
+  REVOCATION_BLOOM_ERROR_RATE, so it is confirmed against the table.
+
+The filter is brought up to date with the rows added since the last sync
+once it is REVOCATION_SYNC_SECONDS old, and rebuilt without the expired
+tokens every REVOCATION_REBUILD_SECONDS. Tokens revoked by this process are
+added right away, other processes see them within REVOCATION_SYNC_SECONDS.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import router
+from django.utils import timezone
+
+from .models import RevokedToken
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def tokens():
+    # Read from the primary, a replica may not have a fresh revocation yet
+    return RevokedToken.objects.db_manager(router.db_for_write(RevokedToken))
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives."""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: position i is h1 + i * h2
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class Denylist:
+    """A process' view of RevokedToken: a Bloom filter, synced periodically."""
+
+    def __init__(self):
+        self._filter = None
+        self._last_id = 0
+        self._synced_at = 0
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        now = timezone.now()
+        rows = list(tokens().filter(expires_at__gt=now).values_list('id', 'jti'))
+        capacity = max(get_setting('REVOCATION_BLOOM_CAPACITY', 100000), 2 * len(rows))
+        bloom = BloomFilter(capacity, get_setting('REVOCATION_BLOOM_ERROR_RATE', 0.001))
+        for _, jti in rows:
+            bloom.add(jti)
+        self._filter = bloom
+        self._last_id = max((row_id for row_id, _ in rows), default=self._last_id)
+        self._built_at = self._synced_at = time.monotonic()
+
+    def _sync(self):
+        # A revocation committed after one with a higher id is only seen at
+        # the next rebuild; revocations are single-row autocommits
+        rows = list(tokens().filter(id__gt=self._last_id).order_by('id').values_list('id', 'jti'))
+        for row_id, jti in rows:
+            self._filter.add(jti)
+            self._last_id = row_id
+        self._synced_at = time.monotonic()
+        # Too full for the error rate, rebuild at the next check
+        if self._filter.count > get_setting('REVOCATION_BLOOM_CAPACITY', 100000):
+            self._built_at = 0
+
+    def refresh(self, force=False):
+        """Sync or rebuild the filter if it is due (or with `force`, now)."""
+        now = time.monotonic()
+        if not force and self._filter is not None and now - self._synced_at < get_setting('REVOCATION_SYNC_SECONDS', 30):
+            return
+        with self._lock:
+            if self._filter is None or force or now - self._built_at >= get_setting('REVOCATION_REBUILD_SECONDS', 3600):
+                self._build()
+            elif now - self._synced_at >= get_setting('REVOCATION_SYNC_SECONDS', 30):
+                self._sync()
+
+    def is_revoked(self, jti):
+        self.refresh()
+        if jti not in self._filter:
+            return False
+        return tokens().filter(jti=jti).exists()
+
+    def revoke(self, jti, expires_at):
+        """Revoke the token `jti` until it expires (a POSIX timestamp)."""
+        expires_at = datetime.fromtimestamp(expires_at, tz=dt_timezone.utc)
+        manager = tokens()
+        # Expired tokens fail validation anyway
+        manager.filter(expires_at__lte=timezone.now()).delete()
+        manager.bulk_create([RevokedToken(jti=jti, expires_at=expires_at)], ignore_conflicts=True)
+        self.refresh()
+        with self._lock:
+            self._filter.add(jti)
+
+
+_denylist = None
+_denylist_lock = threading.Lock()
+
+
+def get_denylist():
+    global _denylist
+    if _denylist is None:
+        with _denylist_lock:
+            if _denylist is None:
+                _denylist = Denylist()
+    return _denylist
+
+
+def reset():
+    """Forget the process' filter, the next check rebuilds it."""
+    global _denylist
+    _denylist = None
@@ -0,0 +1,272 @@
+"""
+Full-text search over Tweet.content for SearchView.
+
+The backend follows the database unless SEARCH_BACKEND names one:
+
+* SQLiteFTSBackend   - an FTS5 external-content table kept current by
+                       triggers on tweets_tweet, ranked with bm25()
+* PostgresBackend    - to_tsvector() over a GIN expression index, ranked
+                       with ts_rank_cd (Postgres has no built-in BM25)
+* PythonIndexBackend - an in-process inverted index ranked with BM25, built
+                       on first use and kept current by the Tweet signals
+
+Queries are whitespace separated terms that must all match; a trailing `*`
+makes a term a prefix query. Backends return up to SEARCH_MAX_CANDIDATES
+ranked tweet ids, already filtered by author and date; visibility is applied
+by the view in SQL.
+"""
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils.module_loading import import_string
+
+from .models import Tweet
+
+TOKEN_RE = re.compile(r'\w+')
+QUERY_TERM_RE = re.compile(r'(\w+)(\*?)')
+
+FTS_TABLE = 'tweets_tweet_fts'
+SQLITE_FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(content, content='tweets_tweet', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON tweets_tweet BEGIN "
+    "INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON tweets_tweet BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF content ON tweets_tweet BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+]
+POSTGRES_INDEX = 'tweets_tweet_content_tsv_idx'
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def parse_query(text):
+    """Return the query as a list of (term, is_prefix) pairs."""
+    return [(term.lower(), bool(star)) for term, star in QUERY_TERM_RE.findall(text or '')]
+
+
+def install_sqlite_fts(cursor):
+    """
+    Create the FTS5 table and its triggers if missing. SQLite drops the
+    triggers whenever a migration rebuilds tweets_tweet; rebuild() (the
+    rebuild_search_index command) puts them back. Returns False when FTS5 is
+    not compiled in.
+    """
+    try:
+        for statement in SQLITE_FTS_SCHEMA:
+            cursor.execute(statement.format(fts=FTS_TABLE))
+    except DatabaseError:
+        return False
+    return True
+
+
+class SQLiteFTSBackend:
+    def match_expression(self, terms):
+        return ' '.join('"%s"%s' % (term, '*' if prefix else '') for term, prefix in terms)
+
+    def search(self, terms, author_id=None, since=None, until=None, limit=None):
+        sql = [
+            "SELECT tweets_tweet.id, bm25({fts}) AS score FROM {fts} "
+            "JOIN tweets_tweet ON tweets_tweet.id = {fts}.rowid WHERE {fts} MATCH %s".format(fts=FTS_TABLE)
+        ]
+        params = [self.match_expression(terms)]
+        if author_id is not None:
+            sql.append('AND tweets_tweet.user_id = %s')
+            params.append(author_id)
+        if since is not None:
+            sql.append('AND tweets_tweet.created_at >= %s')
+            params.append(connection.ops.adapt_datetimefield_value(since))
+        if until is not None:
+            sql.append('AND tweets_tweet.created_at <= %s')
+            params.append(connection.ops.adapt_datetimefield_value(until))
+        sql.append('ORDER BY score LIMIT %s')
+        params.append(limit or get_setting('SEARCH_MAX_CANDIDATES', 1000))
+        with connection.cursor() as cursor:
+            cursor.execute(' '.join(sql), params)
+            # bm25() is lower for better matches
+            return [(tweet_id, -score) for tweet_id, score in cursor.fetchall()]
+
+    def index(self, tweet):
+        pass  # the triggers keep the FTS table current
+
+    def remove(self, tweet_id):
+        pass
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            install_sqlite_fts(cursor)
+            cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE))
+
+
+class PostgresBackend:
+    def search(self, terms, author_id=None, since=None, until=None, limit=None):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        query = SearchQuery(
+            ' & '.join('%s%s' % (term, ':*' if prefix else '') for term, prefix in terms),
+            search_type='raw', config='english',
+        )
+        vector = SearchVector('content', config='english')
+        tweets = Tweet.objects.annotate(search_vector=vector).filter(search_vector=query)
+        if author_id is not None:
+            tweets = tweets.filter(user_id=author_id)
+        if since is not None:
+            tweets = tweets.filter(created_at__gte=since)
+        if until is not None:
+            tweets = tweets.filter(created_at__lte=until)
+        tweets = tweets.annotate(score=SearchRank(vector, query, cover_density=True)).order_by('-score')
+        return list(tweets.values_list('id', 'score')[:limit or get_setting('SEARCH_MAX_CANDIDATES', 1000)])
+
+    def index(self, tweet):
+        pass  # the expression index is maintained by Postgres
+
+    def remove(self, tweet_id):
+        pass
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX %s' % POSTGRES_INDEX)
+
+
+class PythonIndexBackend:
+    """
+    In-process inverted index: term -> {tweet_id: term frequency}, plus a
+    sorted term list for prefix lookups. Each process holds its own copy.
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    def _reset(self):
+        self.postings = defaultdict(dict)
+        self.terms = []
+        self.documents = {}  # tweet_id -> (length, user_id, created_at, terms)
+        self.total_length = 0
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self._reset()
+            for tweet in Tweet.objects.only('id', 'user_id', 'created_at', 'content').iterator():
+                self._add(tweet)
+            self._loaded = True
+
+    def _add(self, tweet):
+        tokens = [token.lower() for token in TOKEN_RE.findall(tweet.content)]
+        frequencies = defaultdict(int)
+        for token in tokens:
+            frequencies[token] += 1
+        for term, frequency in frequencies.items():
+            if term not in self.postings:
+                self.terms.insert(bisect_left(self.terms, term), term)
+            self.postings[term][tweet.pk] = frequency
+        self.documents[tweet.pk] = (len(tokens), tweet.user_id, tweet.created_at, tuple(frequencies))
+        self.total_length += len(tokens)
+
+    def _remove(self, tweet_id):
+        document = self.documents.pop(tweet_id, None)
+        if document is None:
+            return
+        length, _, _, terms = document
+        self.total_length -= length
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(tweet_id, None)
+            if not postings:
+                del self.postings[term]
+                self.terms.pop(bisect_left(self.terms, term))
+
+    def index(self, tweet):
+        if self._loaded:
+            with self._lock:
+                self._remove(tweet.pk)
+                self._add(tweet)
+
+    def remove(self, tweet_id):
+        if self._loaded:
+            with self._lock:
+                self._remove(tweet_id)
+
+    def _expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self.postings else []
+        start = bisect_left(self.terms, term)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(term):
+            end += 1
+        return self.terms[start:end]
+
+    def search(self, terms, author_id=None, since=None, until=None, limit=None):
+        self._ensure_loaded()
+        with self._lock:
+            count = len(self.documents)
+            if not count or not terms:
+                return []
+            average_length = self.total_length / count
+            scores = None
+            for term, prefix in terms:
+                term_scores = defaultdict(float)
+                for expanded in self._expand(term, prefix):
+                    postings = self.postings[expanded]
+                    idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for tweet_id, frequency in postings.items():
+                        length = self.documents[tweet_id][0]
+                        norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                        term_scores[tweet_id] += idf * frequency * (self.k1 + 1) / norm
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {tweet_id: score + term_scores[tweet_id] for tweet_id, score in scores.items() if tweet_id in term_scores}
+            results = []
+            for tweet_id, score in scores.items():
+                _, user_id, created_at, _ = self.documents[tweet_id]
+                if author_id is not None and user_id != author_id:
+                    continue
+                if (since is not None and created_at < since) or (until is not None and created_at > until):
+                    continue
+                results.append((tweet_id, score))
+        results.sort(key=lambda result: -result[1])
+        return results[:limit or get_setting('SEARCH_MAX_CANDIDATES', 1000)]
+
+
+def sqlite_fts_installed():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = get_setting('SEARCH_BACKEND', None)
+                if path:
+                    _backend = import_string(path)()
+                elif connection.vendor == 'sqlite' and sqlite_fts_installed():
+                    _backend = SQLiteFTSBackend()
+                elif connection.vendor == 'postgresql':
+                    _backend = PostgresBackend()
+                else:
+                    _backend = PythonIndexBackend()
+    return _backend
@@ -1,60 +1,152 @@
 # serializers.py in the 'tweets' app
 from rest_framework import serializers
-from .models import Tweet, Comment,UserProfile ,Comment, Retweet , Follow, Like
+from .models import Tweet, Comment,UserProfile ,Comment, Retweet , Follow, Like, FollowSuggestion
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
 from django.urls import reverse,reverse_lazy
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from . import cards, comments, counters, images, profiling, timeline, tokens
+from .visibility import VisibilityService
 
 
+class UserCardListSerializer(serializers.ListSerializer):
+    """
+    Renders the user cards of a whole page with one bulk lookup before the
+    items; the child's `user_card_field` names the user id of each item.
+    """
+    def to_representation(self, data):
+        with profiling.timed('serializer'):
+            items = list(data.all() if hasattr(data, 'all') else data)
+            user_ids = {getattr(item, self.child.user_card_field) for item in items}
+            rendered = self.context.setdefault('user_cards', {})
+            missing = user_ids - rendered.keys()
+            if missing:
+                rendered.update(cards.render_cards(missing, self.context.get('request')))
+            return super().to_representation(items)
+
 class UserSerializer(serializers.ModelSerializer):
     profile_pic = serializers.SerializerMethodField()
     class Meta:
         model = User
         fields = ['id', 'username', 'profile_pic']
+    def to_representation(self, instance):
+        # Rendered from the cached user card, in bulk when the parent list
+        # serializer has loaded the page's cards already
+        rendered = self.context.get('user_cards', {}).get(instance.pk)
+        if rendered is None:
+            card = cards.get_cards([instance.pk]).get(instance.pk)
+            if card is None:
+                return super().to_representation(instance)
+            rendered = cards.render_card(card, self.context.get('request'))
+        return rendered
     def get_profile_pic(self, obj):
         request = self.context.get('request')
         if hasattr(obj, 'userprofile'):
-            if obj.userprofile.profile_pic:
-                return request.build_absolute_uri(obj.userprofile.profile_pic.url)
+            profile = obj.userprofile
+            if profile.profile_pic:
+                url = profile.profile_pic.storage.url(images.card_avatar(profile.image_variants, profile.profile_pic.name))
+                return request.build_absolute_uri(url)
         return None
 
 class TweetSerializer(serializers.ModelSerializer):
     likes_count = serializers.SerializerMethodField()
     retweets_count = serializers.SerializerMethodField()
+    comments_count = serializers.SerializerMethodField()
     comments = serializers.SerializerMethodField()
     user = UserSerializer(read_only=True)
+    user_card_field = 'user_id'
     class Meta:
         model = Tweet
+        list_serializer_class = UserCardListSerializer
         fields = ["id",
         "content",
         "created_at",
         "user",
         "likes_count",
         "retweets_count",
+        "comments_count",
         "comments"
         ]
         read_only_fields = ["user"]
+    # The counts and comments are annotated by Tweet.objects.for_serializer(),
+    # the fallbacks only run for tweets that were loaded without it
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        return getattr(obj, 'likes_total', obj.like_count)
     def get_retweets_count(self, obj):
-        return obj.retweets.count()
+        return getattr(obj, 'retweets_total', obj.retweet_count)
+    def get_comments_count(self, obj):
+        return getattr(obj, 'comments_total', obj.comment_count)
     def get_comments(self, obj):
-        latest_comments = obj.comment_set.order_by('-created_at')[:3]
+        latest_comments = getattr(obj, 'latest_comments', None)
+        if latest_comments is None:
+            # Not prefetched by for_serializer(), the cached preview
+            return comments.previews([obj.pk])[obj.pk]
         return CommentSerializer(latest_comments, many=True).data
     def to_representation(self, instance):
-        data = super().to_representation(instance)
         user = self.context['request'].user
         is_visible = self.is_tweet_visible(instance, user)
         
         if not is_visible:
             return {}
-        return data
+        return super().to_representation(instance)
     def is_tweet_visible(self, tweet, viewer):
         """
         Determine if the tweet is visible to the given user.
         """
-        user_profile = tweet.user.userprofile
-        return user_profile.is_public or viewer == tweet.user or (Follow.objects.all().filter(following=tweet.user, follower=viewer,is_accepted=True).exists())
+        return VisibilityService.for_request(self.context['request']).can_see(tweet)
+class LeanTweetListSerializer(serializers.ListSerializer):
+    """
+    TweetSerializer's output for a page of LeanTweetSerializer.rows(), built
+    as plain dicts: the comment previews and user cards of the page are
+    read from their caches in bulk, and no serializer fields run per tweet.
+    """
+    def to_representation(self, data):
+        with profiling.timed('serializer'):
+            rows = list(data)
+            datetime_field = serializers.DateTimeField()
+            previews = self.context.get('comment_previews')
+            if previews is None:
+                previews = comments.previews([row['id'] for row in rows]) if rows else {}
+            rendered = self.context.setdefault('user_cards', {})
+            missing = {row['user_id'] for row in rows} - rendered.keys()
+            if missing:
+                rendered.update(cards.render_cards(missing, self.context.get('request')))
+            return [
+                {
+                    'id': row['id'],
+                    'content': row['content'],
+                    'created_at': datetime_field.to_representation(row['created_at']),
+                    'user': rendered.get(row['user_id']),
+                    'likes_count': row['likes_count'],
+                    'retweets_count': row['retweets_count'],
+                    'comments_count': row['comments_count'],
+                    'comments': previews[row['id']],
+                }
+                for row in rows
+            ]
+
+class LeanTweetSerializer(serializers.BaseSerializer):
+    """
+    Read-only TweetSerializer for the .values() rows of rows(), e.g. pages
+    of tweet lists. The rows are not checked for visibility, the queryset
+    must be filtered by VisibilityService.
+    """
+    class Meta:
+        list_serializer_class = LeanTweetListSerializer
+    @staticmethod
+    def rows(queryset):
+        return queryset.prefetch_related(None).values(
+            'id', 'content', 'created_at', 'user_id',
+            likes_count=counters.counter_expression('like_count'),
+            retweets_count=counters.counter_expression('retweet_count'),
+            comments_count=counters.counter_expression('comment_count'),
+        )
+    def to_representation(self, instance):
+        return LeanTweetSerializer([instance], many=True, context=self.context).data[0]
+
 class TweetCreationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tweet
@@ -62,6 +154,7 @@ class TweetCreationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = self.context['request'].user
         tweet = Tweet.objects.create(user=user, **validated_data)
+        timeline.fan_out_tweet(tweet)
         return tweet
     
 
@@ -69,22 +162,42 @@ class TweetCreationSerializer(serializers.ModelSerializer):
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
-        fields = ["id", "user", "content", "created_at"]
+        fields = ["id", "user", "content", "created_at", "parent", "reply_count"]
+        read_only_fields = ["user", "reply_count"]
+    def validate_parent(self, parent):
+        # The view passes the tweet being commented on
+        tweet = self.context.get('tweet')
+        if parent is not None and tweet is not None and parent.tweet_id != tweet.pk:
+            raise serializers.ValidationError("Not a comment of this tweet.")
+        if parent is not None and len(comments.child_path(parent)) > comments.MAX_PATH_LENGTH:
+            raise serializers.ValidationError("This thread is too deep to reply to.")
+        return parent
 
 # serializers.py in the 'tweets' app
         
-class UserProfileSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin(serializers.Serializer):
+    # {size: {format: url}} of the resized images, empty until processed
+    profile_pic_variants = serializers.SerializerMethodField()
+    profile_header_variants = serializers.SerializerMethodField()
+    def get_profile_pic_variants(self, obj):
+        return images.variant_urls(obj, 'profile_pic', self.context.get('request'))
+    def get_profile_header_variants(self, obj):
+        return images.variant_urls(obj, 'profile_header', self.context.get('request'))
+
+class UserProfileSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     class Meta:
         model = UserProfile
-        fields = ['user','phone_number','bio','profile_pic','profile_header','birth_date','joined_date','is_public']
+        fields = ['user','phone_number','bio','profile_pic','profile_header','birth_date','joined_date','is_public',
+                  'profile_pic_variants','profile_header_variants']
         read_only_fields = ['user','joined_date']
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(ImageVariantsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     
     class Meta:
         model = UserProfile
-        fields = ['user','bio','profile_pic','profile_header','birth_date','is_public']
+        fields = ['user','bio','profile_pic','profile_header','birth_date','is_public',
+                  'profile_pic_variants','profile_header_variants']
         read_only_fields = ['user','joined_date','bio','profile_pic','profile_header','birth_date','is_public']
     
 # serializers.py in the 'tweets' app
@@ -103,13 +216,10 @@ class LikeSerializer(serializers.ModelSerializer):
         return like
 
 class RetweetSerializer(serializers.ModelSerializer):
+    # Input of RetweetCreateView, which writes through tweets/toggles.py
     class Meta:
         model = Retweet
         fields = ['tweet']
-    def create(self, validated_data):
-        user = self.context['request'].user
-        tweet = Retweet.objects.create(user=user, **validated_data)
-        return tweet
 
 
 # serializers.py in the 'tweets' app
@@ -154,6 +264,57 @@ class FollowRequestListSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     follower = UserSerializer(read_only=True)
     created_at = serializers.DateTimeField()
+    user_card_field = 'follower_id'
 
     class Meta:
-        fields = ['id', 'follower', 'created_at']
\ No newline at end of file
+        fields = ['id', 'follower', 'created_at']
+        list_serializer_class = UserCardListSerializer
+
+
+class BulkFollowRequestSerializer(serializers.Serializer):
+    """Selects pending requests to act on: listed ids, or all made before a time."""
+    action = serializers.ChoiceField(choices=['accept', 'deny'])
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False, max_length=10000)
+    before = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if ('ids' in data) == ('before' in data):
+            raise serializers.ValidationError("Provide either 'ids' or 'before'.")
+        return data
+
+
+class FollowSuggestionSerializer(serializers.ModelSerializer):
+    user = UserSerializer(source='suggested_user', read_only=True)
+    user_card_field = 'suggested_user_id'
+
+    class Meta:
+        model = FollowSuggestion
+        fields = ['user', 'score']
+        list_serializer_class = UserCardListSerializer
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # The claims tweets.tokens.ClaimsJWTAuthentication builds request.user of
+    @classmethod
+    def get_token(cls, user):
+        return tokens.add_claims(super().get_token(user), user)
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        tokens.check_not_revoked(self.token_class(attrs['refresh']))
+        return super().validate(attrs)
+
+
+class TokenRevokeSerializer(serializers.Serializer):
+    """A refresh token of the requesting user to revoke along with the access token."""
+    refresh = serializers.CharField(required=False)
+
+    def validate_refresh(self, value):
+        try:
+            token = RefreshToken(value)
+        except TokenError as exc:
+            raise serializers.ValidationError(exc.args[0])
+        if str(token.get(jwt_settings.USER_ID_CLAIM)) != str(self.context['request'].user.pk):
+            raise serializers.ValidationError("Not a token of this user.")
+        return token
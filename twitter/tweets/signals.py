@@ -0,0 +1,166 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import authentication, cards, comments, conditional, graph, images, realtime, search, timeline, visibility
+from .models import Comment, Follow, Like, SuggestionState, Tweet, UserProfile
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    # Pending requests do not change what the follower can see. Dropped once
+    # committed, a read before that would cache the old set again.
+    if instance.is_accepted:
+        follower_id = instance.follower_id
+        transaction.on_commit(lambda: visibility.invalidate([follower_id]))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_suggestions_outdated(sender, instance, **kwargs):
+    SuggestionState.objects.filter(user_id=instance.follower_id, stale=False).update(stale=True)
+
+
+@receiver(post_init, sender=Follow)
+def remember_is_accepted(sender, instance, **kwargs):
+    instance._original_is_accepted = instance.__dict__.get('is_accepted')
+
+
+@receiver(post_save, sender=Follow)
+def follow_timeline_saved(sender, instance, created, **kwargs):
+    # Accepting (or creating accepted) merges the followee's tweets in.
+    # QuerySet.update() bypasses this, BulkFollowRequestView backfills itself.
+    was_accepted = not created and instance._original_is_accepted
+    instance._original_is_accepted = instance.is_accepted
+    follower_id, following_id = instance.follower_id, instance.following_id
+    if instance.is_accepted and not was_accepted:
+        transaction.on_commit(lambda: timeline.backfill_followee(follower_id, following_id))
+    elif was_accepted and not instance.is_accepted:
+        transaction.on_commit(lambda: timeline.remove_followee(follower_id, following_id))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_timeline_deleted(sender, instance, **kwargs):
+    # Unfollows, removed followers, admin deletes and cascades alike
+    if instance.is_accepted:
+        follower_id, following_id = instance.follower_id, instance.following_id
+        transaction.on_commit(lambda: timeline.remove_followee(follower_id, following_id))
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, **kwargs):
+    follower_id, following_id, accepted = instance.follower_id, instance.following_id, instance.is_accepted
+    transaction.on_commit(lambda: graph.edge_changed(follower_id, following_id, accepted))
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    follower_id, following_id = instance.follower_id, instance.following_id
+    transaction.on_commit(lambda: graph.edge_changed(follower_id, following_id))
+
+
+@receiver(post_init, sender=UserProfile)
+def remember_is_public(sender, instance, **kwargs):
+    instance._original_is_public = instance.is_public
+
+
+@receiver(post_init, sender=UserProfile)
+def remember_images(sender, instance, **kwargs):
+    # Read without the descriptors, which would load deferred fields
+    values = [instance.__dict__.get(field) for field in images.VARIANTS]
+    instance._original_images = [getattr(value, 'name', value) for value in values]
+
+
+@receiver(post_save, sender=UserProfile)
+def user_profile_saved(sender, instance, created, **kwargs):
+    if not created and instance.is_public != instance._original_is_public:
+        user_id = instance.user_id
+        transaction.on_commit(lambda: visibility.invalidate_followers_of(user_id))
+    instance._original_is_public = instance.is_public
+    cards.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=UserProfile)
+def user_profile_images_saved(sender, instance, **kwargs):
+    current = [getattr(instance, field).name for field in images.VARIANTS]
+    if current != instance._original_images:
+        instance._original_images = current
+        if images.outdated_fields(instance):
+            images.schedule(instance.pk)
+
+
+@receiver(post_delete, sender=UserProfile)
+def user_profile_deleted(sender, instance, **kwargs):
+    cards.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def user_profile_rendered_outdated(sender, instance, **kwargs):
+    conditional.invalidate('profile', instance.pk)
+    conditional.invalidate('user_tweets', instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    cards.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_login_misses_outdated(sender, instance, **kwargs):
+    # A new or renamed user may be the one an identifier missed
+    authentication.forget_misses()
+
+
+@receiver(post_save, sender=Tweet)
+def tweet_saved(sender, instance, created, **kwargs):
+    search.get_search_backend().index(instance)
+    if created:
+        realtime.tweet_created(instance)
+
+
+@receiver(post_delete, sender=Tweet)
+def tweet_deleted(sender, instance, **kwargs):
+    search.get_search_backend().remove(instance.pk)
+
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def tweet_rendered_outdated(sender, instance, **kwargs):
+    conditional.invalidate('tweet', instance.pk)
+    conditional.invalidate('user_tweets', instance.user_id)
+
+
+@receiver(post_save, sender=Like)
+def like_saved(sender, instance, created, **kwargs):
+    if created:
+        realtime.counters_changed(instance.tweet_id, realtime.tweet_author(instance.tweet_id), likes=1)
+
+
+@receiver(post_delete, sender=Like)
+def like_deleted(sender, instance, **kwargs):
+    realtime.counters_changed(instance.tweet_id, realtime.tweet_author(instance.tweet_id), likes=-1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        realtime.counters_changed(instance.tweet_id, realtime.tweet_author(instance.tweet_id), comments=1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_preview_outdated(sender, instance, created, **kwargs):
+    tweet_id = instance.tweet_id
+    if created:
+        transaction.on_commit(lambda: comments.refresh_preview(tweet_id))
+    else:
+        comments.invalidate_preview(tweet_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    comments.invalidate_preview(instance.tweet_id)
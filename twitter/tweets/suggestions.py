@@ -0,0 +1,290 @@
+"""
+"Who to follow" suggestions for SuggestionsView.
+
+A candidate is scored by
+
+    sum over followees f that follow it of 1 / log(2 + followees of f)
+    + SUGGESTIONS_LIKE_WEIGHT * log(1 + tweets both users liked)
+
+i.e. friends-of-friends counts in which prolific followers weigh less, plus
+like overlap. With F the accepted follow matrix, W the diagonal of those
+weights and L the user x tweet like matrix, the scores of a batch of users
+are the rows F[batch] W F + L[batch] L^T, both sparse products. Accounts
+already followed or requested, and the user, are left out; the top
+SUGGESTIONS_TOP_K are stored as FollowSuggestion rows.
+
+The build_suggestions command computes every user in batches across a
+process pool; a user's SuggestionState marks when that was, and is flagged
+stale by the Follow signals so `--stale` only recomputes users whose follows
+changed. A request for a user without fresh suggestions is served the
+stored ones and queues that user on a background thread
+(SUGGESTIONS_WORKERS), which recomputes them from the process' follow graph
+index and the latest SUGGESTIONS_LIKES_PER_TWEET likes of each tweet the user
+liked recently.
+
+SciPy is imported when a matrix is first built, not with the module: most
+processes never compute suggestions.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from . import graph
+from .models import FollowSuggestion, Like, SuggestionState
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def adjacency(follow_graph, relation, size):
+    """The CSR matrix of a relation of the follow graph, `size` x `size`."""
+    from scipy import sparse
+
+    indptr = np.asarray(follow_graph.arrays[relation + '_indptr'])
+    indices = np.asarray(follow_graph.arrays[relation + '_indices'])
+    if len(indptr) < size + 1:
+        indptr = np.concatenate([indptr, np.full(size + 1 - len(indptr), indptr[-1] if len(indptr) else 0)])
+    return sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(size, size))
+
+
+def rows_matrix(rows, size):
+    """`size` x `size` CSR matrix with only the given {row: sorted column ids}."""
+    from scipy import sparse
+
+    counts = np.zeros(size, dtype=np.int64)
+    for row, columns in rows.items():
+        counts[row] = len(columns)
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.concatenate([rows[row] for row in sorted(rows)] or [np.zeros(0, np.int32)]).astype(np.int32)
+    return sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(size, size))
+
+
+def like_matrix(pairs, size):
+    """User x tweet matrix of (user_id, tweet_id) like pairs."""
+    from scipy import sparse
+
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    tweets = int(pairs[:, 1].max()) + 1 if len(pairs) else 1
+    data = np.ones(len(pairs), dtype=np.float32)
+    return sparse.csr_matrix((data, (pairs[:, 0], pairs[:, 1])), shape=(size, tweets))
+
+
+class Scorer:
+    """Scores users given the follow, request and like matrices, all indexed by user id."""
+
+    def __init__(self, follows, requested, likes):
+        from scipy import sparse
+
+        self.follows = follows
+        self.requested = requested
+        self.likes = likes
+        self.likes_t = likes.T.tocsr()
+        weights = 1 / np.log(2 + np.diff(follows.indptr))
+        self.weighted_follows = sparse.diags(weights.astype(np.float32)) @ follows
+        self.like_weight = get_setting('SUGGESTIONS_LIKE_WEIGHT', 0.5)
+
+    def score(self, user_ids, top_k):
+        """Return [(user_id, suggested_id, score)] for the given users."""
+        friends_of_friends = self.follows[user_ids] @ self.weighted_follows
+        shared_likes = (self.likes[user_ids] @ self.likes_t).tocsr()
+        shared_likes.data = self.like_weight * np.log1p(shared_likes.data)
+        scores = (friends_of_friends + shared_likes).tocsr()
+        results = []
+        for offset, user_id in enumerate(user_ids):
+            start, end = scores.indptr[offset], scores.indptr[offset + 1]
+            columns, values = scores.indices[start:end], scores.data[start:end]
+            excluded = np.concatenate([
+                self.follows.indices[self.follows.indptr[user_id]:self.follows.indptr[user_id + 1]],
+                self.requested.indices[self.requested.indptr[user_id]:self.requested.indptr[user_id + 1]],
+                [user_id],
+            ])
+            keep = ~np.isin(columns, excluded) & (values > 0)
+            columns, values = columns[keep], values[keep]
+            if len(values) > top_k:
+                best = np.argpartition(-values, top_k)[:top_k]
+                columns, values = columns[best], values[best]
+            results.extend((user_id, int(column), float(value)) for column, value in zip(columns, values))
+        return results
+
+
+# The scorer of the pool workers, inherited from the parent when forked
+_scorer = None
+
+
+def score_batch(args):
+    user_ids, top_k = args
+    return user_ids, _scorer.score(user_ids, top_k)
+
+
+def store(user_ids, rows, computed_at):
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FollowSuggestion.objects.bulk_create(
+            [FollowSuggestion(user_id=user_id, suggested_user_id=suggested_id, score=score) for user_id, suggested_id, score in rows],
+            batch_size=1000,
+        )
+        SuggestionState.objects.bulk_create(
+            [SuggestionState(user_id=user_id, computed_at=computed_at, stale=False) for user_id in user_ids],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['computed_at', 'stale'],
+            batch_size=1000,
+        )
+
+
+def build_suggestions(only_user_ids=None, top_k=None, batch_size=500, workers=1):
+    """
+    Recompute the suggestions of `only_user_ids`, or of every user who
+    follows or liked anything. Returns the number of users computed.
+    """
+    global _scorer
+    top_k = top_k or get_setting('SUGGESTIONS_TOP_K', 20)
+    follow_graph = graph.FollowGraph.from_database()
+    like_pairs = list(Like.objects.values_list('user_id', 'tweet_id').iterator(chunk_size=10000))
+    size = max(
+        len(follow_graph.arrays['followees_indptr']) - 1,
+        max((user_id for user_id, _ in like_pairs), default=0) + 1,
+        max(only_user_ids or [0]) + 1,
+    )
+    _scorer = Scorer(
+        adjacency(follow_graph, 'followees', size),
+        adjacency(follow_graph, 'requested', size),
+        like_matrix(like_pairs, size),
+    )
+    if only_user_ids is None:
+        active = np.diff(_scorer.follows.indptr) + np.diff(_scorer.likes.indptr) > 0
+        user_ids = np.flatnonzero(active).tolist()
+    else:
+        user_ids = sorted(set(only_user_ids))
+    batches = [(user_ids[start:start + batch_size], top_k) for start in range(0, len(user_ids), batch_size)]
+    computed_at = timezone.now()
+
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Workers only compute, the parent writes; they must not share its
+        # database connections
+        connections.close_all()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            for batch_user_ids, rows in pool.map(score_batch, batches):
+                store(batch_user_ids, rows, computed_at)
+    else:
+        for batch in batches:
+            store(*score_batch(batch), computed_at)
+    _scorer = None
+    return len(user_ids)
+
+
+def stale_user_ids():
+    """Users whose follows changed, or whose suggestions are too old."""
+    max_age = timedelta(seconds=get_setting('SUGGESTIONS_MAX_AGE', 24 * 60 * 60))
+    return list(
+        SuggestionState.objects.filter(stale=True).values_list('user_id', flat=True).union(
+            SuggestionState.objects.filter(computed_at__lt=timezone.now() - max_age).values_list('user_id', flat=True)
+        )
+    )
+
+
+def compute_for_user(user_id, top_k):
+    """
+    One user's suggestions, from the follow graph index of the process (which
+    includes the follows it changed since it was built) and the likes of the
+    tweets the user liked.
+    """
+    # Run off the request thread, see schedule()
+    follow_graph = graph.get_graph(wait=True)
+    followees = follow_graph.followees(user_id)
+    follows = {user_id: followees}
+    follows.update((followee, follow_graph.followees(followee)) for followee in followees.tolist())
+    # Bounded however viral the tweets: their latest likes only
+    liked = Like.objects.filter(user_id=user_id).order_by('-created_at').values('tweet_id')[
+        :get_setting('SUGGESTIONS_LIKED_TWEETS', 200)
+    ]
+    latest = Like.objects.filter(tweet_id__in=liked).annotate(
+        rank=Window(RowNumber(), partition_by=F('tweet_id'), order_by=F('created_at').desc()),
+    ).filter(rank__lte=get_setting('SUGGESTIONS_LIKES_PER_TWEET', 100))
+    like_pairs = list(latest.values_list('user_id', 'tweet_id'))
+    size = 1 + max(
+        user_id,
+        max((int(ids.max()) for ids in follows.values() if len(ids)), default=0),
+        max((liker_id for liker_id, _ in like_pairs), default=0),
+    )
+    scorer = Scorer(
+        rows_matrix(follows, size),
+        rows_matrix({user_id: follow_graph.neighbours('requested', user_id)}, size),
+        like_matrix(like_pairs, size),
+    )
+    store([user_id], scorer.score([user_id], top_k), timezone.now())
+
+
+_executor = None
+_executor_lock = threading.Lock()
+# Users queued for a recompute, not queued again until it ran
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def get_executor():
+    """The process' recompute thread pool, or None when SUGGESTIONS_WORKERS is 0."""
+    global _executor
+    workers = get_setting('SUGGESTIONS_WORKERS', 1)
+    if not workers:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(workers, thread_name_prefix='suggestions')
+    return _executor
+
+
+def run(user_id):
+    try:
+        compute_for_user(user_id, get_setting('SUGGESTIONS_TOP_K', 20))
+    except Exception:
+        logger.exception('Computing the suggestions of user %s failed', user_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(user_id)
+        close_old_connections()
+
+
+def schedule(user_id):
+    """Recompute the user's suggestions in the background, unless already queued."""
+    def submit():
+        with _pending_lock:
+            if user_id in _pending:
+                return
+            _pending.add(user_id)
+        executor = get_executor()
+        if executor is None:
+            run(user_id)
+        else:
+            executor.submit(run, user_id)
+    transaction.on_commit(submit)
+
+
+def suggested_user_ids(user, limit=None):
+    """
+    Ids of the accounts suggested to `user`, best first, as last computed.
+    When they are missing, flagged stale or too old, the user is queued for
+    a recompute.
+    """
+    top_k = get_setting('SUGGESTIONS_TOP_K', 20)
+    max_age = timedelta(seconds=get_setting('SUGGESTIONS_MAX_AGE', 24 * 60 * 60))
+    state = SuggestionState.objects.filter(user=user).first()
+    if state is None or state.stale or state.computed_at < timezone.now() - max_age:
+        schedule(user.id)
+    return list(
+        FollowSuggestion.objects.filter(user=user).order_by('-score').values_list('suggested_user_id', flat=True)[:limit or top_k]
+    )
@@ -1,3 +1,1496 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+from base64 import b64encode
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.connection import ConnectionDoesNotExist
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import authentication, cards, comments, compression, counters, db_routing, graph, images, profiling, realtime, recommendations, renderers, revocation, search, suggestions, timeline, toggles, tokens, visibility
+from .benchmarks import startup
+from .models import Comment, Follow, Like, SimilarityState, SimilarUser, TimelineEntry, Tweet, TweetCounterShard, UserProfile, latest_comments_queryset
+from .serializers import LeanTweetSerializer, TweetSerializer
+from .visibility import VisibilityService
 
 # Create your tests here.
+
+
+def create_user(username, is_public=True):
+    user = User.objects.create_user(username, '%s@example.com' % username, 'password')
+    UserProfile.objects.create(user=user, is_public=is_public)
+    return user
+
+
+class TweetListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = create_user('viewer')
+        cls.public_author = create_user('public_author')
+        cls.private_author = create_user('private_author', is_public=False)
+        Follow.objects.create(follower=cls.viewer, following=cls.private_author, is_accepted=True)
+        for i in range(30):
+            author = cls.private_author if i % 2 else cls.public_author
+            tweet = Tweet.objects.create(user=author, content='tweet %d' % i)
+            Like.objects.create(user=cls.viewer, tweet=tweet)
+            for j in range(i % 5):
+                Comment.objects.create(user=cls.viewer, tweet=tweet, content='comment %d' % j)
+        Follow.objects.create(follower=cls.viewer, following=cls.public_author, is_accepted=True)
+        timeline.rebuild_timeline(cls.viewer.id)
+        counters.reconcile()
+
+    def setUp(self):
+        # Cached by ids that earlier, rolled back, tests used as well
+        cache.clear()
+        cards.local_cards.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    # Counts the queries of rendering, not of serving a rendered page
+    @override_settings(RENDERED_CACHE_TTL=0)
+    def test_user_tweets_query_count_is_independent_of_page_size(self):
+        for author in (self.public_author, self.private_author):
+            url = '/api/user-tweets/%d/' % author.id
+            # Warms the caches of both pages
+            self.count_queries(url + '?page_size=15')
+            small, small_page = self.count_queries(url + '?page_size=3')
+            large, large_page = self.count_queries(url + '?page_size=15')
+            self.assertEqual(small, large)
+            self.assertEqual(len(large_page), 15)
+
+    def test_feed_query_count_is_independent_of_page_size(self):
+        # Warms the caches (user cards, comment previews) of both pages
+        self.count_queries('/api/tweets/?page_size=30')
+        small, _ = self.count_queries('/api/tweets/?page_size=3')
+        large, large_page = self.count_queries('/api/tweets/?page_size=30')
+        self.assertEqual(small, large)
+        self.assertEqual(len(large_page), 30)
+
+    def test_counts_and_comment_preview(self):
+        _, page = self.count_queries('/api/user-tweets/%d/?page_size=30' % self.private_author.id)
+        for item in page:
+            number = int(item['content'].split()[1])
+            self.assertEqual(item['likes_count'], 1)
+            self.assertEqual(item['comments_count'], number % 5)
+            self.assertEqual(len(item['comments']), min(number % 5, 3))
+
+
+@override_settings(LEAN_TWEET_SERIALIZATION=True)
+class LeanTweetListQueryCountTests(TweetListQueryCountTests):
+    pass
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('counted')
+        cls.tweet = Tweet.objects.create(user=cls.author, content='tweet')
+        cls.likers = [create_user('counter%d' % number) for number in range(5)]
+
+    def like_all(self):
+        for user in self.likers:
+            client = APIClient()
+            client.force_authenticate(user)
+            self.assertEqual(client.post('/api/like/%d/' % self.tweet.pk).json(), {'liked': True})
+
+    def counted(self, field='like_count'):
+        return Tweet.objects.annotate(value=counters.counter_expression(field)).get(pk=self.tweet.pk).value
+
+    @override_settings(TWEET_COUNTER_SHARDS=4, TWEET_COUNTER_HOT_THRESHOLD=2)
+    def test_hot_tweets_count_in_shards(self):
+        self.like_all()
+        # The column stops at the threshold, the rest is spread over shards
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).like_count, 2)
+        shards = TweetCounterShard.objects.filter(tweet=self.tweet, field='like_count')
+        self.assertEqual(sum(shards.values_list('delta', flat=True)), 3)
+        self.assertLessEqual(shards.count(), 4)
+        self.assertEqual(self.counted(), 5)
+        counters.adjust_shard(self.tweet.pk, 'like_count', 0, -1)
+        counters.adjust_shard(self.tweet.pk, 'like_count', 0, 1)
+        self.assertEqual(self.counted(), 5)
+        with self.assertRaises(ValueError):
+            counters.adjust(self.tweet, 'view_count', 1)
+
+        self.assertEqual(counters.reconcile(), 1)
+        self.assertFalse(TweetCounterShard.objects.exists())
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).like_count, 5)
+        self.assertEqual(self.counted(), 5)
+
+    def test_reconcile_repairs_drift(self):
+        self.like_all()
+        other = Tweet.objects.create(user=self.author, content='other')
+        Tweet.objects.filter(pk=self.tweet.pk).update(like_count=42, comment_count=3)
+        self.assertEqual(counters.reconcile(batch_size=1), 1)
+        tweet = Tweet.objects.get(pk=self.tweet.pk)
+        self.assertEqual((tweet.like_count, tweet.retweet_count, tweet.comment_count), (5, 0, 0))
+        self.assertEqual(Tweet.objects.get(pk=other.pk).like_count, 0)
+        self.assertEqual(counters.reconcile(), 0)
+
+    def test_command(self):
+        Tweet.objects.filter(pk=self.tweet.pk).update(retweet_count=7)
+        output = io.StringIO()
+        call_command('reconcile_counters', '--batch-size', '10', stdout=output)
+        self.assertIn('1 tweet(s) had drifted', output.getvalue())
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).retweet_count, 0)
+
+    def test_comments_are_counted(self):
+        client = APIClient()
+        client.force_authenticate(self.likers[0])
+        for content in ('first', 'second'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(client.post('/api/comments/%d/' % self.tweet.pk, {'content': content}).status_code, 201)
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).comment_count, 2)
+        self.assertEqual(counters.reconcile(), 0)
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.fans = [create_user('fan%d' % i) for i in range(2)]
+        cls.requester = create_user('requester')
+        for fan in cls.fans:
+            Follow.objects.create(follower=fan, following=cls.author, is_accepted=True)
+        Follow.objects.create(follower=cls.requester, following=cls.author, is_accepted=False)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def tweet(self, content='tweet'):
+        self.client.force_authenticate(self.author)
+        response = self.client.post('/api/tweets/create/', {'content': content})
+        self.assertEqual(response.status_code, 201)
+        return Tweet.objects.latest('id')
+
+    def timeline(self, user):
+        return list(TimelineEntry.objects.filter(user=user).order_by('-tweet_id').values_list('tweet_id', flat=True))
+
+    def feed(self, user):
+        self.client.force_authenticate(user)
+        return [item['id'] for item in self.client.get('/api/tweets/').json()['results']]
+
+    def test_tweets_are_pushed_to_accepted_followers(self):
+        tweet = self.tweet()
+        for fan in self.fans:
+            self.assertEqual(self.timeline(fan), [tweet.id])
+        self.assertEqual(self.timeline(self.requester), [])
+        self.assertEqual(self.feed(self.fans[0]), [tweet.id])
+
+    @override_settings(TIMELINE_CELEBRITY_THRESHOLD=1)
+    def test_celebrities_are_merged_on_read(self):
+        tweet = self.tweet()
+        self.assertEqual(self.timeline(self.fans[0]), [])
+        self.assertEqual(self.feed(self.fans[0]), [tweet.id])
+
+    def test_unfollow_removes_the_author(self):
+        self.tweet()
+        self.client.force_authenticate(self.fans[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/follow/%d/' % self.author.id)
+        self.assertEqual(self.timeline(self.fans[0]), [])
+        self.assertEqual(self.feed(self.fans[0]), [])
+        self.assertEqual(len(self.timeline(self.fans[1])), 1)
+
+    def test_removed_follower_loses_the_author(self):
+        self.tweet()
+        follow = Follow.objects.get(follower=self.fans[0], following=self.author)
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/requests/%d/deny/' % follow.pk)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.timeline(self.fans[0]), [])
+        # As do deletes outside the views (admin, shell, cascades)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.fans[1]).delete()
+        self.assertEqual(self.timeline(self.fans[1]), [])
+
+    def test_accepting_a_request_backfills(self):
+        tweet = self.tweet()
+        follow = Follow.objects.get(follower=self.requester, following=self.author)
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/requests/%d/accept/' % follow.pk)
+        self.assertEqual(self.timeline(self.requester), [tweet.id])
+
+    def test_former_celebrity_is_backfilled(self):
+        with self.settings(TIMELINE_CELEBRITY_THRESHOLD=1):
+            tweet = self.tweet()
+            self.assertEqual(self.feed(self.fans[0]), [tweet.id])
+            self.assertEqual(self.timeline(self.fans[0]), [])
+            with self.captureOnCommitCallbacks(execute=True):
+                Follow.objects.filter(follower=self.fans[1], following=self.author).delete()
+            cache.delete('timeline:celebrities')
+            self.assertEqual(self.feed(self.fans[0]), [tweet.id])
+        self.assertEqual(self.timeline(self.fans[0]), [tweet.id])
+
+    @override_settings(TIMELINE_MAX_LENGTH=3, TIMELINE_TRIM_EVERY=1)
+    def test_pushes_trim(self):
+        tweets = [self.tweet('tweet %d' % i) for i in range(5)]
+        for fan in self.fans:
+            self.assertEqual(self.timeline(fan), [tweet.id for tweet in reversed(tweets[2:])])
+
+    def test_backfill_command(self):
+        tweets = [self.tweet('tweet %d' % i) for i in range(2)]
+        TimelineEntry.objects.all().delete()
+        call_command('backfill_timelines', '--user', str(self.fans[0].id), stdout=io.StringIO())
+        self.assertEqual(self.timeline(self.fans[0]), [tweets[1].id, tweets[0].id])
+        self.assertEqual(self.timeline(self.fans[1]), [])
+        call_command('backfill_timelines', stdout=io.StringIO())
+        self.assertEqual(len(self.timeline(self.fans[1])), 2)
+        call_command(
+            'backfill_timelines', '--follower', str(self.fans[1].id), '--following', str(self.author.id), '--removed',
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(self.timeline(self.fans[1]), [])
+
+
+class VisibilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = create_user('visibility_viewer')
+        cls.author = create_user('visibility_author', is_public=False)
+        cls.tweet = Tweet.objects.create(user=cls.author, content='private tweet')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def visible(self):
+        # Goes through the cached followee set
+        return bool(VisibilityService(self.viewer).filter_tweets(Tweet.objects.filter(pk=self.tweet.pk)).exists())
+
+    def test_follow_and_unfollow(self):
+        self.assertFalse(self.visible())
+        with self.captureOnCommitCallbacks(execute=True):
+            follow = Follow.objects.create(follower=self.viewer, following=self.author, is_accepted=False)
+        self.assertFalse(self.visible())
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.is_accepted = True
+            follow.save()
+        self.assertTrue(self.visible())
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.assertFalse(self.visible())
+
+    def test_invalidated_on_commit(self):
+        self.assertFalse(self.visible())
+        with self.captureOnCommitCallbacks() as callbacks:
+            Follow.objects.create(follower=self.viewer, following=self.author, is_accepted=True)
+            # Not yet committed: a concurrent read would cache the old set
+            self.assertEqual(cache.get(visibility.CACHE_KEY % self.viewer.pk), frozenset())
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(visibility.CACHE_KEY % self.viewer.pk))
+        self.assertTrue(self.visible())
+
+    def test_switching_between_public_and_private(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.viewer, following=self.author, is_accepted=True)
+            profile = self.author.userprofile
+            profile.is_public = True
+            profile.save()
+        # Public accounts are not in the set
+        self.assertTrue(self.visible())
+        self.assertEqual(visibility.private_followee_ids(self.viewer.pk), frozenset())
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.is_public = False
+            profile.save()
+        self.assertEqual(visibility.private_followee_ids(self.viewer.pk), frozenset([self.author.pk]))
+        self.assertTrue(self.visible())
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.viewer).delete()
+        self.assertFalse(self.visible())
+        response = self.client.get('/api/user-tweets/%d/' % self.author.pk)
+        self.assertEqual(response.json()['results'], [])
+
+
+@override_settings(LEAN_TWEET_SERIALIZATION=True)
+class AsyncViewTests(TransactionTestCase):
+    # The views load on worker threads, with connections of their own, so
+    # the data is committed
+    def setUp(self):
+        cache.clear()
+        self.viewer = create_user('async_viewer')
+        self.author = create_user('async_author', is_public=False)
+        Follow.objects.create(follower=self.viewer, following=self.author, is_accepted=True)
+        for i in range(3):
+            tweet = Tweet.objects.create(user=self.author, content='tweet %d' % i)
+            Comment.objects.create(user=self.viewer, tweet=tweet, content='comment %d' % i)
+        timeline.rebuild_timeline(self.viewer.id)
+        self.token = tokens.add_claims(AccessToken.for_user(self.viewer), self.viewer)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+        self.async_client = AsyncClient()
+
+    async def test_same_json_as_the_sync_views(self):
+        await self.async_client.aforce_login(self.viewer)
+        await self.assert_same_json()
+        with override_settings(LEAN_TWEET_SERIALIZATION=False):
+            await self.assert_same_json()
+
+    async def assert_same_json(self):
+        for sync_path, async_path in (
+            ('/api/tweets/', '/api/async/tweets/'),
+            ('/api/user-tweets/%d/' % self.author.pk, '/api/async/user-tweets/%d/' % self.author.pk),
+            ('/api/user-profile/%d/' % self.author.userprofile.pk, '/api/async/user-profile/%d/' % self.author.userprofile.pk),
+        ):
+            expected = (await sync_to_async(self.client.get)(sync_path)).json()
+            response = await self.async_client.get(async_path)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            if 'results' in expected:
+                # The links differ by path
+                data, expected = data['results'], expected['results']
+            self.assertEqual(data, expected)
+
+    async def test_independent_loads_run_concurrently(self):
+        await self.async_client.aforce_login(self.viewer)
+        # Only passed when both loads wait on it at the same time
+        barrier = threading.Barrier(2, timeout=5)
+
+        def waiting(function):
+            def wrapper(*args):
+                barrier.wait()
+                return function(*args)
+            return wrapper
+
+        with mock.patch.object(visibility, 'private_followee_ids', waiting(visibility.private_followee_ids)), \
+                mock.patch.object(timeline, 'celebrity_ids', waiting(timeline.celebrity_ids)):
+            response = await self.async_client.get('/api/async/tweets/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+
+    async def test_authentication(self):
+        self.assertEqual((await self.async_client.get('/api/async/tweets/')).status_code, 403)
+        response = await self.async_client.get(
+            '/api/async/user-tweets/%d/' % self.author.pk, headers={'Authorization': 'Bearer %s' % self.token},
+        )
+        self.assertEqual(len(response.json()['results']), 3)
+        await self.async_client.aforce_login(self.viewer)
+        self.assertEqual((await self.async_client.get('/api/async/user-profile/0/')).status_code, 404)
+
+
+class RealtimeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('streamer')
+        cls.follower = create_user('listener')
+        cls.stranger = create_user('stranger')
+        Follow.objects.create(follower=cls.follower, following=cls.author, is_accepted=True)
+
+    def setUp(self):
+        self.broker = realtime.InProcessBroker()
+        patcher = mock.patch.object(realtime, '_broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self, user):
+        async def subscribe():
+            return self.broker.subscribe(user.pk)
+        return self.loop.run_until_complete(subscribe())
+
+    def next_batch(self, subscription, coalesce=0):
+        return self.loop.run_until_complete(asyncio.wait_for(subscription.next_batch(coalesce), 1))
+
+    def pending(self, subscription):
+        # Runs the callbacks offer() scheduled on the loop
+        self.loop.run_until_complete(asyncio.sleep(0))
+        return subscription.ready.is_set()
+
+    def test_published_after_commit_to_followers_and_author(self):
+        subscriptions = {user: self.subscribe(user) for user in (self.author, self.follower, self.stranger)}
+        with self.captureOnCommitCallbacks() as callbacks:
+            tweet = Tweet.objects.create(user=self.author, content='live')
+            Like.objects.create(user=self.stranger, tweet=tweet)
+        self.assertFalse(any(self.pending(subscription) for subscription in subscriptions.values()))
+        for callback in callbacks:
+            callback()
+        for user in (self.author, self.follower):
+            self.assertEqual(
+                self.next_batch(subscriptions[user]),
+                [{'type': 'tweet', 'id': tweet.pk}, {'type': 'counters', 'tweet': tweet.pk, 'likes': 1}],
+            )
+        self.assertFalse(self.pending(subscriptions[self.stranger]))
+
+    def test_nothing_is_published_without_subscribers(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tweet.objects.create(user=self.author, content='unheard')
+        self.assertEqual(callbacks, [])
+
+    def test_counters_coalesce(self):
+        subscription = self.subscribe(self.follower)
+        for deltas in ({'likes': 1}, {'likes': 1}, {'comments': 1}, {'likes': -2}):
+            subscription.offer({'type': 'counters', 'tweet': 7, 'deltas': deltas})
+        subscription.offer({'type': 'counters', 'tweet': 8, 'deltas': {'likes': 1}})
+        subscription.offer({'type': 'counters', 'tweet': 8, 'deltas': {'likes': -1}})
+        self.assertEqual(self.next_batch(subscription), [{'type': 'counters', 'tweet': 7, 'comments': 1}])
+        self.assertFalse(self.pending(subscription))
+
+    @override_settings(REALTIME_MAX_PENDING=3)
+    def test_slow_subscribers_are_told_to_resync(self):
+        subscription = self.subscribe(self.follower)
+        for tweet_id in range(1, 6):
+            subscription.offer({'type': 'tweet', 'id': tweet_id})
+        # Bounded: only the newest ids are kept
+        self.assertEqual(self.next_batch(subscription), [
+            {'type': 'resync'}, {'type': 'tweet', 'id': 3}, {'type': 'tweet', 'id': 4}, {'type': 'tweet', 'id': 5},
+        ])
+        for tweet_id in range(1, 5):
+            subscription.offer({'type': 'counters', 'tweet': tweet_id, 'deltas': {'likes': 1}})
+        self.assertEqual(self.next_batch(subscription), [{'type': 'resync'}])
+        subscription.offer({'type': 'tweet', 'id': 6})
+        self.assertEqual(self.next_batch(subscription), [{'type': 'tweet', 'id': 6}])
+
+    async def test_stream(self):
+        await self.async_client.aforce_login(self.follower)
+        response = await self.async_client.get('/api/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+        # The stream subscribed once it started
+        self.assertEqual(self.broker.connected_user_ids(), {self.follower.pk})
+        self.broker.publish([self.follower.pk], {'type': 'tweet', 'id': 1})
+        self.assertEqual(await asyncio.wait_for(anext(chunks), 5), b'event: tweet\ndata: {"type": "tweet", "id": 1}\n\n')
+        # A disconnect cancels the task waiting for the next chunk
+        waiting = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(self.broker.connected_user_ids(), set())
+
+
+class SearchTestsMixin:
+    """The same queries through SearchView, for each backend."""
+    backend_class = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = create_user('searcher')
+        cls.author = create_user('search_author')
+        cls.hidden = create_user('hidden_author', is_public=False)
+        cls.tweets = {
+            name: Tweet.objects.create(user=user, content=content)
+            for name, user, content in (
+                ('repeated', cls.author, 'django django django orm'),
+                ('once', cls.author, 'django tips'),
+                ('longer_word', cls.author, 'djangonauts unite'),
+                ('hidden', cls.hidden, 'django secrets'),
+                ('old', cls.author, 'django history'),
+                ('unrelated', cls.author, 'cooking pasta'),
+            )
+        }
+        Tweet.objects.filter(pk=cls.tweets['old'].pk).update(created_at='2020-06-01T00:00:00Z')
+
+    def setUp(self):
+        patcher = mock.patch.object(search, '_backend', self.backend_class())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Visibility sets are cached by user id, which rolled-back tests reuse
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def search(self, **params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, 200)
+        ids = {tweet.pk: name for name, tweet in self.tweets.items()}
+        return [ids[item['id']] for item in response.json()['results']]
+
+    def test_ranking(self):
+        # More occurrences in a short tweet rank first; hidden authors are left out
+        self.assertEqual(self.search(q='django')[:2], ['repeated', 'once'])
+        self.assertEqual(set(self.search(q='django')), {'repeated', 'once', 'old'})
+        self.assertEqual(self.search(q='django orm'), ['repeated'])
+        self.assertEqual(self.search(q=''), [])
+
+    def test_prefix(self):
+        self.assertEqual(self.search(q='djang'), [])
+        self.assertEqual(set(self.search(q='djang*')), {'repeated', 'once', 'longer_word', 'old'})
+
+    def test_author_and_dates(self):
+        self.assertEqual(self.search(q='django', author=self.hidden.pk), [])
+        self.assertEqual(set(self.search(q='django', author=self.author.pk)), {'repeated', 'once', 'old'})
+        self.assertEqual(self.search(q='django', until='2021-01-01T00:00:00Z'), ['old'])
+        self.assertEqual(set(self.search(q='django', since='2021-01-01T00:00:00Z')), {'repeated', 'once'})
+        self.assertEqual(self.client.get('/api/search/', {'q': 'django', 'since': 'soon'}).status_code, 400)
+        # Without an offset, in the current time zone (UTC)
+        self.assertEqual(self.search(q='django', until='2021-01-01T00:00:00'), ['old'])
+        self.assertEqual(set(self.search(q='django', since='2021-01-01T00:00:00')), {'repeated', 'once'})
+        self.assertEqual(self.search(q='django', since='2020-06-01T00:00:01', until='2020-12-31T00:00:00'), [])
+
+    def test_follows_changes(self):
+        Tweet.objects.filter(pk=self.tweets['once'].pk).first().delete()
+        tweet = self.tweets['unrelated']
+        tweet.content = 'django pasta'
+        tweet.save()
+        self.assertEqual(set(self.search(q='django')), {'repeated', 'old', 'unrelated'})
+
+    def test_visible_to_followers(self):
+        Follow.objects.create(follower=self.viewer, following=self.hidden, is_accepted=True)
+        cache.clear()
+        self.assertIn('hidden', self.search(q='secrets'))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5')
+class SQLiteSearchTests(SearchTestsMixin, TestCase):
+    backend_class = search.SQLiteFTSBackend
+
+    def setUp(self):
+        if not search.sqlite_fts_installed():
+            self.skipTest('SQLite was built without FTS5')
+        super().setUp()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Postgres full-text search')
+class PostgresSearchTests(SearchTestsMixin, TestCase):
+    backend_class = search.PostgresBackend
+
+
+class PythonIndexSearchTests(SearchTestsMixin, TestCase):
+    backend_class = search.PythonIndexBackend
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('paged_author')
+        cls.tweets = [Tweet.objects.create(user=cls.author, content='tweet %d' % i) for i in range(7)]
+        # Three tweets share a timestamp, told apart by id
+        Tweet.objects.filter(id__in=[tweet.id for tweet in cls.tweets[2:5]]).update(created_at=cls.tweets[2].created_at)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.url = '/api/user-tweets/%d/' % self.author.id
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [item['id'] for item in page['results']]
+
+    def test_cursor_round_trip(self):
+        expected = list(Tweet.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        seen, page = [], self.get(self.url + '?page_size=2')
+        while True:
+            seen.extend(self.ids(page))
+            if page['next'] is None:
+                break
+            self.assertTrue(page['has_more'])
+            page = self.get(page['next'])
+        self.assertEqual(seen, expected)
+        self.assertFalse(page['has_more'])
+
+    def test_rows_inserted_meanwhile_do_not_shift_pages(self):
+        first = self.get(self.url + '?page_size=3')
+        Tweet.objects.create(user=self.author, content='new')
+        second = self.get(first['next'])
+        self.assertEqual(self.ids(first) + self.ids(second), [tweet.id for tweet in reversed(self.tweets)][:6])
+
+    def test_since_polls_newer_rows_oldest_slice_first(self):
+        since = self.get(self.url + '?page_size=2')['since']
+        self.assertEqual(self.ids(self.get(since)), [])
+        new = [Tweet.objects.create(user=self.author, content='new %d' % i) for i in range(3)]
+        page = self.get(since)
+        self.assertEqual(self.ids(page), [new[1].id, new[0].id])
+        self.assertIsNone(page['next'])
+        self.assertTrue(page['has_more'])
+        page = self.get(page['since'])
+        self.assertEqual(self.ids(page), [new[2].id])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(self.ids(self.get(page['since'])), [])
+
+    def test_invalid_cursors(self):
+        for cursor in (
+            'garbage!',
+            b64encode(b'2026-01-01T00:00:00+00:00').decode(),
+            b64encode(b'2026-01-01T00:00:00+00:00|x').decode(),
+            b64encode(b'yesterday|1').decode(),
+            # Tampered to drop the offset
+            b64encode(b'2026-01-01T00:00:00|1').decode(),
+        ):
+            for param in ('cursor', 'since'):
+                response = self.client.get(self.url, {param: cursor})
+                self.assertEqual(response.status_code, 404, (param, cursor))
+
+
+class BenchmarkHarnessTests(TestCase):
+    # A background thread would not see the uncommitted dataset
+    @override_settings(FOLLOW_GRAPH_BACKGROUND_REBUILD=False)
+    def test_harness_runs_on_a_small_dataset(self):
+        from .benchmarks import datagen, harness
+
+        dataset = datagen.generate(users=30, tweets_per_user=2, follows_per_user=5, likes_per_user=5, comments_per_user=1)
+        self.assertEqual(dataset['tweets'], 60)
+        results = harness.run(['feed', 'recommended', 'like_toggle'], requests=3)
+        for result in results.values():
+            self.assertEqual(result['requests'], 3)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['queries_mean'], 0)
+
+    def test_rows_are_counted_at_the_cursor(self):
+        from .benchmarks import harness
+
+        author = create_user('rows')
+        for number in range(3):
+            Tweet.objects.create(user=author, content='tweet %d' % number)
+        with harness.count_rows() as rows:
+            self.assertEqual(len(list(Tweet.objects.values('id', 'content'))), 3)
+            self.assertEqual(len(list(Tweet.objects.all()[:2])), 2)
+            self.assertIsNotNone(Tweet.objects.first())
+        self.assertEqual(rows[0], 6)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0)
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin')
+        cls.admin.is_staff = True
+        cls.admin.save()
+        cls.other = create_user('other')
+        for i in range(3):
+            tweet = Tweet.objects.create(user=cls.other, content='python tweet %d' % i)
+            Like.objects.create(user=cls.admin, tweet=tweet)
+            Like.objects.create(user=cls.other, tweet=tweet)
+
+    def setUp(self):
+        profiling.registry.reset()
+        graph.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_views_are_profiled_and_exported(self):
+        self.assertEqual(self.client.get('/api/recommended-tweets/').status_code, 200)
+        stats = self.client.get('/api/metrics/').json()['views']['RecommendedTweetsListView']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries'], 0)
+        # The similarity index is refreshed after responding, never refitted
+        self.assertNotIn('tfidf', stats['sections'])
+        self.assertIn('serializer', stats['sections'])
+
+        response = self.client.get('/api/metrics/?format=prometheus')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('tweets_requests_total{view="RecommendedTweetsListView"} 1', response.content.decode())
+
+    def test_metrics_are_staff_only(self):
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+
+class BulkFollowRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = create_user('owner', is_public=False)
+        cls.someone_else = create_user('someone_else', is_public=False)
+        cls.followers = [create_user('follower%d' % i) for i in range(4)]
+        cls.requests = [
+            Follow.objects.create(follower=follower, following=cls.owner, is_accepted=False) for follower in cls.followers
+        ]
+        cls.foreign_request = Follow.objects.create(follower=cls.followers[0], following=cls.someone_else, is_accepted=False)
+        Tweet.objects.create(user=cls.owner, content='private tweet')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_accept_only_touches_own_requests_and_backfills(self):
+        follower = self.followers[0]
+        reader = APIClient()
+        reader.force_authenticate(follower)
+        self.assertEqual(reader.get('/api/tweets/').json()['results'], [])
+
+        ids = [self.requests[0].id, self.requests[1].id, self.foreign_request.id]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/requests/bulk/', {'action': 'accept', 'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['accepted']), ids[:2])
+        self.assertFalse(Follow.objects.get(pk=self.foreign_request.id).is_accepted)
+        # Timeline and the cached visibility of the follower are up to date
+        self.assertEqual([tweet['content'] for tweet in reader.get('/api/tweets/').json()['results']], ['private tweet'])
+
+    def test_deny_all_before(self):
+        graph.reset()
+        self.addCleanup(graph.reset)
+        follow_graph = graph.get_graph(wait=True)
+        self.assertEqual(len(follow_graph.neighbours('requesters', self.owner.id)), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/requests/bulk/', {'action': 'deny', 'before': timezone.now().isoformat()}, format='json')
+        self.assertEqual(len(response.json()['denied']), 4)
+        self.assertFalse(Follow.objects.filter(following=self.owner).exists())
+        self.assertTrue(Follow.objects.filter(pk=self.foreign_request.id).exists())
+        self.assertEqual(follow_graph.neighbours('requesters', self.owner.id).tolist(), [])
+
+    def test_deny_queries_do_not_grow_with_requests(self):
+        def deny(follows):
+            ids = [follow.id for follow in follows]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/requests/bulk/', {'action': 'deny', 'ids': ids}, format='json')
+            self.assertEqual(sorted(response.json()['denied']), ids)
+            return len(queries)
+
+        self.assertEqual(deny(self.requests[:1]), deny(self.requests[1:]))
+        self.assertFalse(Follow.objects.filter(following=self.owner).exists())
+
+    def test_ids_or_before_required(self):
+        response = self.client.post('/api/requests/bulk/', {'action': 'accept'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(RECOMMENDATIONS_WORKERS=0)
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user('liker%d' % i) for i in range(4)]
+        cls.tweets = [
+            Tweet.objects.create(user=cls.users[0], content=content)
+            for content in ('python django orm', 'pasta recipes', 'django rest framework', 'knitting')
+        ]
+        for user, tweet in ((0, 0), (0, 2), (1, 0), (1, 2), (2, 1), (3, 3)):
+            Like.objects.create(user=cls.users[user], tweet=cls.tweets[tweet])
+
+    def setUp(self):
+        recommendations.reset()
+        self.addCleanup(recommendations.reset)
+
+    def test_index(self):
+        self.assertEqual(recommendations.build_similarity_index(), 4)
+        self.assertEqual(recommendations.similar_user_ids(self.users[0]), [self.users[1].id])
+        # Computed, without neighbours
+        self.assertEqual(recommendations.similar_user_ids(self.users[3]), [])
+        self.assertEqual(SimilarityState.objects.count(), 4)
+
+    def test_vectors_match_the_fitted_rows(self):
+        model = recommendations.SimilarityModel.fit(recommendations.liked_documents())
+        documents = recommendations.liked_documents([self.users[0].id])
+        vector = model.vectors([documents[self.users[0].id]]).toarray()
+        expected = model.matrix[model.positions[self.users[0].id]].toarray()
+        self.assertTrue((abs(vector - expected) < 1e-9).all())
+
+    def test_stale_users_are_refreshed_after_responding_without_refitting(self):
+        recommendations.build_similarity_index()
+        newcomer = create_user('newcomer')
+        Like.objects.create(user=newcomer, tweet=self.tweets[2])
+        client = APIClient()
+        client.force_authenticate(newcomer)
+        with mock.patch.object(recommendations, 'refresh_users', wraps=recommendations.refresh_users) as refresh, \
+                mock.patch.object(recommendations.SimilarityModel, 'fit') as fit:
+            for _ in range(3):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(client.get('/api/recommended-tweets/').status_code, 200)
+        fit.assert_not_called()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(set(recommendations.similar_user_ids(newcomer)), {self.users[0].id, self.users[1].id})
+
+    def test_users_without_neighbours_are_refreshed_once_per_like(self):
+        recommendations.build_similarity_index()
+        loner = self.users[3]
+        with mock.patch.object(recommendations, 'refresh_users', wraps=recommendations.refresh_users) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                recommendations.similar_user_ids(loner)
+            self.assertEqual(refresh.call_count, 0)
+            Like.objects.create(user=loner, tweet=self.tweets[1])
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    recommendations.similar_user_ids(loner)
+            self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(recommendations.similar_user_ids(loner), [self.users[2].id])
+
+    def test_model_file_is_shared(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(RECOMMENDATIONS_MODEL=os.path.join(directory, 'similarity.npz')):
+            recommendations.build_similarity_index()
+            built = recommendations.get_model()
+            recommendations.reset()
+            loaded = recommendations.get_model()
+            self.assertIsNot(loaded, built)
+            self.assertEqual(loaded.terms.tolist(), built.terms.tolist())
+            self.assertEqual((loaded.matrix != built.matrix).nnz, 0)
+
+
+class FollowGraphTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user('user%d' % i) for i in range(5)]
+        a, b, c, d, _ = cls.users
+        Follow.objects.create(follower=a, following=b, is_accepted=True)
+        Follow.objects.create(follower=b, following=a, is_accepted=True)
+        Follow.objects.create(follower=b, following=c, is_accepted=True)
+        Follow.objects.create(follower=a, following=d, is_accepted=False)
+
+    def setUp(self):
+        graph.reset()
+
+    def test_lookups(self):
+        a, b, c, d, _ = [user.id for user in self.users]
+        follow_graph = graph.get_graph(wait=True)
+        self.assertEqual(follow_graph.followees(a).tolist(), [b])
+        self.assertEqual(follow_graph.neighbours('requesters', d).tolist(), [a])
+        self.assertTrue(follow_graph.follows(a, b))
+        self.assertFalse(follow_graph.follows(a, d))
+        self.assertEqual(follow_graph.mutuals(a).tolist(), [b])
+        ids, counts = follow_graph.two_hop(a)
+        self.assertEqual((ids.tolist(), counts.tolist()), ([c], [1]))
+
+    def test_signals_update_the_loaded_graph(self):
+        a, b, c, d, e = self.users
+        follow_graph = graph.get_graph(wait=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=a, following=b).delete()
+            Follow.objects.filter(follower=a, following=d).update(is_accepted=True)
+            Follow.objects.get(follower=a, following=d).save()
+            Follow.objects.create(follower=a, following=e, is_accepted=True)
+        self.assertEqual(follow_graph.followees(a.id).tolist(), [d.id, e.id])
+        self.assertFalse(follow_graph.follows(a.id, b.id))
+        self.assertEqual(follow_graph.neighbours('requested', a.id).tolist(), [])
+
+    def test_first_graph_is_built_in_the_background(self):
+        a, b = self.users[:2]
+        executor = mock.Mock()
+        with mock.patch.object(graph, 'get_executor', return_value=executor):
+            self.assertIsNone(graph.get_graph())
+            self.assertIsNone(graph.get_graph())
+        # Queued once, the request went on without it
+        executor.submit.assert_called_once_with(graph.run)
+        self.assertIsNone(graph._graph)
+        # Meanwhile the recommended feed reads the followees from the table
+        Like.objects.create(user=b, tweet=Tweet.objects.create(user=self.users[2], content='liked'))
+        Like.objects.create(user=a, tweet=Tweet.objects.create(user=self.users[4], content='liked too'))
+        SimilarUser.objects.create(user=a, similar_user=b, score=1, computed_at=timezone.now())
+        Tweet.objects.create(user=b, content='followed')
+        client = APIClient()
+        client.force_authenticate(a)
+        with mock.patch.object(graph, 'get_executor', return_value=executor):
+            response = client.get('/api/recommended-tweets/')
+        self.assertIn('followed', [item['content'] for item in response.json()['results']])
+        graph.run()
+        self.assertTrue(graph.get_graph().follows(a.id, b.id))
+
+    @override_settings(FOLLOW_GRAPH_BACKGROUND_REBUILD=False)
+    def test_old_graph_is_served_while_rebuilt(self):
+        a, b, c, d, e = self.users
+        old = graph.FollowGraph.from_database()
+        old.created_at -= 3600
+        graph._graph = old
+        build = graph.FollowGraph.from_database
+
+        def build_while_following():
+            built = build()
+            # Committed after the rebuild read the Follow table
+            Follow.objects.create(follower=a, following=e, is_accepted=True)
+            graph.edge_changed(a.id, e.id, True)
+            return built
+
+        with mock.patch.object(graph.FollowGraph, 'from_database', side_effect=build_while_following):
+            self.assertIs(graph.get_graph(), old)
+        rebuilt = graph.get_graph()
+        self.assertIsNot(rebuilt, old)
+        self.assertEqual(rebuilt.followees(a.id).tolist(), [b.id, e.id])
+        self.assertTrue(old.follows(a.id, e.id))
+        # Fresh, so served without another rebuild
+        with mock.patch.object(graph.FollowGraph, 'from_database') as from_database:
+            self.assertIs(graph.get_graph(), rebuilt)
+        from_database.assert_not_called()
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.snap')
+            graph.get_graph(wait=True).save(path)
+            loaded = graph.FollowGraph.load(path)
+        self.assertEqual(loaded.followees(self.users[1].id).tolist(), [self.users[0].id, self.users[2].id])
+        self.assertEqual(loaded.followees(10 ** 6).tolist(), [])
+
+
+@override_settings(SUGGESTIONS_WORKERS=0)
+class SuggestionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user('user%d' % i) for i in range(6)]
+        viewer, a, b, c, d, e = cls.users
+        for follower, following in ((viewer, a), (viewer, b), (a, c), (b, c), (b, d), (c, e)):
+            Follow.objects.create(follower=follower, following=following, is_accepted=True)
+        Follow.objects.create(follower=viewer, following=e, is_accepted=False)
+
+    def setUp(self):
+        graph.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def suggested(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get('/api/suggestions/')
+        self.assertEqual(response.status_code, 200)
+        return [item['user']['username'] for item in response.json()]
+
+    def test_ranks_friends_of_friends_and_skips_followed_and_requested(self):
+        # Computed after the first response
+        with mock.patch.object(suggestions, 'compute_for_user', wraps=suggestions.compute_for_user) as compute:
+            self.assertEqual(self.suggested(), [])
+        compute.assert_called_once()
+        # user3 is followed by two followees, user4 by one, user5 is requested
+        self.assertEqual(self.suggested(), ['user3', 'user4'])
+
+    def test_follow_changes_trigger_a_recompute(self):
+        self.suggested()
+        self.suggested()
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.users[0], following=self.users[5]).delete()
+            Follow.objects.create(follower=self.users[0], following=self.users[3], is_accepted=True)
+        # Served the previous ones while recomputing; user5 comes through
+        # user3, who follows fewer accounts than user2
+        self.assertEqual(self.suggested(), ['user4'])
+        self.assertEqual(self.suggested(), ['user5', 'user4'])
+
+    @override_settings(SUGGESTIONS_LIKES_PER_TWEET=2)
+    def test_only_the_latest_likes_of_a_tweet_count(self):
+        viewer, *others = self.users
+        tweet = Tweet.objects.create(user=others[0], content='viral')
+        for user in (viewer, *others):
+            Like.objects.create(user=user, tweet=tweet)
+        with mock.patch.object(suggestions, 'like_matrix', wraps=suggestions.like_matrix) as like_matrix:
+            suggestions.compute_for_user(viewer.id, 20)
+        self.assertEqual(len(like_matrix.call_args.args[0]), 2)
+
+
+class ToggleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('liker')
+        cls.tweet = Tweet.objects.create(user=create_user('author'), content='tweet')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def like_count(self):
+        return Tweet.objects.get(pk=self.tweet.pk).like_count
+
+    def test_like_toggles_and_sets(self):
+        url = '/api/like/%d/' % self.tweet.pk
+        self.assertEqual(self.client.post(url).json(), {'liked': True})
+        self.assertEqual(self.like_count(), 1)
+        self.assertEqual(self.client.post(url).json(), {'liked': False})
+        self.assertEqual(self.like_count(), 0)
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, {'liked': True}, format='json').json(), {'liked': True})
+        self.assertEqual(self.like_count(), 1)
+        self.assertEqual(self.client.post('/api/like/%d/' % (self.tweet.pk + 100)).status_code, 404)
+
+    def test_retweet_twice(self):
+        first = self.client.post('/api/retweet/', {'tweet': self.tweet.pk}, format='json')
+        second = self.client.post('/api/retweet/', {'tweet': self.tweet.pk}, format='json')
+        self.assertEqual((first.status_code, second.status_code), (201, 200))
+        self.assertEqual(Tweet.objects.get(pk=self.tweet.pk).retweet_count, 1)
+
+    def test_buffer_coalesces_until_flush(self):
+        buffer = toggles.LikeBuffer(toggles.likes, interval=60)
+        buffer._start = lambda: None
+        self.assertTrue(buffer.submit(self.user.id, self.tweet.pk))
+        self.assertFalse(buffer.submit(self.user.id, self.tweet.pk))
+        self.assertTrue(buffer.submit(self.user.id, self.tweet.pk))
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.like_count(), 1)
+        self.assertFalse(buffer.submit(self.user.id, self.tweet.pk))
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.like_count(), 0)
+        self.assertIsNone(buffer.submit(self.user.id, self.tweet.pk + 100))
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        cards.local_cards.clear()
+        self.user = create_user('pictured')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self):
+        image = Image.new('RGB', (900, 600), (200, 30, 30))
+        exif = Image.Exif()
+        exif[0x0110] = 'Secret camera'
+        exif[0x0112] = 6  # rotated 90 degrees
+        content = io.BytesIO()
+        image.save(content, 'JPEG', exif=exif)
+        return SimpleUploadedFile('me.jpg', content.getvalue(), 'image/jpeg')
+
+    def test_upload_makes_stripped_hashed_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/my-profile/', {'profile_pic': self.upload()}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        profile = UserProfile.objects.get(user=self.user)
+        sizes = profile.image_variants['profile_pic']['sizes']
+        self.assertEqual(set(sizes), set(images.VARIANTS['profile_pic']))
+        with profile.profile_pic.storage.open(sizes['large']['jpeg']) as file:
+            variant = Image.open(file)
+            self.assertEqual(variant.size, (400, 400))
+            self.assertFalse(variant.getexif())
+        self.assertRegex(sizes['small']['webp'], r'^profile_pics/variants/[0-9a-f]{32}\.webp$')
+
+        author = self.client.get('/api/user-profile/%d/' % profile.pk).json()['user']
+        self.assertTrue(author['profile_pic'].endswith(sizes['small']['webp']))
+
+    def test_backfill_command(self):
+        UserProfile.objects.filter(user=self.user).update(profile_pic='profile_pics/me.jpg')
+        storage = UserProfile._meta.get_field('profile_pic').storage
+        storage.save('profile_pics/me.jpg', self.upload())
+        call_command('process_profile_images', workers=1, stdout=io.StringIO())
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.image_variants['profile_pic']['source'], 'profile_pics/me.jpg')
+        self.assertEqual(images.outdated_fields(profile), [])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('stamped')
+        cls.private_author = create_user('stamped_private', is_public=False)
+        cls.tweet = Tweet.objects.create(user=cls.author, content='tweet')
+        cls.private_tweet = Tweet.objects.create(user=cls.private_author, content='private tweet')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user('reader'))
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers=headers)
+        return response, len(queries)
+
+    def test_not_modified_until_the_tweet_changes(self):
+        url = '/api/tweets/%d/' % self.tweet.pk
+        response, _ = self.get(url)
+        etag = response['ETag']
+        response, queries = self.get(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 1)
+
+        toggles.likes.toggle(self.author.id, self.tweet.pk)
+        response, _ = self.get(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['likes_count'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rendered_json_is_shared_by_viewers_of_public_profiles(self):
+        url = '/api/user-profile/%d/' % self.author.userprofile.pk
+        first, rendered_queries = self.get(url)
+        self.client.force_authenticate(create_user('other_reader'))
+        second, queries = self.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertLess(queries, rendered_queries)
+
+    def test_hidden_tweets(self):
+        self.assertEqual(self.client.get('/api/tweets/%d/' % self.private_tweet.pk).status_code, 404)
+        response = self.client.get('/api/user-tweets/%d/' % self.private_author.pk)
+        self.assertEqual(response.json()['results'], [])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('writer')
+
+    def request(self, method='get', user=None, cookies=None):
+        request = getattr(RequestFactory(), method)('/api/tweets/')
+        request.user = user or self.user
+        request.COOKIES.update(cookies or {})
+        return request
+
+    def test_writes_make_reads_sticky(self):
+        middleware = db_routing.ReplicaStickinessMiddleware(lambda request: HttpResponse(status=201))
+        response = middleware(self.request())
+        self.assertFalse(response.cookies)
+        self.assertFalse(db_routing.is_sticky(self.request()))
+        response = middleware(self.request('post'))
+        cookie = response.cookies[db_routing.COOKIE_NAME]
+        self.assertEqual(cookie['max-age'], 10)
+        self.assertTrue(cookie['httponly'])
+        self.assertTrue(db_routing.is_sticky(self.request(cookies={cookie.key: cookie.value})))
+        # Cookie-less clients are matched through the cache
+        self.assertTrue(db_routing.is_sticky(self.request()))
+
+    def test_sticky_cookie_is_signed_and_per_user(self):
+        middleware = db_routing.ReplicaStickinessMiddleware(lambda request: HttpResponse(status=201))
+        cookie = middleware(self.request('post')).cookies[db_routing.COOKIE_NAME]
+        cache.clear()
+        other = create_user('other_writer')
+        self.assertTrue(db_routing.is_sticky(self.request(cookies={cookie.key: cookie.value})))
+        self.assertFalse(db_routing.is_sticky(self.request(user=other, cookies={cookie.key: cookie.value})))
+        self.assertFalse(db_routing.is_sticky(self.request(cookies={cookie.key: str(other.pk)})))
+        with self.settings(REPLICA_STICKY_SECONDS=-1):
+            self.assertFalse(db_routing.is_sticky(self.request(cookies={cookie.key: cookie.value})))
+
+    def test_router(self):
+        router = db_routing.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Tweet))
+        token = db_routing._replica.set('replica1')
+        try:
+            self.assertEqual(router.db_for_read(Tweet), 'replica1')
+            self.assertEqual(router.db_for_write(Tweet), 'default')
+            # DatabaseCache entries are read from where they are invalidated
+            self.assertEqual(router.db_for_read(DatabaseCache('django_cache', {}).cache_model_class), 'default')
+        finally:
+            db_routing._replica.reset(token)
+        self.assertFalse(router.allow_migrate('replica1', 'tweets'))
+
+    def test_cached_reads_use_the_primary(self):
+        followed = create_user('followed', is_public=False)
+        Follow.objects.create(follower=self.user, following=followed, is_accepted=True)
+        tweet = Tweet.objects.create(user=followed, content='tweet')
+        Comment.objects.create(user=self.user, tweet=tweet, content='comment')
+        # 'replica1' is not a configured database, reading from it would fail
+        token = db_routing._replica.set('replica1')
+        try:
+            self.assertEqual(visibility.private_followee_ids(self.user.pk), {followed.pk})
+            self.assertEqual(set(cards.load_cards([followed.pk])), {followed.pk})
+            self.assertEqual(len(comments.render_previews([tweet.pk])[tweet.pk]), 1)
+            self.assertEqual(timeline.celebrity_ids(), [])
+            with self.assertRaises(ConnectionDoesNotExist):
+                list(Follow.objects.all())
+        finally:
+            db_routing._replica.reset(token)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Reads the SQLite query plan format')
+class QueryPlanTests(TestCase):
+    """The hot queries are index lookups: no full table scan, no sort of their rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('planned')
+        cls.tweet = Tweet.objects.create(user=cls.user, content='tweet')
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndexes(self, queryset, sorts_result=False):
+        plan = self.plan(queryset)
+        subqueries = {line.split()[-1] for line in plan if line.startswith('CO-ROUTINE')}
+        for line in plan:
+            words = line.split()
+            # Walking a whole index in order (under a LIMIT) is fine, reading
+            # the whole table is not
+            if words[0] == 'SCAN' and 'USING' not in words and words[1] not in subqueries and not words[1].startswith('('):
+                self.fail('Full scan in %s' % plan)
+            # Unless the rows sorted are few by construction
+            if line.startswith('USE TEMP B-TREE') and not sorts_result:
+                self.fail('Sort in %s' % plan)
+
+    def test_tweets_of_a_user(self):
+        viewer = create_user('plan_viewer')
+        tweets = VisibilityService(viewer).filter_tweets(Tweet.objects.filter(user=self.user))
+        self.assertUsesIndexes(tweets.order_by('-created_at', '-id')[:11])
+        self.assertUsesIndexes(VisibilityService(viewer).filter_tweets(Tweet.objects.all()).order_by('-created_at', '-id')[:11])
+
+    def test_follows(self):
+        self.assertUsesIndexes(Follow.objects.filter(following=self.user, is_accepted=False).order_by('-created_at'))
+        self.assertUsesIndexes(Follow.objects.filter(following=self.user, is_accepted=False, created_at__lt=timezone.now()))
+        self.assertUsesIndexes(Follow.objects.filter(following=self.user, is_accepted=True).values('follower_id'))
+
+    def test_comments(self):
+        self.assertUsesIndexes(self.tweet.comment_set.order_by('-created_at')[:3])
+        # Orders the (at most 3 per tweet) previews of a page
+        self.assertUsesIndexes(latest_comments_queryset().filter(tweet_id__in=[self.tweet.pk]), sorts_result=True)
+
+    def test_comment_threads(self):
+        comment = Comment.objects.create(user=self.user, tweet=self.tweet, content='comment')
+        self.assertUsesIndexes(Comment.objects.filter(tweet=self.tweet, parent=None).order_by('-created_at', '-id')[:11])
+        self.assertUsesIndexes(Comment.objects.filter(tweet=self.tweet, parent=comment).order_by('-created_at', '-id')[:11])
+        # Oldest first, sorting the subtree's rows only
+        self.assertUsesIndexes(comments.subtree(comment), sorts_result=True)
+
+    def test_login_lookup(self):
+        self.assertUsesIndexes(authentication.candidates('Planned@Example.com'))
+
+    def test_likes_and_timeline(self):
+        self.assertUsesIndexes(Like.objects.filter(user=self.user).order_by('-created_at'))
+        self.assertUsesIndexes(Like.objects.filter(user=self.user).values('tweet_id'))
+        self.assertUsesIndexes(timeline.DatabaseTimelineBackend().get_tweet_ids(self.user.pk))
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('login')
+        self.backend = authentication.EmailOrUsernameModelBackend()
+
+    def test_username_or_email(self):
+        self.assertEqual(self.backend.authenticate(None, 'login', 'password'), self.user)
+        self.assertEqual(self.backend.authenticate(None, 'Login@Example.com', 'password'), self.user)
+        self.assertIsNone(self.backend.authenticate(None, 'login', 'wrong'))
+
+    def test_misses_are_remembered_until_a_user_is_saved(self):
+        self.assertIsNone(self.backend.authenticate(None, 'newcomer', 'password'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.backend.authenticate(None, 'newcomer', 'password'))
+        newcomer = create_user('newcomer')
+        self.assertEqual(self.backend.authenticate(None, 'newcomer', 'password'), newcomer)
+
+    def test_login_is_throttled_per_account(self):
+        client = APIClient()
+        for _ in range(10):
+            response = client.post('/api/login/', {'username': 'login', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 401)
+        response = client.post('/api/login/', {'username': 'LOGIN', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_login_body_that_is_not_an_object(self):
+        client = APIClient()
+        for body in ([1, 2], 'login', None):
+            response = client.post('/api/login/', body, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class TokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        revocation.reset()
+        self.user = create_user('bearer')
+        self.client = APIClient()
+        response = self.client.post('/api/login/', {'username': 'bearer', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.tokens = response.data
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % self.tokens['access'])
+
+    def test_reads_build_the_user_from_claims(self):
+        Tweet.objects.create(user=self.user, content='own tweet')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/user-tweets/%d/' % self.user.pk)
+        self.assertEqual(response.status_code, 200)
+        # No lookup of the requesting user
+        self.assertFalse([query for query in queries if 'FROM "auth_user" WHERE' in query['sql']])
+        self.assertEqual(self.client.post('/api/tweets/create/', {'content': 'written'}).status_code, 201)
+        self.assertEqual(Tweet.objects.filter(user=self.user, content='written').count(), 1)
+
+    def test_revoked_tokens_are_rejected(self):
+        response = self.client.post('/api/token/revoke/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/tweets/').status_code, 403)
+        response = APIClient().post('/api/token/refresh/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+        # Another process learns of it at its next sync
+        other = revocation.Denylist()
+        self.assertIsNone(other._filter)
+        self.assertTrue(other.is_revoked(AccessToken(self.tokens['access'])['jti']))
+        self.assertFalse(other.is_revoked('not-revoked'))
+
+    def test_bloom_filter(self):
+        bloom = revocation.BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom.add('revoked-%d' % number)
+        self.assertTrue(all('revoked-%d' % number in bloom for number in range(1000)))
+        false_positives = sum('other-%d' % number in bloom for number in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class UserCardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user('card%d' % number) for number in range(5)]
+
+    def setUp(self):
+        cache.clear()
+        cards.local_cards.clear()
+        self.addCleanup(cards.local_cards.clear)
+
+    def test_one_bulk_fetch(self):
+        user_ids = [user.pk for user in self.users]
+        with self.assertNumQueries(1):
+            found = cards.get_cards(user_ids + [0])
+        self.assertEqual(set(found), set(user_ids))
+        self.assertEqual(found[user_ids[0]], {'id': user_ids[0], 'username': 'card0', 'avatar': None, 'is_public': True})
+        with self.assertNumQueries(0):
+            cards.get_cards(user_ids)
+        cards.local_cards.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(cards.get_cards(user_ids), found)
+
+    def test_saves_invalidate(self):
+        user = self.users[0]
+        cards.get_cards([user.pk])
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(cards.get_cards([user.pk])[user.pk]['username'], 'renamed')
+        profile = UserProfile.objects.get(user=user)
+        profile.is_public = False
+        profile.save()
+        self.assertFalse(cards.get_cards([user.pk])[user.pk]['is_public'])
+
+    def test_local_size_follows_settings(self):
+        with self.settings(USER_CARD_LOCAL_SIZE=2):
+            cards.get_cards([user.pk for user in self.users])
+            self.assertEqual(len(cards.local_cards.get_many([user.pk for user in self.users])), 2)
+
+
+class SerializationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = create_user('reader')
+        cls.author = create_user('writer')
+        hidden = create_user('hidden', is_public=False)
+        for number in range(5):
+            tweet = Tweet.objects.create(user=cls.author, content='tweet %d \u2028' % number)
+            Comment.objects.create(user=cls.viewer, tweet=tweet, content='comment %d' % number)
+        Tweet.objects.create(user=hidden, content='hidden')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lean_serializer_matches_tweet_serializer(self):
+        request = RequestFactory().get('/api/tweets/')
+        request.user = self.viewer
+        tweets = VisibilityService(self.viewer).filter_tweets(Tweet.objects.all()).order_by('-created_at', '-id')
+        expected = TweetSerializer(list(tweets.for_serializer()), many=True, context={'request': request}).data
+        lean = LeanTweetSerializer(LeanTweetSerializer.rows(tweets), many=True, context={'request': request}).data
+        self.assertEqual(len(lean), 5)
+        self.assertEqual(lean, expected)
+        self.assertEqual(renderers.ORJSONRenderer().render(lean), JSONRenderer().render(expected))
+
+    def test_large_responses_are_compressed(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        with self.settings(COMPRESSION_MIN_SIZE=100):
+            response = client.get('/api/user-tweets/%d/' % self.author.pk, HTTP_ACCEPT_ENCODING='br;q=0.5, gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertTrue(response['ETag'].startswith('W/'))
+            self.assertEqual(json.loads(gzip.decompress(response.content))['results'][0]['content'], 'tweet 4 \u2028')
+        response = client.get('/api/user-tweets/%d/?page_size=1' % self.author.pk, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_only_json_is_compressed(self):
+        # The browsable API's HTML holds a CSRF token
+        middleware = compression.CompressionMiddleware(lambda request: HttpResponse('x' * 2000, content_type='text/html'))
+        request = RequestFactory().get('/api/tweets/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(middleware(request).has_header('Content-Encoding'))
+        middleware.get_response = lambda request: HttpResponse('x' * 2000, content_type='application/json; charset=utf-8')
+        self.assertEqual(middleware(request)['Content-Encoding'], 'gzip')
+
+    def test_fast_json_is_opt_in(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        response = client.get('/api/user-tweets/%d/' % self.author.pk)
+        self.assertIsInstance(response.accepted_renderer, JSONRenderer)
+        self.assertNotIsInstance(response.accepted_renderer, renderers.ORJSONRenderer)
+        self.assertFalse(response.renderer_context['view'].is_lean())
+
+    def test_accept_encoding(self):
+        self.assertEqual(compression.accepted_codings('gzip;q=0.8, br, identity;q=0'), {'gzip': 0.8, 'br': 1.0})
+        self.assertEqual(compression.choose_coding('deflate, gzip;q=0'), None)
+        self.assertEqual(compression.choose_coding('*'), 'br' if compression.brotli is not None else 'gzip')
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('commenter')
+        self.tweet = Tweet.objects.create(user=self.user, content='tweet')
+        self.other = Tweet.objects.create(user=self.user, content='other tweet')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, tweet, content, parent=None):
+        data = {'content': content} if parent is None else {'content': content, 'parent': parent}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/comments/%d/' % tweet.pk, data)
+
+    def test_comments_are_listed_per_tweet_in_pages(self):
+        for number in range(3):
+            self.post(self.tweet, 'comment %d' % number)
+        self.post(self.other, 'elsewhere')
+        response = self.client.get('/api/comments/%d/?page_size=2' % self.tweet.pk)
+        self.assertEqual([item['content'] for item in response.data['results']], ['comment 2', 'comment 1'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['content'] for item in response.data['results']], ['comment 0'])
+        self.assertIsNone(response.data['next'])
+
+    def test_replies(self):
+        root = self.post(self.tweet, 'root').data['id']
+        reply = self.post(self.tweet, 'reply', root).data['id']
+        self.post(self.tweet, 'nested', reply)
+        self.post(self.tweet, 'second reply', root)
+        self.assertEqual(self.post(self.other, 'wrong tweet', root).status_code, 400)
+        self.assertEqual(Comment.objects.get(content='nested').path, '%d.%d.' % (root, reply))
+
+        top = self.client.get('/api/comments/%d/' % self.tweet.pk).data['results']
+        self.assertEqual([(item['content'], item['reply_count']) for item in top], [('root', 2)])
+        replies = self.client.get('/api/comments/%d/?parent=%d' % (self.tweet.pk, root)).data['results']
+        self.assertEqual([item['content'] for item in replies], ['second reply', 'reply'])
+        with self.assertNumQueries(3):
+            thread = self.client.get('/api/comments/thread/%d/' % root).data
+        self.assertEqual([item['content'] for item in thread], ['root', 'reply', 'nested', 'second reply'])
+        self.assertEqual(len(self.client.get('/api/comments/thread/%d/' % reply).data), 2)
+
+    def test_subtree_is_a_path_prefix(self):
+        root = Comment.objects.create(user=self.user, tweet=self.tweet, content='root')
+        reply = Comment.objects.create(user=self.user, tweet=self.tweet, content='reply', parent=root)
+        nested = Comment.objects.create(user=self.user, tweet=self.tweet, content='nested', parent=reply)
+        self.assertEqual(nested.path, '%d.%d.' % (root.pk, reply.pk))
+        # Under a comment whose id starts with the same digits, not under root
+        Comment.objects.create(user=self.user, tweet=self.tweet, content='cousin', path='%d0.' % root.pk)
+        Comment.objects.create(user=self.user, tweet=self.other, content='other tweet', path=nested.path)
+        self.assertEqual(list(comments.subtree(root)), [reply, nested])
+        self.assertEqual(list(comments.subtree(reply)), [nested])
+
+    def test_preview_is_updated_on_insert(self):
+        self.post(self.tweet, 'first')
+        self.assertEqual([item['content'] for item in comments.previews([self.tweet.pk])[self.tweet.pk]], ['first'])
+        for number in range(3):
+            self.post(self.tweet, 'later %d' % number)
+        with self.assertNumQueries(0):
+            preview = comments.previews([self.tweet.pk])[self.tweet.pk]
+        self.assertEqual([item['content'] for item in preview], ['later 2', 'later 1', 'later 0'])
+
+    def test_hidden_tweets(self):
+        hidden = Tweet.objects.create(user=create_user('hidden_commenter', is_public=False), content='hidden')
+        comment = Comment.objects.create(user=self.user, tweet=hidden, content='comment')
+        self.assertEqual(self.client.get('/api/comments/%d/' % hidden.pk).status_code, 404)
+        self.assertEqual(self.client.get('/api/comments/thread/%d/' % comment.pk).status_code, 404)
+        self.assertEqual(self.post(hidden, 'comment').status_code, 404)
+
+
+class StartupTests(SimpleTestCase):
+    def test_startup_within_budget(self):
+        result = startup.measure(runs=1)
+        self.assertEqual(startup.over_budget(result), [])
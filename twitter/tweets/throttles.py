@@ -0,0 +1,36 @@
+"""
+Rate limits of the login view, per client address and per account.
+
+Each attempt costs a password hash (see tweets/authentication.py), so
+attempts are limited before authentication runs: `login` by the client
+address, against one source trying many accounts, and `login_account` by
+the identifier tried, against many sources trying one account. The rates
+are in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']. Behind a proxy, set DRF's
+NUM_PROXIES so that the client address is read from X-Forwarded-For.
+"""
+import hashlib
+from collections.abc import Mapping
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class LoginRateThrottle(SimpleRateThrottle):
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class LoginAccountRateThrottle(SimpleRateThrottle):
+    scope = 'login_account'
+
+    def get_cache_key(self, request, view):
+        # A JSON body may be a list or a scalar; the view rejects it later
+        if not isinstance(request.data, Mapping):
+            return None
+        identifier = request.data.get('username')
+        if not isinstance(identifier, str) or not identifier:
+            return None
+        # Case variants of an email address count as the same account
+        ident = hashlib.blake2b(identifier.strip().lower().encode(), digest_size=16).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
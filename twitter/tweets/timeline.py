@@ -0,0 +1,339 @@
+"""
+Materialized home timelines for FollowingTweetsListView.
+
+When a tweet is created its id is pushed into the bounded timeline of every
+accepted follower of the author (fan-out-on-write). Authors with more
+accepted followers than TIMELINE_CELEBRITY_THRESHOLD are skipped at write
+time; their tweets are merged into the feed when it is read instead
+(fan-out-on-read).
+
+The storage is pluggable through the TIMELINE_BACKEND setting:
+
+* DatabaseTimelineBackend    - TimelineEntry rows (default)
+* LocalMemoryTimelineBackend - per-process lists, same semantics as the
+                               Redis LPUSH/LTRIM/LRANGE commands
+* RedisTimelineBackend       - a local Redis server (needs the redis package)
+"""
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import router
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils.module_loading import import_string
+
+from .models import Follow, TimelineEntry, Tweet
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def max_length():
+    return get_setting('TIMELINE_MAX_LENGTH', 800)
+
+
+def celebrity_threshold():
+    return get_setting('TIMELINE_CELEBRITY_THRESHOLD', 10000)
+
+
+class BaseTimelineBackend:
+    """
+    Stores, per user, the ids of the newest tweets of the accounts they follow.
+    Every timeline keeps at most TIMELINE_MAX_LENGTH ids, newest first.
+    """
+
+    def push(self, user_ids, tweet_id, author_id):
+        """Push one new tweet to the top of several timelines."""
+        raise NotImplementedError
+
+    def extend(self, user_id, tweets):
+        """Merge (tweet_id, author_id) pairs into one timeline (backfill)."""
+        raise NotImplementedError
+
+    def extend_many(self, user_ids, tweets):
+        """Merge the same (tweet_id, author_id) pairs into several timelines."""
+        for user_id in user_ids:
+            self.extend(user_id, tweets)
+
+    def remove_author(self, user_id, author_id):
+        """Drop every tweet of author_id from user_id's timeline (unfollow)."""
+        raise NotImplementedError
+
+    def clear(self, user_id):
+        raise NotImplementedError
+
+    def get_tweet_ids(self, user_id):
+        """
+        Return the tweet ids of a timeline, either as a list or as a queryset
+        usable in an `id__in` lookup.
+        """
+        raise NotImplementedError
+
+
+class DatabaseTimelineBackend(BaseTimelineBackend):
+    """
+    Timelines as TimelineEntry rows, bounded on read. Trimming reads every
+    row of the timelines trimmed, so pushes only trim the recipients of one
+    tweet in TIMELINE_TRIM_EVERY (by id); a timeline then holds about
+    TIMELINE_MAX_LENGTH + TIMELINE_TRIM_EVERY rows at most. extend(),
+    extend_many() and the backfill_timelines command trim right away.
+    """
+
+    def push(self, user_ids, tweet_id, author_id):
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, tweet_id=tweet_id) for user_id in user_ids],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        if tweet_id % get_setting('TIMELINE_TRIM_EVERY', 50) == 0:
+            self.trim_many(user_ids)
+
+    def extend(self, user_id, tweets):
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, tweet_id=tweet_id) for tweet_id, _ in tweets],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        self.trim(user_id)
+
+    def extend_many(self, user_ids, tweets):
+        # One insert and one trim for every timeline
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, tweet_id=tweet_id) for user_id in user_ids for tweet_id, _ in tweets],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        self.trim_many(user_ids)
+
+    def trim(self, user_id):
+        self.trim_many([user_id])
+
+    def trim_many(self, user_ids, batch_size=1000):
+        """Delete all but the newest TIMELINE_MAX_LENGTH entries of each timeline, one statement per batch."""
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), batch_size):
+            overflow = TimelineEntry.objects.filter(user_id__in=user_ids[start:start + batch_size]).annotate(
+                rank=Window(RowNumber(), partition_by=F('user_id'), order_by=F('tweet_id').desc()),
+            ).filter(rank__gt=max_length())
+            # No signals or cascades; the raw delete skips loading the rows
+            TimelineEntry.objects.filter(id__in=overflow.values('id'))._raw_delete(router.db_for_write(TimelineEntry))
+
+    def remove_author(self, user_id, author_id):
+        TimelineEntry.objects.filter(user_id=user_id, tweet__user_id=author_id).delete()
+
+    def clear(self, user_id):
+        TimelineEntry.objects.filter(user_id=user_id).delete()
+
+    def get_tweet_ids(self, user_id):
+        entries = TimelineEntry.objects.filter(user_id=user_id).order_by('-tweet_id')
+        return entries.values('tweet_id')[:max_length()]
+
+
+class LocalMemoryTimelineBackend(BaseTimelineBackend):
+    """
+    Timelines held in the memory of the current process. Only suitable for a
+    single worker, or for tests; timelines are lost on restart and have to be
+    rebuilt with the backfill_timelines command.
+    """
+
+    def __init__(self):
+        self._timelines = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def push(self, user_ids, tweet_id, author_id):
+        limit = max_length()
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines[user_id]
+                timeline.insert(0, (tweet_id, author_id))
+                del timeline[limit:]
+
+    def extend(self, user_id, tweets):
+        with self._lock:
+            merged = set(self._timelines[user_id]) | set(tweets)
+            self._timelines[user_id] = sorted(merged, reverse=True)[:max_length()]
+
+    def remove_author(self, user_id, author_id):
+        with self._lock:
+            self._timelines[user_id] = [
+                entry for entry in self._timelines[user_id] if entry[1] != author_id
+            ]
+
+    def clear(self, user_id):
+        with self._lock:
+            self._timelines.pop(user_id, None)
+
+    def get_tweet_ids(self, user_id):
+        with self._lock:
+            return [tweet_id for tweet_id, _ in self._timelines.get(user_id, ())]
+
+
+class RedisTimelineBackend(BaseTimelineBackend):
+    """
+    Timelines as Redis lists of "tweet_id:author_id" members, newest first.
+    The server is configured with TIMELINE_REDIS_URL.
+    """
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("RedisTimelineBackend requires the 'redis' package.")
+        self._redis = redis.Redis.from_url(get_setting('TIMELINE_REDIS_URL', 'redis://localhost:6379/0'))
+
+    def _key(self, user_id):
+        return 'timeline:%s' % user_id
+
+    def _read(self, user_id):
+        members = self._redis.lrange(self._key(user_id), 0, -1)
+        return [tuple(int(part) for part in member.split(b':')) for member in members]
+
+    def _write(self, user_id, tweets):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(user_id))
+        if tweets:
+            pipe.rpush(self._key(user_id), *['%s:%s' % entry for entry in tweets])
+        pipe.execute()
+
+    def push(self, user_ids, tweet_id, author_id):
+        limit = max_length()
+        pipe = self._redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.lpush(self._key(user_id), '%s:%s' % (tweet_id, author_id))
+            pipe.ltrim(self._key(user_id), 0, limit - 1)
+        pipe.execute()
+
+    def extend(self, user_id, tweets):
+        merged = set(self._read(user_id)) | set(tweets)
+        self._write(user_id, sorted(merged, reverse=True)[:max_length()])
+
+    def remove_author(self, user_id, author_id):
+        self._write(user_id, [entry for entry in self._read(user_id) if entry[1] != author_id])
+
+    def clear(self, user_id):
+        self._redis.delete(self._key(user_id))
+
+    def get_tweet_ids(self, user_id):
+        return [tweet_id for tweet_id, _ in self._read(user_id)]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_timeline_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = get_setting('TIMELINE_BACKEND', 'tweets.timeline.DatabaseTimelineBackend')
+                _backend = import_string(path)()
+    return _backend
+
+
+def celebrity_ids():
+    """
+    Ids of the accounts served by fan-out-on-read. The list is small and
+    changes slowly, so it is computed with one grouped query and cached.
+
+    The last computed list is also kept without expiry. An account that has
+    left it since was skipped by fan_out_tweet() while it was a celebrity and
+    is no longer merged in on read, so its followers are backfilled.
+    """
+    ids = cache.get('timeline:celebrities')
+    if ids is None:
+        # From the primary: cached, a lagging replica's list would outlive it
+        ids = list(
+            Follow.objects.db_manager(router.db_for_write(Follow)).filter(is_accepted=True)
+            .values('following')
+            .annotate(followers_count=Count('id'))
+            .filter(followers_count__gt=celebrity_threshold())
+            .values_list('following', flat=True)
+        )
+        previous = cache.get('timeline:celebrities:last')
+        cache.set('timeline:celebrities', ids, get_setting('TIMELINE_CELEBRITY_CACHE_TIMEOUT', 300))
+        cache.set('timeline:celebrities:last', ids, None)
+        for author_id in set(previous or ()) - set(ids):
+            backfill_all_followers(author_id)
+    return ids
+
+
+def is_celebrity(user_id):
+    return user_id in celebrity_ids()
+
+
+def fan_out_tweet(tweet):
+    """Push a newly created tweet into the timelines of the author's followers."""
+    threshold = celebrity_threshold()
+    follower_ids = list(
+        Follow.objects.filter(following_id=tweet.user_id, is_accepted=True)
+        .values_list('follower_id', flat=True)[:threshold + 1]
+    )
+    if len(follower_ids) > threshold:
+        # Celebrity: followers pick these tweets up at read time
+        return
+    get_timeline_backend().push(follower_ids, tweet.id, tweet.user_id)
+
+
+def latest_tweets_of(author_ids):
+    return list(
+        Tweet.objects.filter(user_id__in=author_ids)
+        .order_by('-id')
+        .values_list('id', 'user_id')[:max_length()]
+    )
+
+
+def backfill_followee(follower_id, following_id):
+    """Called when a follow is accepted: merge the followee's latest tweets."""
+    if is_celebrity(following_id):
+        return
+    get_timeline_backend().extend(follower_id, latest_tweets_of([following_id]))
+
+
+def backfill_followers(follower_ids, following_id):
+    """backfill_followee() for several followers accepted at once."""
+    if not follower_ids or is_celebrity(following_id):
+        return
+    get_timeline_backend().extend_many(follower_ids, latest_tweets_of([following_id]))
+
+
+def backfill_all_followers(following_id, batch_size=100):
+    """Merge the latest tweets of a former celebrity into every follower's timeline."""
+    tweets = latest_tweets_of([following_id])
+    follower_ids = list(Follow.objects.filter(following_id=following_id, is_accepted=True).values_list('follower_id', flat=True))
+    backend = get_timeline_backend()
+    for start in range(0, len(follower_ids), batch_size):
+        backend.extend_many(follower_ids[start:start + batch_size], tweets)
+
+
+def remove_followee(follower_id, following_id):
+    """Called when a follow is deleted: drop the followee's tweets."""
+    get_timeline_backend().remove_author(follower_id, following_id)
+
+
+def rebuild_timeline(user_id):
+    """Rebuild a timeline from scratch out of the Follow and Tweet tables."""
+    followee_ids = Follow.objects.filter(follower_id=user_id, is_accepted=True).exclude(
+        following_id__in=celebrity_ids()
+    ).values('following_id')
+    backend = get_timeline_backend()
+    backend.clear(user_id)
+    backend.extend(user_id, latest_tweets_of(followee_ids))
+
+
+def home_timeline_queryset(user):
+    """
+    The home feed of `user`: their materialized timeline, the tweets of the
+    celebrities they follow and their own tweets.
+    """
+    celebrity_followees = Follow.objects.filter(
+        follower=user, is_accepted=True, following_id__in=celebrity_ids()
+    ).values('following_id')
+    tweet_ids = get_timeline_backend().get_tweet_ids(user.id)
+    return Tweet.objects.filter(
+        Q(id__in=tweet_ids) | Q(user_id__in=celebrity_followees) | Q(user=user)
+    ).order_by('-created_at', '-id')
@@ -0,0 +1,244 @@
+"""
+Like and retweet toggles in as few round-trips as possible.
+
+ToggleService.toggle() first tries
+
+    INSERT INTO tweets_like (user_id, tweet_id, created_at)
+    SELECT %s, id, %s FROM tweets_tweet WHERE id = %s
+    ON CONFLICT (user_id, tweet_id) DO NOTHING
+
+and only when that inserted nothing, a DELETE of the same pair. The row
+count tells which happened, so concurrent double taps serialize on the
+unique index instead of failing on it; neither inserted nor deleted means
+the tweet does not exist. set() is the idempotent form, for clients that
+send the state they want. The counter update runs in the same transaction.
+Raw SQL sends no model signals, so the realtime counter event is published
+here.
+
+Read-your-writes: unbuffered, the change is committed before the response,
+which carries the resulting state, so any later read by the acting user
+sees it.
+
+With LIKE_BUFFER_MS set, likes go through LikeBuffer instead. The resulting
+state is computed against what this process has buffered for the pair and
+returned right away. The buffer is written with one bulk insert and one
+bulk delete every LIKE_BUFFER_MS. Until then the acting user's toggles
+still see their own buffered state, as long as they reach the same process
+(sticky sessions). Counters and other readers catch up at the flush. Pending
+likes are flushed at exit, but are lost if the process is killed.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import counters, realtime
+from .models import Like, Retweet, Tweet
+
+logger = logging.getLogger(__name__)
+
+
+class ToggleService:
+    """On/off relation between a user and a tweet, with a counter on Tweet."""
+
+    def __init__(self, model, counter, event):
+        self.model = model
+        self.counter = counter
+        self.event = event  # key of the realtime counter delta
+
+    def _connection(self):
+        return connections[router.db_for_write(self.model)]
+
+    def _insert(self, connection, user_id, tweet_id):
+        opts = self.model._meta
+        created_at = opts.get_field('created_at').get_db_prep_value(timezone.now(), connection)
+        if connection.vendor == 'mysql':
+            sql = 'INSERT IGNORE INTO {table} (user_id, tweet_id, created_at) SELECT %s, id, %s FROM {tweets} WHERE id = %s'
+        else:
+            sql = (
+                'INSERT INTO {table} (user_id, tweet_id, created_at) SELECT %s, id, %s FROM {tweets} WHERE id = %s '
+                'ON CONFLICT (user_id, tweet_id) DO NOTHING'
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(table=opts.db_table, tweets=Tweet._meta.db_table), [user_id, created_at, tweet_id])
+            return cursor.rowcount == 1
+
+    def _delete(self, connection, user_id, tweet_id):
+        return self.delete_pairs(connection, [(user_id, tweet_id)]) == 1
+
+    def delete_pairs(self, connection, pairs):
+        """Delete the rows of (user_id, tweet_id) pairs; returns how many existed."""
+        deleted = 0
+        with connection.cursor() as cursor:
+            for start in range(0, len(pairs), 500):
+                chunk = pairs[start:start + 500]
+                cursor.execute(
+                    'DELETE FROM {table} WHERE {condition}'.format(
+                        table=self.model._meta.db_table,
+                        condition=' OR '.join(['(user_id = %s AND tweet_id = %s)'] * len(chunk)),
+                    ),
+                    [value for pair in chunk for value in pair],
+                )
+                deleted += cursor.rowcount
+        return deleted
+
+    def changed(self, tweet_id, delta):
+        """Counter and realtime side effects of `delta` rows; call inside the transaction."""
+        counters.adjust_id(tweet_id, self.counter, delta)
+        realtime.counters_changed(tweet_id, realtime.tweet_author(tweet_id), **{self.event: delta})
+
+    def toggle(self, user_id, tweet_id):
+        """Flip the state; returns the new state, or None if the tweet does not exist."""
+        connection = self._connection()
+        with transaction.atomic(using=connection.alias):
+            if self._insert(connection, user_id, tweet_id):
+                self.changed(tweet_id, 1)
+                return True
+            if self._delete(connection, user_id, tweet_id):
+                self.changed(tweet_id, -1)
+                return False
+        return None
+
+    def set(self, user_id, tweet_id, on):
+        """
+        Make the state `on`. Returns whether it changed, or None if the tweet
+        does not exist.
+        """
+        connection = self._connection()
+        with transaction.atomic(using=connection.alias):
+            if on and self._insert(connection, user_id, tweet_id):
+                self.changed(tweet_id, 1)
+                return True
+            if not on and self._delete(connection, user_id, tweet_id):
+                self.changed(tweet_id, -1)
+                return True
+        if not Tweet.objects.filter(pk=tweet_id).exists():
+            return None
+        return False
+
+
+likes = ToggleService(Like, 'like_count', 'likes')
+retweets = ToggleService(Retweet, 'retweet_count', 'retweets')
+
+
+class LikeBuffer:
+    """Like states submitted by this process, written every `interval` seconds."""
+
+    def __init__(self, service, interval):
+        self.service = service
+        self.interval = interval
+        self._pending = {}  # (user_id, tweet_id) -> wanted state
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def state(self, user_id, tweet_id):
+        """Current state as this process sees it, None if the tweet does not exist."""
+        with self._lock:
+            if (user_id, tweet_id) in self._pending:
+                return self._pending[(user_id, tweet_id)]
+        liked = Like.objects.filter(user_id=user_id, tweet_id=OuterRef('pk'))
+        return Tweet.objects.filter(pk=tweet_id).values_list(Exists(liked), flat=True).first()
+
+    def submit(self, user_id, tweet_id, on=None):
+        """Buffer a set (or with `on` None, a toggle); returns the resulting state."""
+        current = self.state(user_id, tweet_id)
+        if current is None:
+            return None
+        with self._lock:
+            # Another request of the user may have been buffered meanwhile
+            current = self._pending.get((user_id, tweet_id), current)
+            state = (not current) if on is None else on
+            self._pending[(user_id, tweet_id)] = state
+            self._start()
+        return state
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing buffered likes failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Write the buffered states; returns the number of rows changed."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        pairs = list(pending)
+        existing = set()
+        for start in range(0, len(pairs), 500):
+            chunk = pairs[start:start + 500]
+            query = reduce(or_, [Q(user_id=user_id, tweet_id=tweet_id) for user_id, tweet_id in chunk])
+            existing.update(Like.objects.filter(query).values_list('user_id', 'tweet_id'))
+        tweet_ids = set(Tweet.objects.filter(id__in={tweet_id for _, tweet_id in pairs}).values_list('id', flat=True))
+        # Another process flushing the same pair concurrently can make a
+        # counter drift by one; reconcile_counters repairs that
+        added = [pair for pair, state in pending.items() if state and pair not in existing and pair[1] in tweet_ids]
+        removed = [pair for pair, state in pending.items() if not state and pair in existing]
+        deltas = defaultdict(int)
+        connection = self.service._connection()
+        with transaction.atomic(using=connection.alias):
+            # Neither sends model signals; the side effects follow per tweet
+            Like.objects.bulk_create(
+                [Like(user_id=user_id, tweet_id=tweet_id) for user_id, tweet_id in added],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            self.service.delete_pairs(connection, removed)
+            for _, tweet_id in added:
+                deltas[tweet_id] += 1
+            for _, tweet_id in removed:
+                deltas[tweet_id] -= 1
+            for tweet_id, delta in deltas.items():
+                if delta:
+                    self.service.changed(tweet_id, delta)
+        return len(added) + len(removed)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_like_buffer():
+    """The process' LikeBuffer, or None when LIKE_BUFFER_MS is not set."""
+    global _buffer
+    interval = getattr(settings, 'LIKE_BUFFER_MS', 0)
+    if not interval:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = LikeBuffer(likes, interval / 1000)
+    return _buffer
+
+
+def toggle_like(user_id, tweet_id, on=None):
+    """
+    Toggle (or with `on`, set) a like through the buffer if one is
+    configured. Returns the resulting state, None if the tweet does not exist.
+    """
+    buffer = get_like_buffer()
+    if buffer is not None:
+        return buffer.submit(user_id, tweet_id, on)
+    if on is None:
+        return likes.toggle(user_id, tweet_id)
+    changed = likes.set(user_id, tweet_id, on)
+    return None if changed is None else on
@@ -0,0 +1,83 @@
+"""
+JWT authentication without a query per request.
+
+Tokens issued at login (CustomTokenObtainPairView) carry the user's id,
+username and is_public as claims. ClaimsJWTAuthentication checks the
+signature, the expiry and the revocation denylist (tweets/revocation.py,
+usually no query) and, for GET, HEAD and OPTIONS, makes request.user a User
+instance out of the claims alone: its pk and username are set and every
+other field is deferred, so the first access to one (email, is_staff, ...)
+loads it with a query. The instance compares, filters and assigns like the
+full user, e.g. `obj.user == request.user` or `Tweet(user=request.user)`.
+
+Writes load the full user as simplejwt does, which also rejects deactivated
+accounts; reads by a deactivated account keep working until its access token
+expires (ACCESS_TOKEN_LIFETIME in SIMPLE_JWT). The username and is_public
+claims are as of login and may be outdated until the next one, so nothing
+may decide access from them.
+"""
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import revocation
+from .models import UserProfile
+
+
+def add_claims(token, user):
+    """Add the claims claims_user() reads to a token issued for `user`."""
+    token['username'] = user.get_username()
+    is_public = UserProfile.objects.filter(user_id=user.pk).values_list('is_public', flat=True).first()
+    token['is_public'] = is_public is not False
+    return token
+
+
+def claims_user(token):
+    """The token's user, built from its claims without a query."""
+    UserModel = get_user_model()
+    try:
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken(_('Token contained no recognizable user identification'))
+    values = {jwt_settings.USER_ID_FIELD: user_id}
+    if 'username' in token:
+        values[UserModel.USERNAME_FIELD] = token['username']
+    # Fields not in `values` are deferred, as if left out by .only()
+    fields = [field.attname for field in UserModel._meta.concrete_fields if field.attname in values]
+    user = UserModel.from_db(router.db_for_read(UserModel), fields, [values[field] for field in fields])
+    user.is_public = token.get('is_public')
+    return user
+
+
+def check_not_revoked(token):
+    if revocation.get_denylist().is_revoked(token[jwt_settings.JTI_CLAIM]):
+        raise InvalidToken(_('Token is revoked'))
+    return token
+
+
+def revoke(token):
+    """Reject `token` from now on, until it expires."""
+    revocation.get_denylist().revoke(token[jwt_settings.JTI_CLAIM], token['exp'])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """Bearer tokens; the user of safe requests comes from the claims."""
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = self.get_validated_token(raw_token)
+        if request.method in SAFE_METHODS:
+            return claims_user(token), token
+        return self.get_user(token), token
+
+    def get_validated_token(self, raw_token):
+        return check_not_revoked(super().get_validated_token(raw_token))
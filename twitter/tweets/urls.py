@@ -5,6 +5,7 @@ from django.contrib.auth.views import LoginView, LogoutView
 from .views import (
     TweetCreateView,
     CommentListCreateView,
+    CommentThreadView,
     FollowListCreateView,
     UserProfileDetailView,
     UserTweetsListView,
@@ -15,17 +16,30 @@ from .views import (
     RegisterView,
     MyProfileView,
     CustomTokenObtainPairView,
+    CustomTokenRefreshView,
+    TokenRevokeView,
     TweetListView,
     TweetDetailView,
     FollowRequestListView,
     AcceptFollowRequestView,
-    DenyFollowRequestView
+    DenyFollowRequestView,
+    BulkFollowRequestView,
+    SearchView,
+    SuggestionsView
 )
+from .async_views import (
+    AsyncFollowingTweetsListView,
+    AsyncUserTweetsListView,
+    AsyncUserProfileDetailView,
+    TimelineStreamView
+)
+from .profiling import ProfilingMetricsView
 
 urlpatterns = [
     path('tweets/<int:pk>/', TweetDetailView.as_view(), name='tweet-list-detail'),
     path('tweets/create/', TweetCreateView.as_view(), name='tweet-list-create'),
     path('comments/<int:pk>/', CommentListCreateView.as_view(), name='comment-detail'),
+    path('comments/thread/<int:pk>/', CommentThreadView.as_view(), name='comment-thread'),
     path('like/<int:pk>/', LikeCreateView.as_view(), name='like-create'),
     path('follow/<int:pk>/', FollowListCreateView.as_view(), name='follow-list-create'),
     #follows have problem
@@ -37,10 +51,21 @@ urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', CustomTokenObtainPairView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('token/refresh/', CustomTokenRefreshView.as_view(), name='token-refresh'),
+    path('token/revoke/', TokenRevokeView.as_view(), name='token-revoke'),
     path('my-profile/', MyProfileView.as_view(), name='my-profile'),
     path('requests/', FollowRequestListView.as_view(), name='requests'),
     path('requests/<int:pk>/accept/', AcceptFollowRequestView.as_view(), name='accept-follow-request'),
     path('requests/<int:pk>/deny/', DenyFollowRequestView.as_view(), name='deny-follow-request'),
+    path('requests/bulk/', BulkFollowRequestView.as_view(), name='bulk-follow-requests'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('suggestions/', SuggestionsView.as_view(), name='suggestions'),
+    # async variants, served without blocking when running under twitter/asgi.py
+    path('async/tweets/', AsyncFollowingTweetsListView.as_view(), name='async-tweets-list'),
+    path('async/user-tweets/<int:user>/', AsyncUserTweetsListView.as_view(), name='async-user-tweets-list'),
+    path('async/user-profile/<int:pk>/', AsyncUserProfileDetailView.as_view(), name='async-user-profile-detail'),
+    path('stream/', TimelineStreamView.as_view(), name='timeline-stream'),
+    path('metrics/', ProfilingMetricsView.as_view(), name='profiling-metrics'),
 
 ]   
 
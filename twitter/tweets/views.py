@@ -4,52 +4,159 @@ from django.shortcuts import render
 # views.py in the 'tweets' app
 from rest_framework import generics
 from .models import Tweet, Comment
-from .serializers import TweetSerializer, CommentSerializer, TweetCreationSerializer
+from .serializers import TweetSerializer, CommentSerializer, TweetCreationSerializer, LeanTweetSerializer
 from .models import Follow
 from .serializers import FollowSerializer, LikeSerializer, RetweetSerializer, UserCreationSerializer
 from .models import UserProfile  , Retweet, Like
-from .serializers import UserProfileSerializer , ProfileSerializer, FollowRequestListSerializer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
+from .serializers import UserProfileSerializer , ProfileSerializer, FollowRequestListSerializer, BulkFollowRequestSerializer
+from .serializers import FollowSuggestionSerializer
+from .serializers import ClaimsTokenObtainPairSerializer, RevocableTokenRefreshSerializer, TokenRevokeSerializer
+from .models import FollowSuggestion, SuggestionState
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.urls import reverse_lazy
 from django.contrib.auth import login
+from django.db import router, transaction
+from django.shortcuts import get_object_or_404
+from django.db.models import Case, F, When
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, pagination
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.tokens import Token
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.permissions import AllowAny
 from .permissions import IsOwnerOrReadOnly, IsFollowOwnerOrReadOnly
+from . import cards, comments, conditional, counters, graph, recommendations, search, suggestions, timeline, toggles, tokens, visibility
+from .conditional import ConditionalGetMixin
+from .db_routing import ReplicaReadMixin
+from .pagination import KeysetPagination
+from .throttles import LoginAccountRateThrottle, LoginRateThrottle
+from .visibility import VisibilityService
 from rest_framework import serializers
 from django.contrib.auth.models import User
 
+class LeanTweetListMixin:
+    """
+    Render the list's pages with LeanTweetSerializer from .values() rows,
+    unless LEAN_TWEET_SERIALIZATION is off. Same output as TweetSerializer.
+    """
+    def is_lean(self):
+        return self.request.method == 'GET' and getattr(settings, 'LEAN_TWEET_SERIALIZATION', False)
+
+    def get_serializer_class(self):
+        return LeanTweetSerializer if self.is_lean() else super().get_serializer_class()
+
+    def paginate_queryset(self, queryset):
+        if self.is_lean():
+            queryset = LeanTweetSerializer.rows(queryset)
+        return super().paginate_queryset(queryset)
+
 class TweetCreateView(generics.CreateAPIView):
     queryset = Tweet.objects.all()
     serializer_class = TweetCreationSerializer
     permission_classes = [IsAuthenticated]
-class TweetListView(generics.ListAPIView):
-    queryset = Tweet.objects.all()
+class TweetListView(LeanTweetListMixin, ReplicaReadMixin, generics.ListAPIView):
+    queryset = Tweet.objects.for_serializer()
     serializer_class = TweetSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return VisibilityService.for_request(self.request).filter_tweets(super().get_queryset())
 class CommentListCreateView(generics.ListCreateAPIView):
-    queryset = Comment.objects.all()
+    """
+    The top-level comments of a tweet, or with ?parent=<id> the replies to
+    a comment of it, newest first; POST comments on the tweet (or replies,
+    with `parent`).
+    """
+    serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_tweet(self):
+        if not hasattr(self, '_tweet'):
+            tweets = VisibilityService.for_request(self.request).filter_tweets(Tweet.objects.filter(pk=self.kwargs['pk']))
+            self._tweet = get_object_or_404(tweets)
+        return self._tweet
+
+    def get_queryset(self):
+        parent = self.request.query_params.get('parent')
+        if parent is not None and not parent.isdigit():
+            raise serializers.ValidationError({'parent': 'Expected a comment id.'})
+        return Comment.objects.filter(tweet=self.get_tweet(), parent_id=int(parent) if parent else None)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.request.method == 'POST':
+            context['tweet'] = self.get_tweet()
+        return context
+
+    def perform_create(self, serializer):
+        tweet = self.get_tweet()
+        parent = serializer.validated_data.get('parent')
+        with transaction.atomic():
+            serializer.save(user=self.request.user, tweet=tweet)
+            counters.adjust(tweet, 'comment_count', 1)
+            if parent is not None:
+                Comment.objects.filter(pk=parent.pk).update(reply_count=F('reply_count') + 1)
+
+
+class CommentThreadView(generics.GenericAPIView):
+    """A comment followed by all the replies under it, oldest first."""
     serializer_class = CommentSerializer
-    lookup_field = 'pk'
     permission_classes = [IsAuthenticated]
 
+    def get(self, request, *args, **kwargs):
+        root = get_object_or_404(Comment, pk=self.kwargs['pk'])
+        tweets = VisibilityService.for_request(request).filter_tweets(Tweet.objects.filter(pk=root.tweet_id))
+        if not tweets.exists():
+            raise Http404
+        # The whole subtree is one range scan of the path index
+        thread = [root] + list(comments.subtree(root))
+        return Response(self.get_serializer(thread, many=True).data)
+
 
-class UserProfileDetailView(generics.RetrieveAPIView):
+class UserProfileDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     queryset = UserProfile.objects.all()
     serializer_class = ProfileSerializer
     lookup_field = 'pk'
     permission_classes = [IsAuthenticated]
+    rendered_cache_name = 'profile'
 
-class TweetDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Tweet.objects.all()
+    def get_version(self):
+        row = UserProfile.objects.filter(pk=self.kwargs['pk']).values(
+            'user_id', 'bio', 'profile_pic', 'profile_header', 'birth_date', 'is_public', 'image_variants'
+        ).first()
+        if row is None:
+            return None
+        viewer_class = conditional.visibility_class(self.request, row['user_id'], row['is_public'])
+        return self.kwargs['pk'], viewer_class, (row, cards.get_cards([row['user_id']]).get(row['user_id']))
+
+class TweetDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = TweetSerializer
     permission_classes = [IsOwnerOrReadOnly,IsAuthenticated]
+    rendered_cache_name = 'tweet'
+
+    def get_queryset(self):
+        return VisibilityService.for_request(self.request).filter_tweets(Tweet.objects.all()).for_serializer()
+
+    def get_version(self):
+        row = Tweet.objects.filter(pk=self.kwargs['pk']).values(
+            'user_id', 'content', 'created_at', 'user__userprofile__is_public',
+            likes_total=counters.counter_expression('like_count'),
+            retweets_total=counters.counter_expression('retweet_count'),
+            comments_total=counters.counter_expression('comment_count'),
+        ).first()
+        if row is None:
+            return None
+        viewer_class = conditional.visibility_class(self.request, row['user_id'], row['user__userprofile__is_public'] is not False)
+        if viewer_class == 'hidden':
+            return None
+        return self.kwargs['pk'], viewer_class, (row, cards.get_cards([row['user_id']]).get(row['user_id']))
 
 class LikeCreateView(generics.CreateAPIView):
     queryset = Like.objects.all()
@@ -57,35 +164,34 @@ class LikeCreateView(generics.CreateAPIView):
     lookup_field = 'pk'
     permission_classes = [IsAuthenticated]
 
-    def get_tweet(self, tweet_id):
-        try:
-            return Tweet.objects.get(pk=tweet_id)
-        except Tweet.DoesNotExist:
-            return None
-
-    def perform_create(self, serializer):
-        tweet_id = self.kwargs['pk']
-        tweet = self.get_tweet(tweet_id)
-        ret = True
-        if tweet:
-            user = self.request.user
-            existing_like = tweet.like_set.filter(user=user).first()
-            if existing_like:
-                existing_like.delete()
-                ret = False
-            else:
-                like = Like(user=user, tweet=tweet)
-                like.save()
-                ret=False
-            return Response({'Liked' : ret})
-        else:
+    def create(self, request, *args, **kwargs):
+        # Toggles, or sets the state sent as {"liked": true/false}
+        wanted = request.data.get('liked') if hasattr(request.data, 'get') else None
+        if wanted is not None and not isinstance(wanted, bool):
+            raise serializers.ValidationError({'liked': 'Expected a boolean.'})
+        liked = toggles.toggle_like(request.user.id, self.kwargs['pk'], wanted)
+        if liked is None:
             return Response({'detail': 'Tweet not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'liked': liked}, status=status.HTTP_200_OK)
 
 class RetweetCreateView(generics.CreateAPIView):
     queryset = Retweet.objects.all()
     serializer_class = RetweetSerializer
     permission_classes = [IsAuthenticated]
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        tweet = serializer.validated_data['tweet']
+        # Retweeting twice is not an error, the second time changes nothing
+        created = toggles.retweets.set(request.user.id, tweet.pk, True)
+        if created is None:
+            return Response({'detail': 'Tweet not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(
+            {'tweet': tweet.pk, 'retweeted': True},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
 class FollowListCreateView(generics.ListCreateAPIView):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
@@ -118,119 +224,97 @@ class FollowListCreateView(generics.ListCreateAPIView):
     
 
 
-class UserTweetsListView(generics.ListAPIView):
+class UserTweetsListView(LeanTweetListMixin, ReplicaReadMixin, ConditionalGetMixin, generics.ListAPIView):
     serializer_class = TweetSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
+    rendered_cache_name = 'user_tweets'
 
     def get_queryset(self):
         user = self.kwargs['user']
-        return Tweet.objects.filter(user=user)
+        tweets = Tweet.objects.filter(user=user)
+        return VisibilityService.for_request(self.request).filter_tweets(tweets).for_serializer()
 
-class FollowingTweetsListView(generics.ListAPIView):
+    def get_version(self):
+        user = self.kwargs['user']
+        is_public = UserProfile.objects.filter(user_id=user).values_list('is_public', flat=True).first()
+        # The rows of the page the list would render, without joins or comments
+        tweets = VisibilityService.for_request(self.request).filter_tweets(Tweet.objects.filter(user=user)).values_list(
+            'id', 'content', 'created_at',
+            counters.counter_expression('like_count'),
+            counters.counter_expression('retweet_count'),
+            counters.counter_expression('comment_count'),
+        )
+        page = list(self.pagination_class().page_queryset(tweets, self.request))
+        viewer_class = conditional.visibility_class(self.request, user, is_public is not False)
+        return user, viewer_class, (page, cards.get_cards([user]).get(user))
+
+class FollowingTweetsListView(LeanTweetListMixin, ReplicaReadMixin, generics.ListAPIView):
     serializer_class = TweetSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        following_users = [follow.following for follow in Follow.objects.filter(follower=user)]
-        return (Tweet.objects.filter(user__in=following_users)) | (Tweet.objects.filter(user=user))
+        tweets = timeline.home_timeline_queryset(self.request.user)
+        return VisibilityService.for_request(self.request).filter_tweets(tweets).for_serializer()
 
-class RecommendedTweetsListView(generics.ListAPIView):
+class RecommendedTweetsListView(LeanTweetListMixin, ReplicaReadMixin, generics.ListAPIView):
     serializer_class = TweetSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         # Get the user making the request
         user = self.request.user
 
-        # Get liked tweet content for the user
-        user_liked_tweets = Like.objects.filter(user=user).values_list('tweet__content', flat=True)
-
-        if not user_liked_tweets:
-            # Handle the case where the user has no liked tweets
-            return Tweet.objects.none()
-
-        # Get liked tweet content for all other users
-        all_users_liked_tweets = [
-            Like.objects.filter(user=u).values_list('tweet__content', flat=True) for u in User.objects.exclude(id=user.id)
-        ]
-
-        # Filter out empty liked tweet content
-        all_users_liked_tweets = [tweets for tweets in all_users_liked_tweets if tweets]
-
-        if not all_users_liked_tweets:
-            # Handle the case where there are no liked tweets from other users
-            return Tweet.objects.none()
-
-        # Create a TF-IDF vectorizer
-        vectorizer = TfidfVectorizer()
-
-        try:
-            # Fit and transform the vectorizer on the user's and other users' tweet content
-            user_vector = vectorizer.fit_transform(user_liked_tweets)
-            all_users_vectors = [vectorizer.transform(u_liked_tweets) for u_liked_tweets in all_users_liked_tweets]
-        except ValueError as e:
-            # Handle the case where TF-IDF vectorization fails
-            print("TF-IDF Vectorization Error:", e)
-            return Tweet.objects.none()
-
-        # Calculate cosine similarity between the user and all other users
-        similarities = [cosine_similarity(user_vector, u_vector)[0][0] for u_vector in all_users_vectors]
-
-        # Sort users based on similarity in descending order
-        similar_users = sorted(zip(User.objects.exclude(id=user.id), similarities), key=lambda x: x[1], reverse=True)
+        # Look up the most similar user in the offline similarity index
+        similar_ids = recommendations.similar_user_ids(user, limit=1)
 
-        if not similar_users:
-            # Handle the case where there are no similar users
+        if not similar_ids:
+            # Handle the case where the user has no liked tweets or no similar users
             return Tweet.objects.none()
 
         # Get recommended tweets from the most similar user
-        most_similar_user, _ = similar_users[0]
-        recommended_tweets = Tweet.objects.filter(like__user=most_similar_user)
-        # following_users = [follow.following for follow in Follow.objects.filter(follower=user)]
-        following_users = [follow.following for follow in Follow.objects.filter(follower=user)]
-        return recommended_tweets | (Tweet.objects.filter(user__in=following_users)) | (Tweet.objects.filter(user=user))
+        recommended_tweets = Tweet.objects.filter(id__in=Like.objects.filter(user_id=similar_ids[0]).values('tweet_id'))
+        follow_graph = graph.get_graph()
+        if follow_graph is not None:
+            following_users = follow_graph.followees(user.id).tolist()
+        else:
+            # The process' graph is still being built
+            following_users = Follow.objects.filter(follower=user, is_accepted=True).values('following_id')
+        tweets = recommended_tweets | (Tweet.objects.filter(user__in=following_users)) | (Tweet.objects.filter(user=user))
+        return VisibilityService.for_request(self.request).filter_tweets(tweets).for_serializer()
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     permission_classes = [AllowAny]  # Allow any user to access the login view
-
-    def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-        refresh = RefreshToken.for_user(response.data['user'])
-        response.data['refresh'] = str(refresh)
-        response.data['access'] = str(refresh.access_token)
-        return response
-
-
+    throttle_classes = [LoginRateThrottle, LoginAccountRateThrottle]
+    serializer_class = ClaimsTokenObtainPairSerializer
 
 
-def find_similar_users(user):
-    # Get the list of users who have interacted with tweets
-    users = User.objects.exclude(id=user.id)
-
-    # Get the liked tweet content for the given user
-    user_liked_tweets = Like.objects.filter(user=user).values_list('tweet__content', flat=True)
-
-    # Get liked tweet content for all other users
-    all_users_liked_tweets = [
-        Like.objects.filter(user=u).values_list('tweet__content', flat=True) for u in users
-    ]
+class CustomTokenRefreshView(TokenRefreshView):
+    permission_classes = [AllowAny]
+    serializer_class = RevocableTokenRefreshSerializer
 
-    # Create a TF-IDF vectorizer
-    vectorizer = TfidfVectorizer()
 
-    # Fit and transform the vectorizer on the user's and other users' tweet content
-    user_vector = vectorizer.fit_transform(user_liked_tweets)
-    all_users_vectors = [vectorizer.transform(u_liked_tweets) for u_liked_tweets in all_users_liked_tweets]
+class TokenRevokeView(APIView):
+    """Revoke the bearer token of the request, and the refresh token posted."""
+    permission_classes = [IsAuthenticated]
 
-    # Calculate cosine similarity between the user and all other users
-    similarities = [cosine_similarity(user_vector, u_vector)[0][0] for u_vector in all_users_vectors]
+    def post(self, request):
+        serializer = TokenRevokeSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        if isinstance(request.auth, Token):
+            tokens.revoke(request.auth)
+        if 'refresh' in serializer.validated_data:
+            tokens.revoke(serializer.validated_data['refresh'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-    # Sort users based on similarity in descending order
-    similar_users = sorted(zip(users, similarities), key=lambda x: x[1], reverse=True)
 
-    # Return a list of similar users
-    return [user for user, _ in similar_users]
+def find_similar_users(user):
+    # Return the users most similar to the given user, most similar first
+    similar_ids = recommendations.similar_user_ids(user)
+    users = User.objects.in_bulk(similar_ids)
+    return [users[user_id] for user_id in similar_ids if user_id in users]
 
 # tweets/views.py
 
@@ -255,6 +339,43 @@ class CustomPageNumberPagination(pagination.PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class SearchView(LeanTweetListMixin, generics.ListAPIView):
+    serializer_class = TweetSerializer
+    pagination_class = CustomPageNumberPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_datetime_param(self, name):
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise serializers.ValidationError({name: 'Expected an ISO 8601 date and time.'})
+        if settings.USE_TZ and timezone.is_naive(parsed):
+            # Without an offset, in the current time zone like form input
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def get_queryset(self):
+        terms = search.parse_query(self.request.query_params.get('q'))
+        if not terms:
+            return Tweet.objects.none()
+        author = self.request.query_params.get('author')
+        if author is not None and not author.isdigit():
+            raise serializers.ValidationError({'author': 'Expected a user id.'})
+        ranked = search.get_search_backend().search(
+            terms,
+            author_id=int(author) if author is not None else None,
+            since=self.get_datetime_param('since'),
+            until=self.get_datetime_param('until'),
+        )
+        if not ranked:
+            return Tweet.objects.none()
+        # Keep the backend's ranking, best match first
+        rank = Case(*[When(id=tweet_id, then=position) for position, (tweet_id, _) in enumerate(ranked)])
+        tweets = Tweet.objects.filter(id__in=[tweet_id for tweet_id, _ in ranked])
+        return VisibilityService.for_request(self.request).filter_tweets(tweets).for_serializer().order_by(rank)
+
 class FollowRequestListView(generics.ListAPIView):
     serializer_class = FollowRequestListSerializer
     permission_classes = [IsAuthenticated]
@@ -262,7 +383,7 @@ class FollowRequestListView(generics.ListAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        follow_requests = Follow.objects.filter(following=user, is_accepted=False)
+        follow_requests = Follow.objects.filter(following=user, is_accepted=False).order_by('-created_at')
         return follow_requests
     
 class AcceptFollowRequestView(generics.UpdateAPIView):
@@ -285,3 +406,64 @@ class DenyFollowRequestView(generics.DestroyAPIView):
         instance = self.get_object()
         instance.delete()
         return Response({'detail': 'Follow request denied successfully.'}, status=status.HTTP_204_NO_CONTENT)
+
+class BulkFollowRequestView(generics.GenericAPIView):
+    """
+    Accept or deny many pending requests in one call. Only requests made to
+    the authenticated user are selected, the guarantee IsFollowOwnerOrReadOnly
+    gives the single-request views; ids that are not among them are ignored.
+    """
+    serializer_class = BulkFollowRequestSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        pending = Follow.objects.filter(following=request.user, is_accepted=False)
+        if 'ids' in data:
+            pending = pending.filter(id__in=data['ids'])
+        else:
+            pending = pending.filter(created_at__lt=data['before'])
+
+        with transaction.atomic():
+            rows = list(pending.select_for_update().values_list('id', 'follower_id'))
+            ids = [follow_id for follow_id, _ in rows]
+            follower_ids = [follower_id for _, follower_id in rows]
+            # Neither update() nor _raw_delete() sends signals (delete() would
+            # send post_delete per row), the side effects follow in bulk
+            if data['action'] == 'accept':
+                accepted = True
+                Follow.objects.filter(id__in=ids).update(is_accepted=True)
+                transaction.on_commit(lambda: timeline.backfill_followers(follower_ids, request.user.id))
+                # Dropped once committed, a read before that would cache the old set again
+                transaction.on_commit(lambda: visibility.invalidate(follower_ids))
+            else:
+                # Pending requests never changed what the followers can see
+                accepted = None
+                Follow.objects.filter(id__in=ids)._raw_delete(router.db_for_write(Follow))
+            SuggestionState.objects.filter(user_id__in=follower_ids, stale=False).update(stale=True)
+
+            def update_graph():
+                for follower_id in follower_ids:
+                    graph.edge_changed(follower_id, request.user.id, accepted)
+            transaction.on_commit(update_graph)
+        key = 'accepted' if data['action'] == 'accept' else 'denied'
+        return Response({key: ids}, status=status.HTTP_200_OK)
+
+class SuggestionsView(generics.ListAPIView):
+    """Accounts to follow, best first, see tweets/suggestions.py."""
+    serializer_class = FollowSuggestionSerializer
+    pagination_class = None
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        suggestions.suggested_user_ids(user)
+        return (
+            FollowSuggestion.objects.filter(user=user)
+            # Followed or requested from another process since computed
+            .exclude(suggested_user__in=Follow.objects.filter(follower=user).values('following_id'))
+            .select_related('suggested_user')
+            .order_by('-score')
+        )
@@ -0,0 +1,99 @@
+"""
+Who can see whose tweets.
+
+A tweet is visible to a viewer when its author is public, is the viewer, or
+is a private account the viewer follows with an accepted request. The last
+set is the only per-viewer state; it is memoized per request and cached
+across requests for VISIBILITY_CACHE_TTL seconds, in the cache every process
+shares (CACHES in settings.py). The signal handlers in tweets/signals.py
+invalidate it once a follow change, or a followed account switching between
+public and private, is committed. The sets are read from the primary: one
+read from a lagging replica would be cached again after the invalidation.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Q
+
+from .models import Follow
+
+CACHE_KEY = 'visibility:private-followees:%s'
+
+
+def cache_ttl():
+    return getattr(settings, 'VISIBILITY_CACHE_TTL', 300)
+
+
+def follows():
+    # Read from the primary, whatever database the request reads from
+    return Follow.objects.db_manager(router.db_for_write(Follow))
+
+
+def private_followee_ids(user_id):
+    """Ids of the private accounts `user_id` follows with an accepted request."""
+    key = CACHE_KEY % user_id
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(
+            follows().filter(
+                follower_id=user_id, is_accepted=True, following__userprofile__is_public=False
+            ).values_list('following_id', flat=True)
+        )
+        cache.set(key, ids, cache_ttl())
+    return ids
+
+
+def invalidate(user_ids):
+    """Forget the cached followee sets of the given viewers."""
+    cache.delete_many([CACHE_KEY % user_id for user_id in user_ids])
+
+
+def invalidate_followers_of(user_id):
+    """A user changed between public and private: their followers' sets change."""
+    invalidate(follows().filter(following_id=user_id, is_accepted=True).values_list('follower_id', flat=True))
+
+
+class VisibilityService:
+    """Visibility checks for one viewer, with the followee set loaded once."""
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self._private_followee_ids = None
+
+    @classmethod
+    def for_request(cls, request):
+        service = getattr(request, '_visibility_service', None)
+        if service is None or service.viewer != request.user:
+            service = cls(request.user)
+            request._visibility_service = service
+        return service
+
+    @property
+    def private_followee_ids(self):
+        if self._private_followee_ids is None:
+            if self.viewer.is_authenticated:
+                self._private_followee_ids = private_followee_ids(self.viewer.pk)
+            else:
+                self._private_followee_ids = frozenset()
+        return self._private_followee_ids
+
+    def can_see_user(self, user):
+        if user.pk == self.viewer.pk:
+            return True
+        profile = getattr(user, 'userprofile', None)
+        return (profile is not None and profile.is_public) or user.pk in self.private_followee_ids
+
+    def can_see(self, tweet):
+        return self.can_see_user(tweet.user)
+
+    def tweets_q(self, prefix=''):
+        """Q object selecting the tweets the viewer may see, relative to `prefix`."""
+        q = Q(**{prefix + 'user__userprofile__is_public': True})
+        if self.viewer.is_authenticated:
+            q |= Q(**{prefix + 'user_id': self.viewer.pk})
+        if self.private_followee_ids:
+            q |= Q(**{prefix + 'user_id__in': self.private_followee_ids})
+        return q
+
+    def filter_tweets(self, queryset):
+        return queryset.filter(self.tweets_q())
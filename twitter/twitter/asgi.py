@@ -2,6 +2,8 @@
 ASGI config for twitter project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the async endpoints, and the /api/stream/ Server-Sent Events stream in
+particular, from here.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
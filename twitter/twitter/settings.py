@@ -46,6 +46,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'tweets.compression.CompressionMiddleware',
+    'tweets.profiling.ProfilingMiddleware',
+    'tweets.db_routing.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,12 +81,98 @@ WSGI_APPLICATION = 'twitter.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# Configured from the environment. DB_ENGINE=postgresql selects Postgres with
+# DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT. Connections are kept
+# for DB_CONN_MAX_AGE seconds, or with DB_POOL=1 taken from a psycopg pool
+# of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE connections per process (needs
+# psycopg[pool]). DB_REPLICA_HOSTS is a comma separated list of read
+# replicas, used as the 'replica1', 'replica2', ... databases by the router in
+# tweets/db_routing.py. Otherwise the SQLite file DB_NAME (db.sqlite3 by
+# default) is used.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE in ('postgresql', 'postgres'):
+    DB_POOL = os.environ.get('DB_POOL') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'twitter'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            # A pooled connection goes back to the pool at the end of each
+            # request, which needs CONN_MAX_AGE 0
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            # Persistent connections are checked before a request reuses them
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                    'timeout': 10,
+                },
+            } if DB_POOL else {},
+        }
+    }
+    for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES['replica%d' % number] = dict(DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # In WAL mode readers neither block the writer nor wait for
+                # it. Writers wait up to `timeout` seconds for the lock, and
+                # take it when their transaction begins: a deferred
+                # transaction upgrading to a write lock fails at once when
+                # another writer holds it, however long the timeout.
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+DATABASE_ROUTERS = ['tweets.db_routing.ReplicaRouter']
+# Aliases the read-only list views read from, see tweets/db_routing.py
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+#
+# Every process must share it: entries (visibility sets, user cards, comment
+# previews, throttles, login misses) are invalidated by the process handling
+# the change and read by all the others. CACHE_REDIS_URL selects Redis (needs
+# the redis package). With Postgres it otherwise lives in the django_cache
+# table, made by `manage.py createcachetable`. The local-memory cache of the
+# SQLite setup is per process, only fit for a single development server.
+
+if os.environ.get('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_REDIS_URL'],
+        }
+    }
+elif DB_ENGINE in ('postgresql', 'postgres'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
 
 
 # Password validation
@@ -132,7 +221,159 @@ AUTHENTICATION_BACKENDS = ['tweets.authentication.EmailOrUsernameModelBackend']
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Render and parse JSON with orjson (stdlib json when it is not installed),
+# see tweets/renderers.py. Off: DRF's JSONRenderer and JSONParser.
+ORJSON_RENDERER = False
+
 REST_FRAMEWORK = {
+    # Session first: without a session cookie it costs no query, and
+    # unauthenticated requests keep being answered 403
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'tweets.tokens.ClaimsJWTAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'tweets.renderers.ORJSONRenderer' if ORJSON_RENDERER else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'tweets.renderers.ORJSONParser' if ORJSON_RENDERER else 'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
-}
\ No newline at end of file
+    'PAGE_SIZE': 10,
+    # Login attempts, see tweets/throttles.py
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '30/min',
+        'login_account': '10/min',
+    },
+}
+
+# Home timelines, see tweets/timeline.py
+TIMELINE_BACKEND = 'tweets.timeline.DatabaseTimelineBackend'
+TIMELINE_MAX_LENGTH = 800
+# Pushes trim the recipients' timelines back to TIMELINE_MAX_LENGTH for one
+# tweet in this many
+TIMELINE_TRIM_EVERY = 50
+# Authors with more accepted followers than this are merged into feeds at
+# read time instead of being pushed into every follower's timeline
+TIMELINE_CELEBRITY_THRESHOLD = 10000
+
+# User-similarity index, see tweets/recommendations.py
+RECOMMENDATIONS_TOP_K = 20
+# Index rows older than this (seconds) are refreshed in the background on
+# request, by this many threads per process; 0 refreshes before responding
+RECOMMENDATIONS_INDEX_MAX_AGE = 24 * 60 * 60
+RECOMMENDATIONS_WORKERS = 1
+# File the build_similarity_index command writes the fitted model to, for
+# every process to refresh users against. None keeps it in the building
+# process only.
+RECOMMENDATIONS_MODEL = None
+
+# Tweet counters, see tweets/counters.py. With TWEET_COUNTER_SHARDS > 0,
+# tweets whose counter reaches the threshold are updated through that many
+# shard rows instead of the tweet row.
+TWEET_COUNTER_SHARDS = 0
+TWEET_COUNTER_HOT_THRESHOLD = 10000
+
+# Seconds a viewer's accepted private-followee set stays cached, see
+# tweets/visibility.py. Follow and profile signals invalidate it earlier.
+VISIBILITY_CACHE_TTL = 300
+
+# Real-time timeline stream, see tweets/realtime.py
+REALTIME_BROKER = 'tweets.realtime.InProcessBroker'
+# Unsent tweet ids / counter-updated tweets kept per connection before the
+# client is asked to resync
+REALTIME_MAX_PENDING = 100
+REALTIME_COALESCE_MS = 250
+REALTIME_HEARTBEAT_SECONDS = 15
+
+# Full-text search, see tweets/search.py. None picks the backend matching the
+# database (SQLite FTS5, Postgres full-text, else an in-process index).
+SEARCH_BACKEND = None
+SEARCH_MAX_CANDIDATES = 1000
+
+# Cached user cards, see tweets/cards.py
+USER_CARD_CACHE_TTL = 60 * 60
+USER_CARD_LOCAL_SIZE = 1024
+USER_CARD_LOCAL_TTL = 30
+
+# Request profiling, see tweets/profiling.py. Aggregates are served to staff
+# at /api/metrics/ (JSON, or ?format=prometheus).
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 1.0
+# Same SQL issued this many times in one request is reported with its stack
+PROFILING_DUPLICATE_THRESHOLD = 5
+
+# Follow graph index, see tweets/graph.py. Processes memory-map the snapshot
+# written by the follow_graph_snapshot command at startup, if there is one,
+# and rebuild the index from the database once it is older than MAX_AGE,
+# on a background thread unless BACKGROUND_REBUILD is False.
+FOLLOW_GRAPH_SNAPSHOT = None
+FOLLOW_GRAPH_MAX_AGE = 300
+FOLLOW_GRAPH_BACKGROUND_REBUILD = True
+
+# "Who to follow" suggestions, see tweets/suggestions.py
+SUGGESTIONS_TOP_K = 20
+# Weight of log(1 + shared likes) against weighted friends-of-friends counts
+SUGGESTIONS_LIKE_WEIGHT = 0.5
+# Suggestions older than this (seconds) are recomputed once requested, on
+# SUGGESTIONS_WORKERS background threads (0 computes them on the request)
+SUGGESTIONS_MAX_AGE = 24 * 60 * 60
+SUGGESTIONS_WORKERS = 1
+# Like overlap of a single user's recompute: their latest liked tweets, and
+# the latest likes of each
+SUGGESTIONS_LIKED_TWEETS = 200
+SUGGESTIONS_LIKES_PER_TWEET = 100
+
+# Milliseconds likes are buffered in-process before being written in bulk,
+# see tweets/toggles.py. 0 writes every like before responding.
+LIKE_BUFFER_MS = 0
+
+# Threads making the resized variants of uploaded profile images, see
+# tweets/images.py. 0 makes them before the upload's response instead.
+IMAGE_WORKERS = 2
+
+# Seconds rendered tweet and profile responses are cached for reuse while
+# their ETag still matches, see tweets/conditional.py. 0 only validates.
+RENDERED_CACHE_TTL = 300
+
+# Seconds a user's reads stay on the primary database after they wrote,
+# covering the replication lag, see tweets/db_routing.py
+REPLICA_STICKY_SECONDS = 10
+
+# Import scikit-learn when the app starts instead of on the first
+# recommendation build, see tweets/recommendations.py
+RECOMMENDATIONS_WARM_UP = False
+
+# Budget of django.setup() plus the URLconf import, checked by the
+# benchmark_startup command
+STARTUP_BUDGET_SECONDS = 1.5
+STARTUP_BUDGET_RSS_MB = 100
+
+# Seconds a login identifier that matched no user is remembered, skipping
+# its lookup, see tweets/authentication.py. 0 looks it up every time.
+LOGIN_MISS_CACHE_SECONDS = 60
+
+# Revoked JWTs, see tweets/revocation.py. Each process syncs its Bloom
+# filter of them every SYNC_SECONDS and rebuilds it every REBUILD_SECONDS.
+REVOCATION_SYNC_SECONDS = 30
+REVOCATION_REBUILD_SECONDS = 60 * 60
+REVOCATION_BLOOM_CAPACITY = 100000
+REVOCATION_BLOOM_ERROR_RATE = 0.001
+
+# Render tweet list pages from .values() rows instead of TweetSerializer's
+# fields, see LeanTweetListMixin in tweets/views.py
+LEAN_TWEET_SERIALIZATION = False
+
+# Response compression, see tweets/compression.py. Brotli needs the brotli
+# package, gzip is used otherwise.
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+
+# Seconds the latest-comments preview of a tweet stays cached, see
+# tweets/comments.py. New comments replace it right away.
+COMMENT_PREVIEW_CACHE_TTL = 60 * 60